@@ -1,14 +1,28 @@
 -- Clean up
+DROP TABLE IF EXISTS job CASCADE;
 DROP TABLE IF EXISTS payment CASCADE;
+DROP TABLE IF EXISTS member_balance CASCADE;
+DROP TABLE IF EXISTS billing_rate CASCADE;
 DROP TABLE IF EXISTS invoice CASCADE;
 DROP TABLE IF EXISTS equipment CASCADE;
 DROP TABLE IF EXISTS rooms CASCADE;
 DROP TABLE IF EXISTS session_members CASCADE;
 DROP TABLE IF EXISTS training_sessions CASCADE;
+DROP TABLE IF EXISTS class_schedule CASCADE;
+DROP TABLE IF EXISTS health_metric_daily CASCADE;
 DROP TABLE IF EXISTS health_metric CASCADE;
 DROP TABLE IF EXISTS fitness_goal CASCADE;
 DROP TABLE IF EXISTS trainer CASCADE;
 DROP TABLE IF EXISTS member CASCADE;
+DROP TYPE IF EXISTS timerange CASCADE;
+
+-- btree_gist lets exclusion constraints mix "=" on ids with "&&" on ranges
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+-- pg_trgm indexes member names for fuzzy search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Postgres has no built-in range over TIME
+CREATE TYPE timerange AS RANGE (subtype = time);
 
 CREATE TABLE member (
   member_id    SERIAL PRIMARY KEY,
@@ -34,20 +48,68 @@ CREATE TABLE fitness_goal (
   target_date          DATE
 );
 
+-- Range-partitioned by month on date. Monthly partitions are created ahead
+-- of time by ensure_health_metric_partitions() (python -m app.maintenance);
+-- a reading outside every month waits in health_metric_default until its
+-- month is created.
 CREATE TABLE health_metric (
-  metric_id           SERIAL PRIMARY KEY,
+  metric_id           SERIAL,
   member_id           INTEGER NOT NULL REFERENCES member(member_id) ON DELETE CASCADE,
   height              NUMERIC(5,2),
   weight              NUMERIC(5,2),
   heart_rate          INTEGER,
-  date                TIMESTAMP NOT NULL DEFAULT NOW()
+  date                TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (metric_id, date)
+) PARTITION BY RANGE (date);
+
+CREATE TABLE health_metric_default PARTITION OF health_metric DEFAULT;
+
+-- One row per member per day of readings, maintained by the health_metric
+-- triggers, so trends never scan the raw history. Sums and counts (not
+-- averages) are kept so days roll up into weeks and months exactly.
+CREATE TABLE health_metric_daily (
+  member_id         INTEGER NOT NULL REFERENCES member(member_id) ON DELETE CASCADE,
+  day               DATE NOT NULL,
+  readings          INTEGER NOT NULL,
+  weight_count      INTEGER NOT NULL,
+  weight_sum        NUMERIC(12,2) NOT NULL,
+  weight_min        NUMERIC(5,2),
+  weight_max        NUMERIC(5,2),
+  heart_rate_count  INTEGER NOT NULL,
+  heart_rate_sum    BIGINT NOT NULL,
+  heart_rate_min    INTEGER,
+  heart_rate_max    INTEGER,
+  PRIMARY KEY (member_id, day)
 );
 
 CREATE TABLE rooms (
   room_id    SERIAL PRIMARY KEY,
   room_name  VARCHAR(20) NOT NULL,
   capacity INTEGER NOT NULL,
-  isBooked BOOLEAN NOT NULL DEFAULT FALSE
+  -- Equipment in the room with status 2, kept by the equipment trigger
+  out_of_order_equipment INTEGER NOT NULL DEFAULT 0
+);
+
+-- A recurring class: every listed weekday (ISO, 1 = Monday) from
+-- valid_from to valid_until (open-ended when NULL). Occurrences are never
+-- stored up front; class_occurrences() expands the rule for whatever window
+-- is asked about, and class_session() turns one occurrence into a
+-- training_sessions row the first time somebody joins it.
+CREATE TABLE class_schedule (
+  schedule_id   SERIAL PRIMARY KEY,
+  trainer_id    INTEGER NOT NULL REFERENCES trainer(trainer_id),
+  room_id       INTEGER NOT NULL REFERENCES rooms(room_id),
+  weekdays      SMALLINT[] NOT NULL,
+  start_time    TIME NOT NULL,
+  end_time      TIME NOT NULL,
+  capacity      INTEGER NOT NULL,
+  valid_from    DATE NOT NULL DEFAULT CURRENT_DATE,
+  valid_until   DATE,
+  status        VARCHAR(20) NOT NULL DEFAULT 'active',
+  CHECK (end_time > start_time),
+  CHECK (valid_until IS NULL OR valid_until >= valid_from),
+  CHECK (cardinality(weekdays) > 0 AND weekdays <@ '{1,2,3,4,5,6,7}'::smallint[]),
+  CHECK (status IN ('active', 'cancelled'))
 );
 
 CREATE TABLE training_sessions (
@@ -55,19 +117,38 @@ CREATE TABLE training_sessions (
   trainer_id    INTEGER NOT NULL REFERENCES trainer(trainer_id),
   room_id       INTEGER REFERENCES rooms(room_id),
   session_type  VARCHAR(10) NOT NULL,
+  session_date  DATE NOT NULL DEFAULT CURRENT_DATE,
   start_time    TIME NOT NULL,
   end_time      TIME NOT NULL,
   status        VARCHAR(20) NOT NULL DEFAULT 'active',
   capacity      INTEGER NOT NULL,
+  -- Seats taken, kept by the session_members triggers; never COUNT(*)ed
+  enrolled      INTEGER NOT NULL DEFAULT 0,
+  -- Set when this row is one occurrence of a recurring class
+  schedule_id   INTEGER REFERENCES class_schedule(schedule_id),
   CHECK (end_time > start_time),
+  CHECK (enrolled >= 0 AND enrolled <= capacity),
   CHECK (status IN ('cancelled' , 'active' , 'completed', 'full')),
-  CHECK (session_type IN ('group' , 'personal'))
+  CHECK (session_type IN ('group' , 'personal')),
+  UNIQUE (schedule_id, session_date),
+  -- A trainer can't run two live sessions at once, enforced by the database
+  CONSTRAINT training_sessions_no_trainer_overlap EXCLUDE USING gist (
+    trainer_id WITH =,
+    tsrange(session_date + start_time, session_date + end_time) WITH &&
+  ) WHERE (status IN ('active', 'full')),
+  -- Same for rooms. The GiST index behind this constraint is also the
+  -- per-room interval index free_rooms() probes.
+  CONSTRAINT training_sessions_no_room_overlap EXCLUDE USING gist (
+    room_id WITH =,
+    tsrange(session_date + start_time, session_date + end_time) WITH &&
+  ) WHERE (status IN ('active', 'full'))
 );
 
 CREATE TABLE session_members (
   session_member_id  SERIAL PRIMARY KEY,
   session_id  INTEGER NOT NULL REFERENCES training_sessions(session_id),
-  member_id  INTEGER NOT NULL REFERENCES member(member_id)
+  member_id  INTEGER NOT NULL REFERENCES member(member_id),
+  UNIQUE (session_id, member_id)
 );
 
 
@@ -75,7 +156,12 @@ CREATE TABLE equipment (
   equipment_id    SERIAL PRIMARY KEY,
   room_id         INTEGER NOT NULL REFERENCES rooms(room_id) ON DELETE CASCADE,
   type            VARCHAR(20) NOT NULL,
-  status          INTEGER NOT NULL
+  -- 0 = operational, 1 = needs maintenance, 2 = out of order
+  status          INTEGER NOT NULL,
+  -- When the current issue was logged and what it is; NULL while operational
+  issue_since     TIMESTAMPTZ,
+  issue_note      VARCHAR(200),
+  CHECK (status IN (0, 1, 2))
 );
 
 
@@ -84,10 +170,38 @@ CREATE TABLE invoice (
   member_id    INTEGER NOT NULL REFERENCES member(member_id) ON DELETE CASCADE,
   issue_date   DATE NOT NULL DEFAULT CURRENT_DATE,
   total_amount NUMERIC(10,2) NOT NULL CHECK (total_amount >= 0),
+  -- Kept up to date by the payment trigger, never summed on read
+  amount_paid  NUMERIC(10,2) NOT NULL DEFAULT 0,
+  remaining    NUMERIC(10,2) GENERATED ALWAYS AS (total_amount - amount_paid) STORED,
   status       VARCHAR(20) NOT NULL DEFAULT 'unpaid',
-  CHECK (status IN ('unpaid','paid','cancelled'))
+  -- First day of the month a billing run invoiced; NULL for manual invoices
+  billing_period DATE,
+  CHECK (status IN ('unpaid','paid','cancelled')),
+  CHECK (amount_paid >= 0 AND amount_paid <= total_amount),
+  -- A rerun of a billing chunk can't bill a member twice for one month;
+  -- also the index for looking up a member's invoices
+  UNIQUE (member_id, billing_period)
 );
 
+-- Outstanding balance per member (remaining on non-cancelled invoices),
+-- maintained by the invoice trigger
+CREATE TABLE member_balance (
+  member_id    INTEGER PRIMARY KEY REFERENCES member(member_id) ON DELETE CASCADE,
+  outstanding  NUMERIC(12,2) NOT NULL DEFAULT 0
+);
+
+
+-- Price of one session per session type, read by the monthly billing run
+CREATE TABLE billing_rate (
+  session_type VARCHAR(10) PRIMARY KEY,
+  rate         NUMERIC(10,2) NOT NULL CHECK (rate >= 0),
+  CHECK (session_type IN ('group' , 'personal'))
+);
+
+INSERT INTO billing_rate (session_type, rate) VALUES
+('personal', 60.00),
+('group', 15.00);
+
 
 CREATE TABLE payment (
   payment_id   SERIAL PRIMARY KEY,
@@ -97,6 +211,27 @@ CREATE TABLE payment (
   method       VARCHAR(20) NOT NULL
 );
 
+-- Background work for app.worker. Workers claim queued jobs whose run_at
+-- has come with FOR UPDATE SKIP LOCKED; failed jobs go back to queued with
+-- a later run_at until max_attempts, then stay as dead for an admin.
+CREATE TABLE job (
+  job_id        BIGSERIAL PRIMARY KEY,
+  kind          VARCHAR(40) NOT NULL,
+  payload       JSONB NOT NULL DEFAULT '{}',
+  status        VARCHAR(10) NOT NULL DEFAULT 'queued',
+  attempts      INTEGER NOT NULL DEFAULT 0,
+  max_attempts  INTEGER NOT NULL DEFAULT 5,
+  run_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_by     VARCHAR(60),
+  locked_at     TIMESTAMPTZ,
+  last_error    TEXT,
+  result        JSONB,
+  created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at   TIMESTAMPTZ,
+  CHECK (status IN ('queued', 'running', 'done', 'dead')),
+  CHECK (max_attempts > 0)
+);
+
 -- Views
 CREATE OR REPLACE VIEW member_invoice_summary AS
 SELECT
@@ -104,67 +239,1041 @@ SELECT
   i.member_id,
   i.issue_date,
   i.total_amount,
-  COALESCE(SUM(p.amount), 0)              AS total_paid,
-  i.total_amount - COALESCE(SUM(p.amount), 0) AS remaining,
+  i.amount_paid AS total_paid,
+  i.remaining,
   i.status
-FROM invoice i
-LEFT JOIN payment p
-  ON i.invoice_id = p.invoice_id
-GROUP BY
-  i.invoice_id, i.member_id, i.issue_date, i.total_amount, i.status;
+FROM invoice i;
+
+-- Equipment with an open issue, longest-standing first
+CREATE OR REPLACE VIEW maintenance_queue AS
+SELECT
+  e.equipment_id,
+  e.room_id,
+  r.room_name,
+  e.type,
+  e.status,
+  e.issue_since,
+  e.issue_note
+FROM equipment e
+JOIN rooms r
+  ON r.room_id = e.room_id
+WHERE e.status <> 0
+ORDER BY e.issue_since, e.equipment_id;
 
 -- Trigger
+CREATE OR REPLACE FUNCTION invoice_status_for(
+  current_status VARCHAR,
+  amount_paid    NUMERIC,
+  total_amount   NUMERIC
+)
+RETURNS VARCHAR AS $$
+  SELECT CASE
+           WHEN current_status = 'cancelled' THEN current_status
+           WHEN amount_paid >= total_amount THEN 'paid'
+           ELSE 'unpaid'
+         END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Applies payment inserts/updates/deletes to invoice.amount_paid and keeps
+-- the status in step. Statement-level over transition tables, so a batch of
+-- thousands of payments updates each touched invoice once, set-wise.
+-- Overpayment is rejected by the invoice CHECK.
 CREATE OR REPLACE FUNCTION update_invoice_status_after_payment()
 RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE invoice i
+    SET amount_paid = i.amount_paid + d.delta,
+        status = invoice_status_for(i.status, i.amount_paid + d.delta, i.total_amount)
+    FROM (
+      SELECT invoice_id, SUM(amount) AS delta
+      FROM new_payments
+      GROUP BY invoice_id
+    ) d
+    WHERE i.invoice_id = d.invoice_id;
+
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE invoice i
+    SET amount_paid = i.amount_paid - d.delta,
+        status = invoice_status_for(i.status, i.amount_paid - d.delta, i.total_amount)
+    FROM (
+      SELECT invoice_id, SUM(amount) AS delta
+      FROM old_payments
+      GROUP BY invoice_id
+    ) d
+    WHERE i.invoice_id = d.invoice_id;
+
+  ELSE
+    UPDATE invoice i
+    SET amount_paid = i.amount_paid + d.delta,
+        status = invoice_status_for(i.status, i.amount_paid + d.delta, i.total_amount)
+    FROM (
+      SELECT invoice_id, SUM(amount) AS delta
+      FROM (
+        SELECT invoice_id, amount FROM new_payments
+        UNION ALL
+        SELECT invoice_id, -amount FROM old_payments
+      ) changes
+      GROUP BY invoice_id
+      HAVING SUM(amount) <> 0
+    ) d
+    WHERE i.invoice_id = d.invoice_id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+CREATE TRIGGER payment_insert_update_invoice
+AFTER INSERT ON payment
+REFERENCING NEW TABLE AS new_payments
+FOR EACH STATEMENT EXECUTE FUNCTION update_invoice_status_after_payment();
+
+CREATE TRIGGER payment_update_update_invoice
+AFTER UPDATE ON payment
+REFERENCING OLD TABLE AS old_payments NEW TABLE AS new_payments
+FOR EACH STATEMENT EXECUTE FUNCTION update_invoice_status_after_payment();
+
+CREATE TRIGGER payment_delete_update_invoice
+AFTER DELETE ON payment
+REFERENCING OLD TABLE AS old_payments
+FOR EACH STATEMENT EXECUTE FUNCTION update_invoice_status_after_payment();
+
+-- Moves the change in an invoice's outstanding amount onto member_balance
+CREATE OR REPLACE FUNCTION update_member_balance_after_invoice()
+RETURNS TRIGGER AS $$
+DECLARE
+  old_outstanding NUMERIC(12,2) := 0;
+  new_outstanding NUMERIC(12,2) := 0;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status <> 'cancelled' THEN
+    old_outstanding := OLD.remaining;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status <> 'cancelled' THEN
+    new_outstanding := NEW.remaining;
+  END IF;
+
+  IF TG_OP = 'UPDATE' AND OLD.member_id = NEW.member_id THEN
+    IF new_outstanding <> old_outstanding THEN
+      UPDATE member_balance
+      SET outstanding = outstanding + new_outstanding - old_outstanding
+      WHERE member_id = NEW.member_id;
+    END IF;
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE member_balance
+    SET outstanding = outstanding - old_outstanding
+    WHERE member_id = OLD.member_id;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO member_balance (member_id, outstanding)
+    VALUES (NEW.member_id, new_outstanding)
+    ON CONFLICT (member_id)
+    DO UPDATE SET outstanding = member_balance.outstanding + EXCLUDED.outstanding;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER invoice_update_member_balance
+AFTER INSERT OR UPDATE OR DELETE ON invoice
+FOR EACH ROW EXECUTE FUNCTION update_member_balance_after_invoice();
+
+-- The digits of a phone number, so '(555) 111-1111' and '555.111.1111'
+-- search alike. Member phone search goes through an index on this.
+CREATE OR REPLACE FUNCTION normalize_phone(p_phone TEXT)
+RETURNS TEXT AS $$
+  SELECT regexp_replace(p_phone, '[^0-9]', '', 'g')
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+-- One chunk of a monthly billing run: invoices every member in
+-- [p_from_member, p_to_member) for the sessions they were enrolled in during
+-- the month starting p_period that weren't cancelled, priced by p_rates
+-- ({"session_type": rate}, the billing_rate table when the run started).
+-- One INSERT ... SELECT; members already billed for the month are skipped,
+-- so a chunk can simply be run again. Returns the invoices created.
+CREATE OR REPLACE FUNCTION bill_members(
+  p_period DATE,
+  p_from_member INTEGER,
+  p_to_member INTEGER,
+  p_rates JSONB
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_billed INTEGER;
+BEGIN
+  INSERT INTO invoice (member_id, total_amount, billing_period)
+  SELECT sm.member_id, SUM((p_rates ->> ts.session_type)::numeric), p_period
+  FROM session_members sm
+  JOIN training_sessions ts
+    ON ts.session_id = sm.session_id
+  WHERE sm.member_id >= p_from_member
+    AND sm.member_id < p_to_member
+    AND ts.session_date >= p_period
+    AND ts.session_date < p_period + interval '1 month'
+    AND ts.status <> 'cancelled'
+    AND p_rates ? ts.session_type
+  GROUP BY sm.member_id
+  ON CONFLICT (member_id, billing_period) DO NOTHING;
+
+  GET DIAGNOSTICS v_billed = ROW_COUNT;
+  RETURN v_billed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recomputes the health_metric_daily rows for the given (member, day)
+-- pairs from health_metric; days left with no readings are removed.
+-- Used when readings are updated or deleted, since a min/max can't be
+-- backed out incrementally.
+CREATE OR REPLACE FUNCTION refresh_health_metric_days(
+  p_member_ids INTEGER[],
+  p_days       DATE[]
+)
+RETURNS VOID AS $$
+  WITH touched AS (
+    SELECT DISTINCT member_id, day
+    FROM unnest(p_member_ids, p_days) AS t(member_id, day)
+  ),
+  fresh AS (
+    SELECT h.member_id, h.date::date AS day,
+           COUNT(*) AS readings,
+           COUNT(h.weight) AS weight_count,
+           COALESCE(SUM(h.weight), 0) AS weight_sum,
+           MIN(h.weight) AS weight_min,
+           MAX(h.weight) AS weight_max,
+           COUNT(h.heart_rate) AS heart_rate_count,
+           COALESCE(SUM(h.heart_rate), 0) AS heart_rate_sum,
+           MIN(h.heart_rate) AS heart_rate_min,
+           MAX(h.heart_rate) AS heart_rate_max
+    FROM touched t
+    JOIN health_metric h
+      ON h.member_id = t.member_id
+     AND h.date >= t.day
+     AND h.date < t.day + 1
+    GROUP BY h.member_id, h.date::date
+  ),
+  emptied AS (
+    DELETE FROM health_metric_daily d
+    USING touched t
+    WHERE d.member_id = t.member_id
+      AND d.day = t.day
+      AND NOT EXISTS (
+        SELECT 1 FROM fresh f WHERE f.member_id = t.member_id AND f.day = t.day
+      )
+  )
+  INSERT INTO health_metric_daily AS d
+  SELECT * FROM fresh
+  ON CONFLICT (member_id, day) DO UPDATE
+  SET readings = EXCLUDED.readings,
+      weight_count = EXCLUDED.weight_count,
+      weight_sum = EXCLUDED.weight_sum,
+      weight_min = EXCLUDED.weight_min,
+      weight_max = EXCLUDED.weight_max,
+      heart_rate_count = EXCLUDED.heart_rate_count,
+      heart_rate_sum = EXCLUDED.heart_rate_sum,
+      heart_rate_min = EXCLUDED.heart_rate_min,
+      heart_rate_max = EXCLUDED.heart_rate_max
+$$ LANGUAGE sql;
+
+-- Keeps health_metric_daily in step with health_metric. Inserts (the common
+-- case, including bulk COPY imports) are merged in set-wise per statement;
+-- updates and deletes recompute the days they touched.
+CREATE OR REPLACE FUNCTION update_health_metric_daily()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO health_metric_daily AS d
+    SELECT member_id, date::date,
+           COUNT(*),
+           COUNT(weight),
+           COALESCE(SUM(weight), 0),
+           MIN(weight),
+           MAX(weight),
+           COUNT(heart_rate),
+           COALESCE(SUM(heart_rate), 0),
+           MIN(heart_rate),
+           MAX(heart_rate)
+    FROM new_metrics
+    GROUP BY member_id, date::date
+    ON CONFLICT (member_id, day) DO UPDATE
+    SET readings = d.readings + EXCLUDED.readings,
+        weight_count = d.weight_count + EXCLUDED.weight_count,
+        weight_sum = d.weight_sum + EXCLUDED.weight_sum,
+        weight_min = LEAST(d.weight_min, EXCLUDED.weight_min),
+        weight_max = GREATEST(d.weight_max, EXCLUDED.weight_max),
+        heart_rate_count = d.heart_rate_count + EXCLUDED.heart_rate_count,
+        heart_rate_sum = d.heart_rate_sum + EXCLUDED.heart_rate_sum,
+        heart_rate_min = LEAST(d.heart_rate_min, EXCLUDED.heart_rate_min),
+        heart_rate_max = GREATEST(d.heart_rate_max, EXCLUDED.heart_rate_max);
+
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM refresh_health_metric_days(array_agg(member_id), array_agg(date::date))
+    FROM old_metrics;
+
+  ELSE
+    PERFORM refresh_health_metric_days(array_agg(member_id), array_agg(day))
+    FROM (
+      SELECT member_id, date::date AS day FROM old_metrics
+      UNION
+      SELECT member_id, date::date FROM new_metrics
+    ) changes;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER health_metric_insert_update_daily
+AFTER INSERT ON health_metric
+REFERENCING NEW TABLE AS new_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+CREATE TRIGGER health_metric_update_update_daily
+AFTER UPDATE ON health_metric
+REFERENCING OLD TABLE AS old_metrics NEW TABLE AS new_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+CREATE TRIGGER health_metric_delete_update_daily
+AFTER DELETE ON health_metric
+REFERENCING OLD TABLE AS old_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+-- Creates the health_metric partition for the month containing p_month
+-- (health_metric_YYYY_MM) if it doesn't exist yet. Readings for that month
+-- already sitting in the default partition are moved into it.
+CREATE OR REPLACE FUNCTION create_health_metric_partition(p_month DATE)
+RETURNS TEXT AS $$
 DECLARE
-  total_paid NUMERIC(10,2);
-  inv_total  NUMERIC(10,2);
-  inv_status VARCHAR(20);
-BEGIN
-  -- Get invoice total and current status
-  SELECT total_amount, status
-    INTO inv_total, inv_status
-  FROM invoice
-  WHERE invoice_id = NEW.invoice_id;
-
-  -- cancelled invoices
-  IF inv_status = 'cancelled' THEN
-    RETURN NEW;
-  END IF;
-
-  -- Sum all payments
-  SELECT COALESCE(SUM(amount), 0)
-    INTO total_paid
-  FROM payment
-  WHERE invoice_id = NEW.invoice_id;
-
-  -- Set status based on how much is paid
-  IF total_paid >= inv_total THEN
-    UPDATE invoice
-    SET status = 'paid'
-    WHERE invoice_id = NEW.invoice_id;
+  v_start DATE := date_trunc('month', p_month)::date;
+  v_end   DATE := (date_trunc('month', p_month) + interval '1 month')::date;
+  v_name  TEXT := 'health_metric_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+  IF to_regclass(v_name) IS NOT NULL THEN
+    RETURN v_name;
+  END IF;
+
+  IF EXISTS (SELECT 1 FROM health_metric_default WHERE date >= v_start AND date < v_end) THEN
+    CREATE TEMP TABLE health_metric_moving ON COMMIT DROP AS
+    WITH moved AS (
+      DELETE FROM health_metric
+      WHERE date >= v_start AND date < v_end
+      RETURNING *
+    )
+    SELECT * FROM moved;
+
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF health_metric FOR VALUES FROM (%L) TO (%L)',
+      v_name, v_start, v_end
+    );
+    INSERT INTO health_metric SELECT * FROM health_metric_moving;
+    DROP TABLE health_metric_moving;
   ELSE
-    UPDATE invoice
-    SET status = 'unpaid'
-    WHERE invoice_id = NEW.invoice_id;
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF health_metric FOR VALUES FROM (%L) TO (%L)',
+      v_name, v_start, v_end
+    );
+  END IF;
+
+  RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Makes sure every month from p_from to p_to (inclusive) has a partition.
+-- Returns how many were created.
+CREATE OR REPLACE FUNCTION ensure_health_metric_partitions(p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+  v_month   DATE;
+  v_created INTEGER := 0;
+BEGIN
+  FOR v_month IN
+    SELECT generate_series(date_trunc('month', p_from), date_trunc('month', p_to), interval '1 month')::date
+  LOOP
+    IF to_regclass('health_metric_' || to_char(v_month, 'YYYY_MM')) IS NULL THEN
+      PERFORM create_health_metric_partition(v_month);
+      v_created := v_created + 1;
+    END IF;
+  END LOOP;
+  RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Tells app processes (LISTEN refdata_changed) that a reference table they
+-- cache in memory changed. Delivered on commit, once per table per
+-- transaction.
+CREATE OR REPLACE FUNCTION notify_refdata_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('refdata_changed', TG_TABLE_NAME);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trainer_notify_refdata
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON trainer
+FOR EACH STATEMENT EXECUTE FUNCTION notify_refdata_changed();
+
+CREATE TRIGGER rooms_notify_refdata
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON rooms
+FOR EACH STATEMENT EXECUTE FUNCTION notify_refdata_changed();
+
+CREATE TRIGGER equipment_notify_refdata
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON equipment
+FOR EACH STATEMENT EXECUTE FUNCTION notify_refdata_changed();
+
+-- Dates an issue from when the equipment first stopped being operational
+-- (going from needs maintenance to out of order keeps the date) and clears
+-- it when the equipment is fixed
+CREATE OR REPLACE FUNCTION track_equipment_issue()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.status = 0 THEN
+    NEW.issue_since := NULL;
+    NEW.issue_note := NULL;
+  ELSIF TG_OP = 'INSERT' OR OLD.status = 0 THEN
+    NEW.issue_since := COALESCE(NEW.issue_since, now());
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER equipment_track_issue
+BEFORE INSERT OR UPDATE OF status ON equipment
+FOR EACH ROW EXECUTE FUNCTION track_equipment_issue();
+
+-- Keeps rooms.out_of_order_equipment in step, so room selection can skip
+-- rooms with broken equipment by reading the room row alone
+CREATE OR REPLACE FUNCTION count_out_of_order_equipment()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 2 THEN
+    UPDATE rooms
+    SET out_of_order_equipment = out_of_order_equipment - 1
+    WHERE room_id = OLD.room_id;
   END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 2 THEN
+    UPDATE rooms
+    SET out_of_order_equipment = out_of_order_equipment + 1
+    WHERE room_id = NEW.room_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER equipment_count_out_of_order
+AFTER INSERT OR DELETE ON equipment
+FOR EACH ROW
+EXECUTE FUNCTION count_out_of_order_equipment();
+
+CREATE TRIGGER equipment_recount_out_of_order
+AFTER UPDATE OF status, room_id ON equipment
+FOR EACH ROW
+WHEN ((OLD.status = 2 OR NEW.status = 2) AND
+      (OLD.status, OLD.room_id) IS DISTINCT FROM (NEW.status, NEW.room_id))
+EXECUTE FUNCTION count_out_of_order_equipment();
+
+-- Every occurrence of the active recurring classes between p_from and
+-- p_to (inclusive), expanded on the fly. Dates that already have their own
+-- training_sessions row (joined or cancelled occurrences) are left to that
+-- row. Plain SQL, so callers' filters are pushed into the expansion.
+CREATE OR REPLACE FUNCTION class_occurrences(p_from DATE, p_to DATE)
+RETURNS TABLE (
+  schedule_id  INTEGER,
+  trainer_id   INTEGER,
+  room_id      INTEGER,
+  session_date DATE,
+  start_time   TIME,
+  end_time     TIME,
+  capacity     INTEGER
+) AS $$
+  SELECT s.schedule_id, s.trainer_id, s.room_id, d.day::date, s.start_time, s.end_time, s.capacity
+  FROM class_schedule s
+  CROSS JOIN LATERAL generate_series(
+    GREATEST(p_from, s.valid_from),
+    LEAST(p_to, COALESCE(s.valid_until, p_to)),
+    interval '1 day'
+  ) AS d(day)
+  WHERE s.status = 'active'
+    AND s.valid_from <= p_to
+    AND (s.valid_until IS NULL OR s.valid_until >= p_from)
+    AND extract(isodow FROM d.day)::smallint = ANY (s.weekdays)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.schedule_id = s.schedule_id
+        AND ts.session_date = d.day::date
+    )
+$$ LANGUAGE sql STABLE;
+
+-- Live group classes between p_from and p_to: dated sessions plus the
+-- expanded recurring occurrences (session_id NULL until someone joins).
+CREATE OR REPLACE FUNCTION class_calendar(p_from DATE, p_to DATE, p_trainer_id INTEGER DEFAULT NULL)
+RETURNS TABLE (
+  session_id   INTEGER,
+  schedule_id  INTEGER,
+  trainer_id   INTEGER,
+  room_id      INTEGER,
+  session_date DATE,
+  start_time   TIME,
+  end_time     TIME,
+  status       VARCHAR,
+  capacity     INTEGER,
+  enrolled     INTEGER
+) AS $$
+  SELECT ts.session_id, ts.schedule_id, ts.trainer_id, ts.room_id, ts.session_date,
+         ts.start_time, ts.end_time, ts.status, ts.capacity, ts.enrolled
+  FROM training_sessions ts
+  WHERE ts.session_type = 'group'
+    AND ts.status IN ('active', 'full')
+    AND ts.session_date BETWEEN p_from AND p_to
+    AND (p_trainer_id IS NULL OR ts.trainer_id = p_trainer_id)
+  UNION ALL
+  SELECT NULL, o.schedule_id, o.trainer_id, o.room_id, o.session_date,
+         o.start_time, o.end_time, 'active', o.capacity, 0
+  FROM class_occurrences(p_from, p_to) o
+  WHERE p_trainer_id IS NULL OR o.trainer_id = p_trainer_id
+  ORDER BY 5, 6, 3
+$$ LANGUAGE sql STABLE;
 
+-- Rejects a live session that overlaps an occurrence of another recurring
+-- class for the same trainer or room, with the same error the exclusion
+-- constraints raise for dated sessions. Locking the trainer and room rows
+-- first serialises this with add_class_schedule(), so neither can miss a
+-- concurrent insert from the other.
+CREATE OR REPLACE FUNCTION check_class_schedule_overlap()
+RETURNS TRIGGER AS $$
+DECLARE
+  v_clash RECORD;
+BEGIN
+  PERFORM 1 FROM trainer WHERE trainer_id = NEW.trainer_id FOR SHARE;
+  PERFORM 1 FROM rooms WHERE room_id = NEW.room_id FOR SHARE;
+
+  SELECT o.schedule_id, o.trainer_id = NEW.trainer_id AS same_trainer
+    INTO v_clash
+  FROM class_occurrences(NEW.session_date, NEW.session_date) o
+  WHERE (o.trainer_id = NEW.trainer_id OR o.room_id = NEW.room_id)
+    AND o.schedule_id IS DISTINCT FROM NEW.schedule_id
+    AND timerange(o.start_time, o.end_time) && timerange(NEW.start_time, NEW.end_time)
+  ORDER BY same_trainer DESC
+  LIMIT 1;
+
+  IF FOUND THEN
+    RAISE EXCEPTION 'Overlaps recurring class % on %.', v_clash.schedule_id, NEW.session_date
+      USING ERRCODE = 'exclusion_violation',
+            CONSTRAINT = CASE WHEN v_clash.same_trainer
+                              THEN 'training_sessions_no_trainer_overlap'
+                              ELSE 'training_sessions_no_room_overlap' END;
+  END IF;
   RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE TRIGGER training_sessions_check_class_schedule
+BEFORE INSERT ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full'))
+EXECUTE FUNCTION check_class_schedule_overlap();
+
+-- Only when the session moves or comes back to life; seat counter updates
+-- (including active <-> full) skip the check
+CREATE TRIGGER training_sessions_recheck_class_schedule
+BEFORE UPDATE OF trainer_id, room_id, session_date, start_time, end_time, status
+ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full') AND (
+  OLD.status NOT IN ('active', 'full') OR
+  (OLD.trainer_id, OLD.room_id, OLD.session_date, OLD.start_time, OLD.end_time) IS DISTINCT FROM
+  (NEW.trainer_id, NEW.room_id, NEW.session_date, NEW.start_time, NEW.end_time)
+))
+EXECUTE FUNCTION check_class_schedule_overlap();
+
+-- Queues a job for app.worker in the caller's transaction, so it exists
+-- exactly when the work that asked for it commits. Idle workers are woken
+-- on commit unless the job is for later.
+CREATE OR REPLACE FUNCTION enqueue_job(
+  p_kind VARCHAR,
+  p_payload JSONB DEFAULT '{}',
+  p_run_at TIMESTAMPTZ DEFAULT now(),
+  p_max_attempts INTEGER DEFAULT 5
+)
+RETURNS BIGINT AS $$
+DECLARE
+  v_job_id BIGINT;
+BEGIN
+  INSERT INTO job (kind, payload, run_at, max_attempts)
+  VALUES (p_kind, p_payload, p_run_at, p_max_attempts)
+  RETURNING job_id INTO v_job_id;
+
+  IF p_run_at <= now() THEN
+    PERFORM pg_notify('job_queued', p_kind);
+  END IF;
+  RETURN v_job_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Schedules the complete_session job for when a live session ends. A
+-- session that moves gets another job; the job itself skips sessions that
+-- are no longer live or haven't ended yet.
+CREATE OR REPLACE FUNCTION enqueue_session_close()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM enqueue_job(
+    'complete_session',
+    jsonb_build_object('session_id', NEW.session_id),
+    (NEW.session_date + NEW.end_time)::timestamptz
+  );
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER training_sessions_enqueue_close
+AFTER INSERT ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full'))
+EXECUTE FUNCTION enqueue_session_close();
+
+CREATE TRIGGER training_sessions_reenqueue_close
+AFTER UPDATE OF session_date, end_time, status ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full') AND (
+  OLD.status NOT IN ('active', 'full') OR
+  (OLD.session_date, OLD.end_time) IS DISTINCT FROM (NEW.session_date, NEW.end_time)
+))
+EXECUTE FUNCTION enqueue_session_close();
+
+-- Creates a recurring class after checking it against the other recurring
+-- classes (rule against rule, nothing is expanded) and against the live
+-- dated sessions on its weekdays within its date range. Conflicts raise
+-- exclusion_violation naming the trainer or room constraint.
+CREATE OR REPLACE FUNCTION add_class_schedule(
+  p_trainer_id  INTEGER,
+  p_room_id     INTEGER,
+  p_weekdays    SMALLINT[],
+  p_start_time  TIME,
+  p_end_time    TIME,
+  p_capacity    INTEGER,
+  p_valid_from  DATE,
+  p_valid_until DATE DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_span        daterange := daterange(p_valid_from, p_valid_until, '[]');
+  v_clash       RECORD;
+  v_schedule_id INTEGER;
+BEGIN
+  -- Bookings take FOR SHARE on these rows before checking the schedules
+  PERFORM 1 FROM trainer WHERE trainer_id = p_trainer_id FOR NO KEY UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Trainer with ID % does not exist.', p_trainer_id;
+  END IF;
+  PERFORM 1 FROM rooms WHERE room_id = p_room_id FOR NO KEY UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Room ID % does not exist.', p_room_id;
+  END IF;
+
+  -- Two rules clash if some day in both date ranges falls on a weekday of
+  -- both; a week of the shared range is enough to find it
+  SELECT s.schedule_id, day::date AS clash_date, s.trainer_id = p_trainer_id AS same_trainer
+    INTO v_clash
+  FROM class_schedule s
+  CROSS JOIN LATERAL (SELECT daterange(s.valid_from, s.valid_until, '[]') * v_span AS shared) r
+  CROSS JOIN LATERAL generate_series(
+    lower(r.shared),
+    LEAST(lower(r.shared) + 6, COALESCE(upper(r.shared) - 1, lower(r.shared) + 6)),
+    interval '1 day'
+  ) AS day
+  WHERE s.status = 'active'
+    AND (s.trainer_id = p_trainer_id OR s.room_id = p_room_id)
+    AND s.weekdays && p_weekdays
+    AND daterange(s.valid_from, s.valid_until, '[]') && v_span
+    AND timerange(s.start_time, s.end_time) && timerange(p_start_time, p_end_time)
+    AND extract(isodow FROM day)::smallint = ANY (s.weekdays)
+    AND extract(isodow FROM day)::smallint = ANY (p_weekdays)
+  ORDER BY same_trainer DESC, clash_date
+  LIMIT 1;
+
+  IF NOT FOUND THEN
+    SELECT NULL::integer AS schedule_id, ts.session_date AS clash_date,
+           ts.trainer_id = p_trainer_id AS same_trainer
+      INTO v_clash
+    FROM training_sessions ts
+    WHERE ts.status IN ('active', 'full')
+      AND (ts.trainer_id = p_trainer_id OR ts.room_id = p_room_id)
+      AND ts.session_date <@ v_span
+      AND extract(isodow FROM ts.session_date)::smallint = ANY (p_weekdays)
+      AND timerange(ts.start_time, ts.end_time) && timerange(p_start_time, p_end_time)
+    ORDER BY same_trainer DESC, ts.session_date
+    LIMIT 1;
+  END IF;
+
+  IF v_clash.clash_date IS NOT NULL THEN
+    RAISE EXCEPTION '% is already booked on %.',
+      CASE WHEN v_clash.same_trainer THEN 'This trainer' ELSE format('Room ID %s', p_room_id) END,
+      v_clash.clash_date
+      USING ERRCODE = 'exclusion_violation',
+            CONSTRAINT = CASE WHEN v_clash.same_trainer
+                              THEN 'training_sessions_no_trainer_overlap'
+                              ELSE 'training_sessions_no_room_overlap' END;
+  END IF;
+
+  INSERT INTO class_schedule (trainer_id, room_id, weekdays, start_time, end_time, capacity, valid_from, valid_until)
+  VALUES (p_trainer_id, p_room_id, p_weekdays, p_start_time, p_end_time, p_capacity, p_valid_from, p_valid_until)
+  RETURNING schedule_id INTO v_schedule_id;
+  RETURN v_schedule_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The training_sessions row for one occurrence of a recurring class,
+-- created on first use. Concurrent callers get the same row.
+CREATE OR REPLACE FUNCTION class_session(p_schedule_id INTEGER, p_date DATE)
+RETURNS INTEGER AS $$
+DECLARE
+  v_session_id INTEGER;
+BEGIN
+  SELECT ts.session_id INTO v_session_id
+  FROM training_sessions ts
+  WHERE ts.schedule_id = p_schedule_id
+    AND ts.session_date = p_date;
+  IF FOUND THEN
+    RETURN v_session_id;
+  END IF;
+
+  INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, capacity, schedule_id)
+  SELECT o.trainer_id, o.room_id, 'group', o.session_date, o.start_time, o.end_time, o.capacity, o.schedule_id
+  FROM class_occurrences(p_date, p_date) o
+  WHERE o.schedule_id = p_schedule_id
+  ON CONFLICT (schedule_id, session_date) DO NOTHING
+  RETURNING session_id INTO v_session_id;
+
+  IF v_session_id IS NULL THEN
+    SELECT ts.session_id INTO v_session_id
+    FROM training_sessions ts
+    WHERE ts.schedule_id = p_schedule_id
+      AND ts.session_date = p_date;
+  END IF;
+  IF v_session_id IS NULL THEN
+    RAISE EXCEPTION 'Recurring class % does not meet on %.', p_schedule_id, p_date;
+  END IF;
+  RETURN v_session_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rooms with at least p_min_capacity seats and nothing live overlapping
+-- [p_start_time, p_end_time) on p_date, smallest first. Each room is one
+-- probe of the training_sessions_no_room_overlap GiST index plus that
+-- day's recurring occurrences. Pass p_room_id to ask about a single room,
+-- p_skip_out_of_order to leave out rooms with out-of-order equipment.
+CREATE OR REPLACE FUNCTION free_rooms(
+  p_date         DATE,
+  p_start_time   TIME,
+  p_end_time     TIME,
+  p_min_capacity INTEGER DEFAULT 1,
+  p_room_id      INTEGER DEFAULT NULL,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (room_id INTEGER, room_name VARCHAR, capacity INTEGER) AS $$
+  SELECT r.room_id, r.room_name, r.capacity
+  FROM rooms r
+  WHERE r.capacity >= p_min_capacity
+    AND (p_room_id IS NULL OR r.room_id = p_room_id)
+    AND NOT (p_skip_out_of_order AND r.out_of_order_equipment > 0)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.room_id = r.room_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(p_date + p_start_time, p_date + p_end_time)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.room_id = r.room_id
+        AND timerange(o.start_time, o.end_time) && timerange(p_start_time, p_end_time)
+    )
+  ORDER BY r.capacity, r.room_id
+$$ LANGUAGE sql STABLE;
+
+-- Every bookable slot of length p_length on p_date, stepping through each
+-- trainer's availability window p_step at a time (one trainer if
+-- p_trainer_id is given). A slot is listed when the trainer has nothing
+-- live overlapping it and at least one room is free; the free rooms come
+-- with it.
+CREATE OR REPLACE FUNCTION open_slots(
+  p_length     INTERVAL,
+  p_trainer_id INTEGER DEFAULT NULL,
+  p_step       INTERVAL DEFAULT '15 minutes',
+  p_date       DATE DEFAULT CURRENT_DATE,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+  trainer_id      INTEGER,
+  trainer_name    VARCHAR,
+  start_time      TIME,
+  end_time        TIME,
+  free_room_ids   INTEGER[],
+  free_room_names VARCHAR[]
+) AS $$
+  SELECT t.trainer_id, t.full_name, slot.start_time, slot.end_time, rooms.ids, rooms.names
+  FROM trainer t
+  -- Step through the window as timestamps on the day itself so slots
+  -- can't wrap past midnight
+  CROSS JOIN LATERAL generate_series(
+    p_date + t.availability_start,
+    p_date + t.availability_end - p_length,
+    p_step
+  ) AS step(slot_start)
+  CROSS JOIN LATERAL (
+    SELECT step.slot_start::time AS start_time,
+           (step.slot_start + p_length)::time AS end_time
+  ) slot
+  CROSS JOIN LATERAL (
+    SELECT array_agg(f.room_id) AS ids, array_agg(f.room_name) AS names
+    FROM free_rooms(p_date, slot.start_time, slot.end_time, p_skip_out_of_order => p_skip_out_of_order) f
+  ) rooms
+  WHERE (p_trainer_id IS NULL OR t.trainer_id = p_trainer_id)
+    AND rooms.ids IS NOT NULL
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.trainer_id = t.trainer_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(step.slot_start, step.slot_start + p_length)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.trainer_id = t.trainer_id
+        AND timerange(o.start_time, o.end_time) && timerange(slot.start_time, slot.end_time)
+    )
+  ORDER BY t.trainer_id, slot.start_time
+$$ LANGUAGE sql STABLE;
+
+-- Books a personal session in one call: checks the trainer's availability,
+-- picks the smallest room free for that window, creates the session and
+-- enrols the member. Overlaps are rejected by the exclusion constraints
+-- (and the recurring-class trigger), so two concurrent bookings can't take
+-- the same trainer or room. With p_skip_out_of_order, rooms with
+-- out-of-order equipment aren't picked.
+CREATE OR REPLACE FUNCTION book_personal_session(
+  p_member_id  INTEGER,
+  p_trainer_id INTEGER,
+  p_date       DATE,
+  p_start_time TIME,
+  p_end_time   TIME,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (session_id INTEGER, room_id INTEGER, room_name VARCHAR) AS $$
+DECLARE
+  avail_start TIME;
+  avail_end   TIME;
+  conflict    TEXT;
+BEGIN
+  SELECT t.availability_start, t.availability_end
+    INTO avail_start, avail_end
+  FROM trainer t
+  WHERE t.trainer_id = p_trainer_id;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Trainer with ID % does not exist.', p_trainer_id;
+  END IF;
+
+  IF p_start_time < avail_start OR p_end_time > avail_end THEN
+    RAISE EXCEPTION 'Requested time is outside trainer''s availability.';
+  END IF;
+
+  -- A concurrent booking can take the room we picked between our lookup and
+  -- our insert; the room constraint catches that and we try the next room.
+  FOR attempt IN 1..3 LOOP
+    SELECT f.room_id, f.room_name
+      INTO room_id, room_name
+    FROM free_rooms(p_date, p_start_time, p_end_time, p_skip_out_of_order => p_skip_out_of_order) f
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'No rooms are available at this time.';
+    END IF;
+
+    BEGIN
+      INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, capacity)
+      VALUES (p_trainer_id, room_id, 'personal', p_date, p_start_time, p_end_time, 1)
+      RETURNING training_sessions.session_id INTO session_id;
+      EXIT;
+    EXCEPTION WHEN exclusion_violation THEN
+      GET STACKED DIAGNOSTICS conflict = CONSTRAINT_NAME;
+      IF conflict <> 'training_sessions_no_room_overlap' OR attempt = 3 THEN
+        RAISE;
+      END IF;
+    END;
+  END LOOP;
+
+  INSERT INTO session_members (session_id, member_id)
+  VALUES (session_id, p_member_id);
+
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Takes a seat for each new member of a session with one conditional
+-- update of its counter: the row lock queues concurrent joins on the
+-- session and each re-checks enrolled < capacity after the one before it,
+-- so a class can't be oversold. A group class that fills up becomes 'full'.
+-- Raising aborts the whole insert, membership row included.
+CREATE OR REPLACE FUNCTION take_session_seat()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE training_sessions ts
+  SET enrolled = ts.enrolled + 1,
+      status = CASE WHEN ts.session_type = 'group' AND ts.enrolled + 1 >= ts.capacity
+                    THEN 'full' ELSE ts.status END
+  WHERE ts.session_id = NEW.session_id
+    AND ts.status = 'active'
+    AND ts.enrolled < ts.capacity;
+
+  IF NOT FOUND THEN
+    IF EXISTS (SELECT 1 FROM training_sessions WHERE session_id = NEW.session_id AND status = 'full') THEN
+      RAISE EXCEPTION 'This class is already full.';
+    END IF;
+    RAISE EXCEPTION 'Session % is not open for joining.', NEW.session_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Gives seats back when members leave; a full class that has room again
+-- goes back to 'active'.
+CREATE OR REPLACE FUNCTION release_session_seats()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE training_sessions ts
+  SET enrolled = ts.enrolled - d.members,
+      status = CASE WHEN ts.status = 'full' AND ts.enrolled - d.members < ts.capacity
+                    THEN 'active' ELSE ts.status END
+  FROM (
+    SELECT session_id, COUNT(*) AS members
+    FROM old_members
+    GROUP BY session_id
+  ) d
+  WHERE ts.session_id = d.session_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER session_members_take_seat
+AFTER INSERT ON session_members
+FOR EACH ROW EXECUTE FUNCTION take_session_seat();
+
+CREATE TRIGGER session_members_release_seats
+AFTER DELETE ON session_members
+REFERENCING OLD TABLE AS old_members
+FOR EACH STATEMENT EXECUTE FUNCTION release_session_seats();
+
+-- Enrols a member in a group class in one statement and returns the seats
+-- left. The seat itself is taken by the session_members trigger; the
+-- unique (session_id, member_id) key turns a repeat join into an error
+-- instead of a second seat.
+CREATE OR REPLACE FUNCTION join_class(p_session_id INTEGER, p_member_id INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+  v_left INTEGER;
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM training_sessions WHERE session_id = p_session_id AND session_type = 'group'
+  ) THEN
+    RAISE EXCEPTION 'Session % is not a group class.', p_session_id;
+  END IF;
+
+  INSERT INTO session_members (session_id, member_id)
+  VALUES (p_session_id, p_member_id)
+  ON CONFLICT (session_id, member_id) DO NOTHING;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'You have already joined this class.';
+  END IF;
+
+  SELECT capacity - enrolled INTO v_left
+  FROM training_sessions
+  WHERE session_id = p_session_id;
+  RETURN v_left;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Indexes
 CREATE INDEX idx_session_members_member_id
 ON session_members (member_id);
 
+-- Member search: closest names first by trigram word similarity (GiST
+-- answers ORDER BY ... <<-> ... LIMIT k without ranking every match), and
+-- phone prefixes as a range of the C-ordered digits
+CREATE INDEX idx_member_full_name_trgm
+ON member USING gist (full_name gist_trgm_ops);
+
+CREATE INDEX idx_member_phone_digits
+ON member ((normalize_phone(phone)) COLLATE "C");
+
 CREATE INDEX idx_training_sessions_trainer_status_type_start
-ON training_sessions (trainer_id, status, session_type, start_time);
+ON training_sessions (trainer_id, status, session_type, session_date, start_time);
+
+-- The class calendar across all trainers, by day
+CREATE INDEX idx_training_sessions_live_group_date
+ON training_sessions (session_date, start_time)
+WHERE session_type = 'group' AND status IN ('active', 'full');
+
+CREATE INDEX idx_class_schedule_trainer
+ON class_schedule (trainer_id);
+
+CREATE INDEX idx_class_schedule_room
+ON class_schedule (room_id);
 
-CREATE INDEX idx_invoice_member_id
-ON invoice (member_id);
+-- Billing runs read one month of sessions at a time
+CREATE INDEX idx_training_sessions_date
+ON training_sessions (session_date);
 
 CREATE INDEX idx_payment_invoice_id
 ON payment (invoice_id);
 
 CREATE INDEX idx_health_metric_member_date
-ON health_metric (member_id, date DESC);
\ No newline at end of file
+ON health_metric (member_id, date DESC);
+
+-- Date-range scans (retention, analytics) over whole months; tiny next to a
+-- B-tree since readings arrive roughly in date order
+CREATE INDEX idx_health_metric_date_brin
+ON health_metric USING brin (date);
+
+CREATE INDEX idx_rooms_capacity
+ON rooms (capacity);
+
+-- Inventory pages by room or by type, in equipment_id order
+CREATE INDEX idx_equipment_room
+ON equipment (room_id, equipment_id);
+
+CREATE INDEX idx_equipment_type
+ON equipment (type, equipment_id);
+
+-- Only the few items with an open issue: the maintenance queue and the
+-- status filters read this instead of the whole inventory
+CREATE INDEX idx_equipment_open_issues
+ON equipment (issue_since, equipment_id)
+WHERE status <> 0;
+
+-- What workers claim next, and what the reaper looks at; finished jobs
+-- stay out of both
+CREATE INDEX idx_job_queued_run_at
+ON job (run_at)
+WHERE status = 'queued';
+
+CREATE INDEX idx_job_running_locked_at
+ON job (locked_at)
+WHERE status = 'running';
+
+-- Partitions for the last two years and the next three months
+SELECT ensure_health_metric_partitions(
+  (date_trunc('month', CURRENT_DATE) - interval '24 months')::date,
+  (date_trunc('month', CURRENT_DATE) + interval '3 months')::date
+);
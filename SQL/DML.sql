@@ -9,10 +9,10 @@ INSERT INTO trainer (full_name, phone, availability_start, availability_end) VAL
   ('Emily Coach',    '555-555-2222', '12:00:00', '20:00:00'),
   ('Michael Strong', '555-555-3333', '06:00:00', '14:00:00');
 
-INSERT INTO rooms (room_name, capacity, isBooked) VALUES
-  ('Studio A', 15, FALSE),
-  ('Studio B', 20, FALSE),
-  ('PT Room 1',  2, FALSE);
+INSERT INTO rooms (room_name, capacity) VALUES
+  ('Studio A', 15),
+  ('Studio B', 20),
+  ('PT Room 1',  2);
 
 INSERT INTO equipment (room_id, type, status) VALUES
   (1, 'Treadmill',      0),
@@ -44,7 +44,7 @@ VALUES
 
   -- Group classes
   (1, 1, 'group', '11:00:00', '12:00:00', 'active',   10),   
-  (2, 2, 'group', '18:00:00', '19:00:00', 'full',     15),    
+  (2, 2, 'group', '18:00:00', '19:00:00', 'active',    2),    
   (3, 1, 'group', '07:00:00', '08:00:00', 'active',   12);    
 
 -- Personal sessions
@@ -58,9 +58,13 @@ INSERT INTO session_members (session_id, member_id) VALUES
   (4, 2),  
   (4, 3),  
   (5, 2), 
+  (5, 4),   -- takes the last seat, so session 5 becomes 'full'
   (6, 3), 
   (6, 4);  
 
+-- Recurring class: Studio B, every Mon/Wed/Fri 14:00
+SELECT add_class_schedule(1, 2, '{1,3,5}', '14:00', '15:00', 20, CURRENT_DATE);
+
 INSERT INTO invoice (member_id, issue_date, total_amount, status) VALUES
   (1, '2025-11-20', 100.00, 'unpaid'),   
   (1, '2025-11-25',  60.00, 'unpaid'),   
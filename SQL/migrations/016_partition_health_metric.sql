@@ -0,0 +1,124 @@
+-- Converts an existing health_metric table into the monthly range-partitioned
+-- layout of DDL.sql. Run once against a database created from the previous
+-- DDL.sql, e.g.
+--   psql -d FinalProject -f SQL/migrations/016_partition_health_metric.sql
+-- Rows are copied with the daily triggers not yet in place, since
+-- health_metric_daily already covers them. Takes an exclusive lock on
+-- health_metric for the duration.
+BEGIN;
+
+LOCK TABLE health_metric IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE health_metric RENAME TO health_metric_unpartitioned;
+ALTER INDEX health_metric_pkey RENAME TO health_metric_unpartitioned_pkey;
+ALTER INDEX idx_health_metric_member_date RENAME TO idx_health_metric_unpartitioned_member_date;
+DROP TRIGGER health_metric_insert_update_daily ON health_metric_unpartitioned;
+DROP TRIGGER health_metric_update_update_daily ON health_metric_unpartitioned;
+DROP TRIGGER health_metric_delete_update_daily ON health_metric_unpartitioned;
+
+CREATE TABLE health_metric (
+  metric_id           INTEGER NOT NULL DEFAULT nextval('health_metric_metric_id_seq'),
+  member_id           INTEGER NOT NULL REFERENCES member(member_id) ON DELETE CASCADE,
+  height              NUMERIC(5,2),
+  weight              NUMERIC(5,2),
+  heart_rate          INTEGER,
+  date                TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (metric_id, date)
+) PARTITION BY RANGE (date);
+
+CREATE TABLE health_metric_default PARTITION OF health_metric DEFAULT;
+
+-- Creates the health_metric partition for the month containing p_month
+-- (health_metric_YYYY_MM) if it doesn't exist yet. Readings for that month
+-- already sitting in the default partition are moved into it.
+CREATE OR REPLACE FUNCTION create_health_metric_partition(p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+  v_start DATE := date_trunc('month', p_month)::date;
+  v_end   DATE := (date_trunc('month', p_month) + interval '1 month')::date;
+  v_name  TEXT := 'health_metric_' || to_char(p_month, 'YYYY_MM');
+BEGIN
+  IF to_regclass(v_name) IS NOT NULL THEN
+    RETURN v_name;
+  END IF;
+
+  IF EXISTS (SELECT 1 FROM health_metric_default WHERE date >= v_start AND date < v_end) THEN
+    CREATE TEMP TABLE health_metric_moving ON COMMIT DROP AS
+    WITH moved AS (
+      DELETE FROM health_metric
+      WHERE date >= v_start AND date < v_end
+      RETURNING *
+    )
+    SELECT * FROM moved;
+
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF health_metric FOR VALUES FROM (%L) TO (%L)',
+      v_name, v_start, v_end
+    );
+    INSERT INTO health_metric SELECT * FROM health_metric_moving;
+    DROP TABLE health_metric_moving;
+  ELSE
+    EXECUTE format(
+      'CREATE TABLE %I PARTITION OF health_metric FOR VALUES FROM (%L) TO (%L)',
+      v_name, v_start, v_end
+    );
+  END IF;
+
+  RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Makes sure every month from p_from to p_to (inclusive) has a partition.
+-- Returns how many were created.
+CREATE OR REPLACE FUNCTION ensure_health_metric_partitions(p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+  v_month   DATE;
+  v_created INTEGER := 0;
+BEGIN
+  FOR v_month IN
+    SELECT generate_series(date_trunc('month', p_from), date_trunc('month', p_to), interval '1 month')::date
+  LOOP
+    IF to_regclass('health_metric_' || to_char(v_month, 'YYYY_MM')) IS NULL THEN
+      PERFORM create_health_metric_partition(v_month);
+      v_created := v_created + 1;
+    END IF;
+  END LOOP;
+  RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_health_metric_partitions(
+  COALESCE((SELECT MIN(date) FROM health_metric_unpartitioned)::date, CURRENT_DATE),
+  (date_trunc('month', CURRENT_DATE) + interval '3 months')::date
+);
+
+INSERT INTO health_metric (metric_id, member_id, height, weight, heart_rate, date)
+SELECT metric_id, member_id, height, weight, heart_rate, date
+FROM health_metric_unpartitioned;
+
+ALTER SEQUENCE health_metric_metric_id_seq OWNED BY health_metric.metric_id;
+DROP TABLE health_metric_unpartitioned;
+
+CREATE INDEX idx_health_metric_member_date
+ON health_metric (member_id, date DESC);
+
+CREATE INDEX idx_health_metric_date_brin
+ON health_metric USING brin (date);
+
+CREATE TRIGGER health_metric_insert_update_daily
+AFTER INSERT ON health_metric
+REFERENCING NEW TABLE AS new_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+CREATE TRIGGER health_metric_update_update_daily
+AFTER UPDATE ON health_metric
+REFERENCING OLD TABLE AS old_metrics NEW TABLE AS new_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+CREATE TRIGGER health_metric_delete_update_daily
+AFTER DELETE ON health_metric
+REFERENCING OLD TABLE AS old_metrics
+FOR EACH STATEMENT EXECUTE FUNCTION update_health_metric_daily();
+
+COMMIT;
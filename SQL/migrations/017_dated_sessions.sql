@@ -0,0 +1,427 @@
+-- Adds dated sessions and recurring classes (class_schedule) to a database
+-- created from the DDL.sql before them, e.g.
+--   psql -d FinalProject -f SQL/migrations/017_dated_sessions.sql
+-- Existing sessions are dated today. Restart the app afterwards: its
+-- connections hold prepared statements for the old function signatures.
+BEGIN;
+
+CREATE TABLE class_schedule (
+  schedule_id   SERIAL PRIMARY KEY,
+  trainer_id    INTEGER NOT NULL REFERENCES trainer(trainer_id),
+  room_id       INTEGER NOT NULL REFERENCES rooms(room_id),
+  weekdays      SMALLINT[] NOT NULL,
+  start_time    TIME NOT NULL,
+  end_time      TIME NOT NULL,
+  capacity      INTEGER NOT NULL,
+  valid_from    DATE NOT NULL DEFAULT CURRENT_DATE,
+  valid_until   DATE,
+  status        VARCHAR(20) NOT NULL DEFAULT 'active',
+  CHECK (end_time > start_time),
+  CHECK (valid_until IS NULL OR valid_until >= valid_from),
+  CHECK (cardinality(weekdays) > 0 AND weekdays <@ '{1,2,3,4,5,6,7}'::smallint[]),
+  CHECK (status IN ('active', 'cancelled'))
+);
+
+ALTER TABLE training_sessions
+  ADD COLUMN session_date DATE NOT NULL DEFAULT CURRENT_DATE,
+  ADD COLUMN schedule_id INTEGER REFERENCES class_schedule(schedule_id),
+  ADD UNIQUE (schedule_id, session_date),
+  DROP CONSTRAINT training_sessions_no_trainer_overlap,
+  DROP CONSTRAINT training_sessions_no_room_overlap,
+  ADD CONSTRAINT training_sessions_no_trainer_overlap EXCLUDE USING gist (
+    trainer_id WITH =,
+    tsrange(session_date + start_time, session_date + end_time) WITH &&
+  ) WHERE (status IN ('active', 'full')),
+  ADD CONSTRAINT training_sessions_no_room_overlap EXCLUDE USING gist (
+    room_id WITH =,
+    tsrange(session_date + start_time, session_date + end_time) WITH &&
+  ) WHERE (status IN ('active', 'full'));
+
+DROP FUNCTION open_slots(INTERVAL, INTEGER, INTERVAL);
+DROP FUNCTION free_rooms(TIME, TIME, INTEGER, INTEGER);
+DROP FUNCTION book_personal_session(INTEGER, INTEGER, TIME, TIME);
+
+-- Every occurrence of the active recurring classes between p_from and
+-- p_to (inclusive), expanded on the fly. Dates that already have their own
+-- training_sessions row (joined or cancelled occurrences) are left to that
+-- row. Plain SQL, so callers' filters are pushed into the expansion.
+CREATE OR REPLACE FUNCTION class_occurrences(p_from DATE, p_to DATE)
+RETURNS TABLE (
+  schedule_id  INTEGER,
+  trainer_id   INTEGER,
+  room_id      INTEGER,
+  session_date DATE,
+  start_time   TIME,
+  end_time     TIME,
+  capacity     INTEGER
+) AS $$
+  SELECT s.schedule_id, s.trainer_id, s.room_id, d.day::date, s.start_time, s.end_time, s.capacity
+  FROM class_schedule s
+  CROSS JOIN LATERAL generate_series(
+    GREATEST(p_from, s.valid_from),
+    LEAST(p_to, COALESCE(s.valid_until, p_to)),
+    interval '1 day'
+  ) AS d(day)
+  WHERE s.status = 'active'
+    AND s.valid_from <= p_to
+    AND (s.valid_until IS NULL OR s.valid_until >= p_from)
+    AND extract(isodow FROM d.day)::smallint = ANY (s.weekdays)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.schedule_id = s.schedule_id
+        AND ts.session_date = d.day::date
+    )
+$$ LANGUAGE sql STABLE;
+
+-- Live group classes between p_from and p_to: dated sessions plus the
+-- expanded recurring occurrences (session_id NULL until someone joins).
+CREATE OR REPLACE FUNCTION class_calendar(p_from DATE, p_to DATE, p_trainer_id INTEGER DEFAULT NULL)
+RETURNS TABLE (
+  session_id   INTEGER,
+  schedule_id  INTEGER,
+  trainer_id   INTEGER,
+  room_id      INTEGER,
+  session_date DATE,
+  start_time   TIME,
+  end_time     TIME,
+  status       VARCHAR,
+  capacity     INTEGER
+) AS $$
+  SELECT ts.session_id, ts.schedule_id, ts.trainer_id, ts.room_id, ts.session_date,
+         ts.start_time, ts.end_time, ts.status, ts.capacity
+  FROM training_sessions ts
+  WHERE ts.session_type = 'group'
+    AND ts.status IN ('active', 'full')
+    AND ts.session_date BETWEEN p_from AND p_to
+    AND (p_trainer_id IS NULL OR ts.trainer_id = p_trainer_id)
+  UNION ALL
+  SELECT NULL, o.schedule_id, o.trainer_id, o.room_id, o.session_date,
+         o.start_time, o.end_time, 'active', o.capacity
+  FROM class_occurrences(p_from, p_to) o
+  WHERE p_trainer_id IS NULL OR o.trainer_id = p_trainer_id
+  ORDER BY 5, 6, 3
+$$ LANGUAGE sql STABLE;
+
+-- Rejects a live session that overlaps an occurrence of another recurring
+-- class for the same trainer or room, with the same error the exclusion
+-- constraints raise for dated sessions. Locking the trainer and room rows
+-- first serialises this with add_class_schedule(), so neither can miss a
+-- concurrent insert from the other.
+CREATE OR REPLACE FUNCTION check_class_schedule_overlap()
+RETURNS TRIGGER AS $$
+DECLARE
+  v_clash RECORD;
+BEGIN
+  PERFORM 1 FROM trainer WHERE trainer_id = NEW.trainer_id FOR SHARE;
+  PERFORM 1 FROM rooms WHERE room_id = NEW.room_id FOR SHARE;
+
+  SELECT o.schedule_id, o.trainer_id = NEW.trainer_id AS same_trainer
+    INTO v_clash
+  FROM class_occurrences(NEW.session_date, NEW.session_date) o
+  WHERE (o.trainer_id = NEW.trainer_id OR o.room_id = NEW.room_id)
+    AND o.schedule_id IS DISTINCT FROM NEW.schedule_id
+    AND timerange(o.start_time, o.end_time) && timerange(NEW.start_time, NEW.end_time)
+  ORDER BY same_trainer DESC
+  LIMIT 1;
+
+  IF FOUND THEN
+    RAISE EXCEPTION 'Overlaps recurring class % on %.', v_clash.schedule_id, NEW.session_date
+      USING ERRCODE = 'exclusion_violation',
+            CONSTRAINT = CASE WHEN v_clash.same_trainer
+                              THEN 'training_sessions_no_trainer_overlap'
+                              ELSE 'training_sessions_no_room_overlap' END;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER training_sessions_check_class_schedule
+BEFORE INSERT OR UPDATE OF trainer_id, room_id, session_date, start_time, end_time, status
+ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full'))
+EXECUTE FUNCTION check_class_schedule_overlap();
+
+-- Creates a recurring class after checking it against the other recurring
+-- classes (rule against rule, nothing is expanded) and against the live
+-- dated sessions on its weekdays within its date range. Conflicts raise
+-- exclusion_violation naming the trainer or room constraint.
+CREATE OR REPLACE FUNCTION add_class_schedule(
+  p_trainer_id  INTEGER,
+  p_room_id     INTEGER,
+  p_weekdays    SMALLINT[],
+  p_start_time  TIME,
+  p_end_time    TIME,
+  p_capacity    INTEGER,
+  p_valid_from  DATE,
+  p_valid_until DATE DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_span        daterange := daterange(p_valid_from, p_valid_until, '[]');
+  v_clash       RECORD;
+  v_schedule_id INTEGER;
+BEGIN
+  -- Bookings take FOR SHARE on these rows before checking the schedules
+  PERFORM 1 FROM trainer WHERE trainer_id = p_trainer_id FOR NO KEY UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Trainer with ID % does not exist.', p_trainer_id;
+  END IF;
+  PERFORM 1 FROM rooms WHERE room_id = p_room_id FOR NO KEY UPDATE;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Room ID % does not exist.', p_room_id;
+  END IF;
+
+  -- Two rules clash if some day in both date ranges falls on a weekday of
+  -- both; a week of the shared range is enough to find it
+  SELECT s.schedule_id, day::date AS clash_date, s.trainer_id = p_trainer_id AS same_trainer
+    INTO v_clash
+  FROM class_schedule s
+  CROSS JOIN LATERAL (SELECT daterange(s.valid_from, s.valid_until, '[]') * v_span AS shared) r
+  CROSS JOIN LATERAL generate_series(
+    lower(r.shared),
+    LEAST(lower(r.shared) + 6, COALESCE(upper(r.shared) - 1, lower(r.shared) + 6)),
+    interval '1 day'
+  ) AS day
+  WHERE s.status = 'active'
+    AND (s.trainer_id = p_trainer_id OR s.room_id = p_room_id)
+    AND s.weekdays && p_weekdays
+    AND daterange(s.valid_from, s.valid_until, '[]') && v_span
+    AND timerange(s.start_time, s.end_time) && timerange(p_start_time, p_end_time)
+    AND extract(isodow FROM day)::smallint = ANY (s.weekdays)
+    AND extract(isodow FROM day)::smallint = ANY (p_weekdays)
+  ORDER BY same_trainer DESC, clash_date
+  LIMIT 1;
+
+  IF NOT FOUND THEN
+    SELECT NULL::integer AS schedule_id, ts.session_date AS clash_date,
+           ts.trainer_id = p_trainer_id AS same_trainer
+      INTO v_clash
+    FROM training_sessions ts
+    WHERE ts.status IN ('active', 'full')
+      AND (ts.trainer_id = p_trainer_id OR ts.room_id = p_room_id)
+      AND ts.session_date <@ v_span
+      AND extract(isodow FROM ts.session_date)::smallint = ANY (p_weekdays)
+      AND timerange(ts.start_time, ts.end_time) && timerange(p_start_time, p_end_time)
+    ORDER BY same_trainer DESC, ts.session_date
+    LIMIT 1;
+  END IF;
+
+  IF v_clash.clash_date IS NOT NULL THEN
+    RAISE EXCEPTION '% is already booked on %.',
+      CASE WHEN v_clash.same_trainer THEN 'This trainer' ELSE format('Room ID %s', p_room_id) END,
+      v_clash.clash_date
+      USING ERRCODE = 'exclusion_violation',
+            CONSTRAINT = CASE WHEN v_clash.same_trainer
+                              THEN 'training_sessions_no_trainer_overlap'
+                              ELSE 'training_sessions_no_room_overlap' END;
+  END IF;
+
+  INSERT INTO class_schedule (trainer_id, room_id, weekdays, start_time, end_time, capacity, valid_from, valid_until)
+  VALUES (p_trainer_id, p_room_id, p_weekdays, p_start_time, p_end_time, p_capacity, p_valid_from, p_valid_until)
+  RETURNING schedule_id INTO v_schedule_id;
+  RETURN v_schedule_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The training_sessions row for one occurrence of a recurring class,
+-- created on first use. Concurrent callers get the same row.
+CREATE OR REPLACE FUNCTION class_session(p_schedule_id INTEGER, p_date DATE)
+RETURNS INTEGER AS $$
+DECLARE
+  v_session_id INTEGER;
+BEGIN
+  SELECT ts.session_id INTO v_session_id
+  FROM training_sessions ts
+  WHERE ts.schedule_id = p_schedule_id
+    AND ts.session_date = p_date;
+  IF FOUND THEN
+    RETURN v_session_id;
+  END IF;
+
+  INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, capacity, schedule_id)
+  SELECT o.trainer_id, o.room_id, 'group', o.session_date, o.start_time, o.end_time, o.capacity, o.schedule_id
+  FROM class_occurrences(p_date, p_date) o
+  WHERE o.schedule_id = p_schedule_id
+  ON CONFLICT (schedule_id, session_date) DO NOTHING
+  RETURNING session_id INTO v_session_id;
+
+  IF v_session_id IS NULL THEN
+    SELECT ts.session_id INTO v_session_id
+    FROM training_sessions ts
+    WHERE ts.schedule_id = p_schedule_id
+      AND ts.session_date = p_date;
+  END IF;
+  IF v_session_id IS NULL THEN
+    RAISE EXCEPTION 'Recurring class % does not meet on %.', p_schedule_id, p_date;
+  END IF;
+  RETURN v_session_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rooms with at least p_min_capacity seats and nothing live overlapping
+-- [p_start_time, p_end_time) on p_date, smallest first. Each room is one
+-- probe of the training_sessions_no_room_overlap GiST index plus that
+-- day's recurring occurrences. Pass p_room_id to ask about a single room.
+CREATE OR REPLACE FUNCTION free_rooms(
+  p_date         DATE,
+  p_start_time   TIME,
+  p_end_time     TIME,
+  p_min_capacity INTEGER DEFAULT 1,
+  p_room_id      INTEGER DEFAULT NULL
+)
+RETURNS TABLE (room_id INTEGER, room_name VARCHAR, capacity INTEGER) AS $$
+  SELECT r.room_id, r.room_name, r.capacity
+  FROM rooms r
+  WHERE r.capacity >= p_min_capacity
+    AND (p_room_id IS NULL OR r.room_id = p_room_id)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.room_id = r.room_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(p_date + p_start_time, p_date + p_end_time)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.room_id = r.room_id
+        AND timerange(o.start_time, o.end_time) && timerange(p_start_time, p_end_time)
+    )
+  ORDER BY r.capacity, r.room_id
+$$ LANGUAGE sql STABLE;
+
+-- Every bookable slot of length p_length on p_date, stepping through each
+-- trainer's availability window p_step at a time (one trainer if
+-- p_trainer_id is given). A slot is listed when the trainer has nothing
+-- live overlapping it and at least one room is free; the free rooms come
+-- with it.
+CREATE OR REPLACE FUNCTION open_slots(
+  p_length     INTERVAL,
+  p_trainer_id INTEGER DEFAULT NULL,
+  p_step       INTERVAL DEFAULT '15 minutes',
+  p_date       DATE DEFAULT CURRENT_DATE
+)
+RETURNS TABLE (
+  trainer_id      INTEGER,
+  trainer_name    VARCHAR,
+  start_time      TIME,
+  end_time        TIME,
+  free_room_ids   INTEGER[],
+  free_room_names VARCHAR[]
+) AS $$
+  SELECT t.trainer_id, t.full_name, slot.start_time, slot.end_time, rooms.ids, rooms.names
+  FROM trainer t
+  -- Step through the window as timestamps on the day itself so slots
+  -- can't wrap past midnight
+  CROSS JOIN LATERAL generate_series(
+    p_date + t.availability_start,
+    p_date + t.availability_end - p_length,
+    p_step
+  ) AS step(slot_start)
+  CROSS JOIN LATERAL (
+    SELECT step.slot_start::time AS start_time,
+           (step.slot_start + p_length)::time AS end_time
+  ) slot
+  CROSS JOIN LATERAL (
+    SELECT array_agg(f.room_id) AS ids, array_agg(f.room_name) AS names
+    FROM free_rooms(p_date, slot.start_time, slot.end_time) f
+  ) rooms
+  WHERE (p_trainer_id IS NULL OR t.trainer_id = p_trainer_id)
+    AND rooms.ids IS NOT NULL
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.trainer_id = t.trainer_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(step.slot_start, step.slot_start + p_length)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.trainer_id = t.trainer_id
+        AND timerange(o.start_time, o.end_time) && timerange(slot.start_time, slot.end_time)
+    )
+  ORDER BY t.trainer_id, slot.start_time
+$$ LANGUAGE sql STABLE;
+
+-- Books a personal session in one call: checks the trainer's availability,
+-- picks the smallest room free for that window, creates the session and
+-- enrols the member. Overlaps are rejected by the exclusion constraints
+-- (and the recurring-class trigger), so two concurrent bookings can't take
+-- the same trainer or room.
+CREATE OR REPLACE FUNCTION book_personal_session(
+  p_member_id  INTEGER,
+  p_trainer_id INTEGER,
+  p_date       DATE,
+  p_start_time TIME,
+  p_end_time   TIME
+)
+RETURNS TABLE (session_id INTEGER, room_id INTEGER, room_name VARCHAR) AS $$
+DECLARE
+  avail_start TIME;
+  avail_end   TIME;
+  conflict    TEXT;
+BEGIN
+  SELECT t.availability_start, t.availability_end
+    INTO avail_start, avail_end
+  FROM trainer t
+  WHERE t.trainer_id = p_trainer_id;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Trainer with ID % does not exist.', p_trainer_id;
+  END IF;
+
+  IF p_start_time < avail_start OR p_end_time > avail_end THEN
+    RAISE EXCEPTION 'Requested time is outside trainer''s availability.';
+  END IF;
+
+  -- A concurrent booking can take the room we picked between our lookup and
+  -- our insert; the room constraint catches that and we try the next room.
+  FOR attempt IN 1..3 LOOP
+    SELECT f.room_id, f.room_name
+      INTO room_id, room_name
+    FROM free_rooms(p_date, p_start_time, p_end_time) f
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'No rooms are available at this time.';
+    END IF;
+
+    BEGIN
+      INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, capacity)
+      VALUES (p_trainer_id, room_id, 'personal', p_date, p_start_time, p_end_time, 1)
+      RETURNING training_sessions.session_id INTO session_id;
+      EXIT;
+    EXCEPTION WHEN exclusion_violation THEN
+      GET STACKED DIAGNOSTICS conflict = CONSTRAINT_NAME;
+      IF conflict <> 'training_sessions_no_room_overlap' OR attempt = 3 THEN
+        RAISE;
+      END IF;
+    END;
+  END LOOP;
+
+  INSERT INTO session_members (session_id, member_id)
+  VALUES (session_id, p_member_id);
+
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+DROP INDEX idx_training_sessions_trainer_status_type_start;
+CREATE INDEX idx_training_sessions_trainer_status_type_start
+ON training_sessions (trainer_id, status, session_type, session_date, start_time);
+
+CREATE INDEX idx_training_sessions_live_group_date
+ON training_sessions (session_date, start_time)
+WHERE session_type = 'group' AND status IN ('active', 'full');
+
+CREATE INDEX idx_class_schedule_trainer
+ON class_schedule (trainer_id);
+
+CREATE INDEX idx_class_schedule_room
+ON class_schedule (room_id);
+
+COMMIT;
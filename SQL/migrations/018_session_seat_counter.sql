@@ -0,0 +1,188 @@
+-- Adds the seat counter and unique enrolment to a database at migration
+-- 017, e.g.
+--   psql -d FinalProject -f SQL/migrations/018_session_seat_counter.sql
+-- Duplicate enrolments are removed (the oldest is kept). Classes that were
+-- already oversold keep their members; the capacity check is added NOT VALID
+-- so it only applies to new joins, and those classes are listed.
+BEGIN;
+
+DELETE FROM session_members sm
+USING session_members keep
+WHERE keep.session_id = sm.session_id
+  AND keep.member_id = sm.member_id
+  AND keep.session_member_id < sm.session_member_id;
+
+ALTER TABLE session_members
+  ADD UNIQUE (session_id, member_id);
+
+ALTER TABLE training_sessions
+  ADD COLUMN enrolled INTEGER NOT NULL DEFAULT 0;
+
+UPDATE training_sessions ts
+SET enrolled = sm.members,
+    status = CASE WHEN ts.session_type = 'group' AND ts.status IN ('active', 'full')
+                  THEN CASE WHEN sm.members >= ts.capacity THEN 'full' ELSE 'active' END
+                  ELSE ts.status END
+FROM (
+  SELECT session_id, COUNT(*) AS members
+  FROM session_members
+  GROUP BY session_id
+) sm
+WHERE ts.session_id = sm.session_id;
+
+UPDATE training_sessions
+SET status = 'active'
+WHERE session_type = 'group' AND status = 'full' AND enrolled < capacity;
+
+DO $$
+DECLARE
+  v_session RECORD;
+BEGIN
+  FOR v_session IN
+    SELECT session_id, enrolled, capacity FROM training_sessions WHERE enrolled > capacity
+  LOOP
+    RAISE NOTICE 'Session % is oversold: % members for % seats', v_session.session_id, v_session.enrolled, v_session.capacity;
+  END LOOP;
+END;
+$$;
+
+ALTER TABLE training_sessions
+  ADD CONSTRAINT training_sessions_enrolled_check CHECK (enrolled >= 0 AND enrolled <= capacity) NOT VALID;
+
+DROP FUNCTION class_calendar(DATE, DATE, INTEGER);
+
+-- Live group classes between p_from and p_to: dated sessions plus the
+-- expanded recurring occurrences (session_id NULL until someone joins).
+CREATE OR REPLACE FUNCTION class_calendar(p_from DATE, p_to DATE, p_trainer_id INTEGER DEFAULT NULL)
+RETURNS TABLE (
+  session_id   INTEGER,
+  schedule_id  INTEGER,
+  trainer_id   INTEGER,
+  room_id      INTEGER,
+  session_date DATE,
+  start_time   TIME,
+  end_time     TIME,
+  status       VARCHAR,
+  capacity     INTEGER,
+  enrolled     INTEGER
+) AS $$
+  SELECT ts.session_id, ts.schedule_id, ts.trainer_id, ts.room_id, ts.session_date,
+         ts.start_time, ts.end_time, ts.status, ts.capacity, ts.enrolled
+  FROM training_sessions ts
+  WHERE ts.session_type = 'group'
+    AND ts.status IN ('active', 'full')
+    AND ts.session_date BETWEEN p_from AND p_to
+    AND (p_trainer_id IS NULL OR ts.trainer_id = p_trainer_id)
+  UNION ALL
+  SELECT NULL, o.schedule_id, o.trainer_id, o.room_id, o.session_date,
+         o.start_time, o.end_time, 'active', o.capacity, 0
+  FROM class_occurrences(p_from, p_to) o
+  WHERE p_trainer_id IS NULL OR o.trainer_id = p_trainer_id
+  ORDER BY 5, 6, 3
+$$ LANGUAGE sql STABLE;
+
+DROP TRIGGER training_sessions_check_class_schedule ON training_sessions;
+
+CREATE TRIGGER training_sessions_check_class_schedule
+BEFORE INSERT ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full'))
+EXECUTE FUNCTION check_class_schedule_overlap();
+
+-- Only when the session moves or comes back to life; seat counter updates
+-- (including active <-> full) skip the check
+CREATE TRIGGER training_sessions_recheck_class_schedule
+BEFORE UPDATE OF trainer_id, room_id, session_date, start_time, end_time, status
+ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full') AND (
+  OLD.status NOT IN ('active', 'full') OR
+  (OLD.trainer_id, OLD.room_id, OLD.session_date, OLD.start_time, OLD.end_time) IS DISTINCT FROM
+  (NEW.trainer_id, NEW.room_id, NEW.session_date, NEW.start_time, NEW.end_time)
+))
+EXECUTE FUNCTION check_class_schedule_overlap();
+
+-- Takes a seat for each new member of a session with one conditional
+-- update of its counter: the row lock queues concurrent joins on the
+-- session and each re-checks enrolled < capacity after the one before it,
+-- so a class can't be oversold. A group class that fills up becomes 'full'.
+-- Raising aborts the whole insert, membership row included.
+CREATE OR REPLACE FUNCTION take_session_seat()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE training_sessions ts
+  SET enrolled = ts.enrolled + 1,
+      status = CASE WHEN ts.session_type = 'group' AND ts.enrolled + 1 >= ts.capacity
+                    THEN 'full' ELSE ts.status END
+  WHERE ts.session_id = NEW.session_id
+    AND ts.status = 'active'
+    AND ts.enrolled < ts.capacity;
+
+  IF NOT FOUND THEN
+    IF EXISTS (SELECT 1 FROM training_sessions WHERE session_id = NEW.session_id AND status = 'full') THEN
+      RAISE EXCEPTION 'This class is already full.';
+    END IF;
+    RAISE EXCEPTION 'Session % is not open for joining.', NEW.session_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Gives seats back when members leave; a full class that has room again
+-- goes back to 'active'.
+CREATE OR REPLACE FUNCTION release_session_seats()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE training_sessions ts
+  SET enrolled = ts.enrolled - d.members,
+      status = CASE WHEN ts.status = 'full' AND ts.enrolled - d.members < ts.capacity
+                    THEN 'active' ELSE ts.status END
+  FROM (
+    SELECT session_id, COUNT(*) AS members
+    FROM old_members
+    GROUP BY session_id
+  ) d
+  WHERE ts.session_id = d.session_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER session_members_take_seat
+AFTER INSERT ON session_members
+FOR EACH ROW EXECUTE FUNCTION take_session_seat();
+
+CREATE TRIGGER session_members_release_seats
+AFTER DELETE ON session_members
+REFERENCING OLD TABLE AS old_members
+FOR EACH STATEMENT EXECUTE FUNCTION release_session_seats();
+
+-- Enrols a member in a group class in one statement and returns the seats
+-- left. The seat itself is taken by the session_members trigger; the
+-- unique (session_id, member_id) key turns a repeat join into an error
+-- instead of a second seat.
+CREATE OR REPLACE FUNCTION join_class(p_session_id INTEGER, p_member_id INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+  v_left INTEGER;
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM training_sessions WHERE session_id = p_session_id AND session_type = 'group'
+  ) THEN
+    RAISE EXCEPTION 'Session % is not a group class.', p_session_id;
+  END IF;
+
+  INSERT INTO session_members (session_id, member_id)
+  VALUES (p_session_id, p_member_id)
+  ON CONFLICT (session_id, member_id) DO NOTHING;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'You have already joined this class.';
+  END IF;
+
+  SELECT capacity - enrolled INTO v_left
+  FROM training_sessions
+  WHERE session_id = p_session_id;
+  RETURN v_left;
+END;
+$$ LANGUAGE plpgsql;
+COMMIT;
@@ -0,0 +1,96 @@
+-- Adds the background job queue to a database at migration 018, e.g.
+--   psql -d FinalProject -f SQL/migrations/019_job_queue.sql
+-- Live sessions that already exist get their close job too.
+BEGIN;
+
+-- Background work for app.worker. Workers claim queued jobs whose run_at
+-- has come with FOR UPDATE SKIP LOCKED; failed jobs go back to queued with
+-- a later run_at until max_attempts, then stay as dead for an admin.
+CREATE TABLE job (
+  job_id        BIGSERIAL PRIMARY KEY,
+  kind          VARCHAR(40) NOT NULL,
+  payload       JSONB NOT NULL DEFAULT '{}',
+  status        VARCHAR(10) NOT NULL DEFAULT 'queued',
+  attempts      INTEGER NOT NULL DEFAULT 0,
+  max_attempts  INTEGER NOT NULL DEFAULT 5,
+  run_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_by     VARCHAR(60),
+  locked_at     TIMESTAMPTZ,
+  last_error    TEXT,
+  result        JSONB,
+  created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at   TIMESTAMPTZ,
+  CHECK (status IN ('queued', 'running', 'done', 'dead')),
+  CHECK (max_attempts > 0)
+);
+
+-- What workers claim next, and what the reaper looks at; finished jobs
+-- stay out of both
+CREATE INDEX idx_job_queued_run_at
+ON job (run_at)
+WHERE status = 'queued';
+
+CREATE INDEX idx_job_running_locked_at
+ON job (locked_at)
+WHERE status = 'running';
+
+-- Queues a job for app.worker in the caller's transaction, so it exists
+-- exactly when the work that asked for it commits. Idle workers are woken
+-- on commit unless the job is for later.
+CREATE OR REPLACE FUNCTION enqueue_job(
+  p_kind VARCHAR,
+  p_payload JSONB DEFAULT '{}',
+  p_run_at TIMESTAMPTZ DEFAULT now(),
+  p_max_attempts INTEGER DEFAULT 5
+)
+RETURNS BIGINT AS $$
+DECLARE
+  v_job_id BIGINT;
+BEGIN
+  INSERT INTO job (kind, payload, run_at, max_attempts)
+  VALUES (p_kind, p_payload, p_run_at, p_max_attempts)
+  RETURNING job_id INTO v_job_id;
+
+  IF p_run_at <= now() THEN
+    PERFORM pg_notify('job_queued', p_kind);
+  END IF;
+  RETURN v_job_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Schedules the complete_session job for when a live session ends. A
+-- session that moves gets another job; the job itself skips sessions that
+-- are no longer live or haven't ended yet.
+CREATE OR REPLACE FUNCTION enqueue_session_close()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM enqueue_job(
+    'complete_session',
+    jsonb_build_object('session_id', NEW.session_id),
+    (NEW.session_date + NEW.end_time)::timestamptz
+  );
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER training_sessions_enqueue_close
+AFTER INSERT ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full'))
+EXECUTE FUNCTION enqueue_session_close();
+
+CREATE TRIGGER training_sessions_reenqueue_close
+AFTER UPDATE OF session_date, end_time, status ON training_sessions
+FOR EACH ROW
+WHEN (NEW.status IN ('active', 'full') AND (
+  OLD.status NOT IN ('active', 'full') OR
+  (OLD.session_date, OLD.end_time) IS DISTINCT FROM (NEW.session_date, NEW.end_time)
+))
+EXECUTE FUNCTION enqueue_session_close();
+
+SELECT enqueue_job('complete_session', jsonb_build_object('session_id', session_id),
+                   (session_date + end_time)::timestamptz)
+FROM training_sessions
+WHERE status IN ('active', 'full');
+
+COMMIT;
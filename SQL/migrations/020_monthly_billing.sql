@@ -0,0 +1,61 @@
+-- Adds billing rates and the set-wise monthly billing run to a database at
+-- migration 019, e.g.
+--   psql -d FinalProject -f SQL/migrations/020_monthly_billing.sql
+BEGIN;
+
+CREATE TABLE billing_rate (
+  session_type VARCHAR(10) PRIMARY KEY,
+  rate         NUMERIC(10,2) NOT NULL CHECK (rate >= 0),
+  CHECK (session_type IN ('group' , 'personal'))
+);
+
+INSERT INTO billing_rate (session_type, rate) VALUES
+('personal', 60.00),
+('group', 15.00);
+
+ALTER TABLE invoice
+  ADD COLUMN billing_period DATE,
+  ADD UNIQUE (member_id, billing_period);
+
+-- Covered by the (member_id, billing_period) key
+DROP INDEX IF EXISTS idx_invoice_member_id;
+
+CREATE INDEX idx_training_sessions_date
+ON training_sessions (session_date);
+
+-- One chunk of a monthly billing run: invoices every member in
+-- [p_from_member, p_to_member) for the sessions they were enrolled in during
+-- the month starting p_period that weren't cancelled, priced by p_rates
+-- ({"session_type": rate}, the billing_rate table when the run started).
+-- One INSERT ... SELECT; members already billed for the month are skipped,
+-- so a chunk can simply be run again. Returns the invoices created.
+CREATE OR REPLACE FUNCTION bill_members(
+  p_period DATE,
+  p_from_member INTEGER,
+  p_to_member INTEGER,
+  p_rates JSONB
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_billed INTEGER;
+BEGIN
+  INSERT INTO invoice (member_id, total_amount, billing_period)
+  SELECT sm.member_id, SUM((p_rates ->> ts.session_type)::numeric), p_period
+  FROM session_members sm
+  JOIN training_sessions ts
+    ON ts.session_id = sm.session_id
+  WHERE sm.member_id >= p_from_member
+    AND sm.member_id < p_to_member
+    AND ts.session_date >= p_period
+    AND ts.session_date < p_period + interval '1 month'
+    AND ts.status <> 'cancelled'
+    AND p_rates ? ts.session_type
+  GROUP BY sm.member_id
+  ON CONFLICT (member_id, billing_period) DO NOTHING;
+
+  GET DIAGNOSTICS v_billed = ROW_COUNT;
+  RETURN v_billed;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
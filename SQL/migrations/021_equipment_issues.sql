@@ -0,0 +1,269 @@
+-- Adds equipment issue tracking, the maintenance queue and out-of-order
+-- aware room selection to a database at migration 020, e.g.
+--   psql -d FinalProject -f SQL/migrations/021_equipment_issues.sql
+-- Open issues are dated to when the migration runs. The status check is
+-- added NOT VALID, so any legacy codes other than 0/1/2 stay as they are.
+BEGIN;
+
+ALTER TABLE rooms
+  ADD COLUMN out_of_order_equipment INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE equipment
+  ADD COLUMN issue_since TIMESTAMPTZ,
+  ADD COLUMN issue_note VARCHAR(200),
+  ADD CHECK (status IN (0, 1, 2)) NOT VALID;
+
+UPDATE equipment SET issue_since = now() WHERE status <> 0;
+
+UPDATE rooms r
+SET out_of_order_equipment = e.broken
+FROM (
+  SELECT room_id, COUNT(*) AS broken
+  FROM equipment
+  WHERE status = 2
+  GROUP BY room_id
+) e
+WHERE r.room_id = e.room_id;
+
+-- Equipment with an open issue, longest-standing first
+CREATE OR REPLACE VIEW maintenance_queue AS
+SELECT
+  e.equipment_id,
+  e.room_id,
+  r.room_name,
+  e.type,
+  e.status,
+  e.issue_since,
+  e.issue_note
+FROM equipment e
+JOIN rooms r
+  ON r.room_id = e.room_id
+WHERE e.status <> 0
+ORDER BY e.issue_since, e.equipment_id;
+
+-- Dates an issue from when the equipment first stopped being operational
+-- (going from needs maintenance to out of order keeps the date) and clears
+-- it when the equipment is fixed
+CREATE OR REPLACE FUNCTION track_equipment_issue()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.status = 0 THEN
+    NEW.issue_since := NULL;
+    NEW.issue_note := NULL;
+  ELSIF TG_OP = 'INSERT' OR OLD.status = 0 THEN
+    NEW.issue_since := COALESCE(NEW.issue_since, now());
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER equipment_track_issue
+BEFORE INSERT OR UPDATE OF status ON equipment
+FOR EACH ROW EXECUTE FUNCTION track_equipment_issue();
+
+-- Keeps rooms.out_of_order_equipment in step, so room selection can skip
+-- rooms with broken equipment by reading the room row alone
+CREATE OR REPLACE FUNCTION count_out_of_order_equipment()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 2 THEN
+    UPDATE rooms
+    SET out_of_order_equipment = out_of_order_equipment - 1
+    WHERE room_id = OLD.room_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 2 THEN
+    UPDATE rooms
+    SET out_of_order_equipment = out_of_order_equipment + 1
+    WHERE room_id = NEW.room_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER equipment_count_out_of_order
+AFTER INSERT OR DELETE ON equipment
+FOR EACH ROW
+EXECUTE FUNCTION count_out_of_order_equipment();
+
+CREATE TRIGGER equipment_recount_out_of_order
+AFTER UPDATE OF status, room_id ON equipment
+FOR EACH ROW
+WHEN ((OLD.status = 2 OR NEW.status = 2) AND
+      (OLD.status, OLD.room_id) IS DISTINCT FROM (NEW.status, NEW.room_id))
+EXECUTE FUNCTION count_out_of_order_equipment();
+
+DROP FUNCTION free_rooms(DATE, TIME, TIME, INTEGER, INTEGER);
+DROP FUNCTION open_slots(INTERVAL, INTEGER, INTERVAL, DATE);
+DROP FUNCTION book_personal_session(INTEGER, INTEGER, DATE, TIME, TIME);
+
+-- Rooms with at least p_min_capacity seats and nothing live overlapping
+-- [p_start_time, p_end_time) on p_date, smallest first. Each room is one
+-- probe of the training_sessions_no_room_overlap GiST index plus that
+-- day's recurring occurrences. Pass p_room_id to ask about a single room,
+-- p_skip_out_of_order to leave out rooms with out-of-order equipment.
+CREATE OR REPLACE FUNCTION free_rooms(
+  p_date         DATE,
+  p_start_time   TIME,
+  p_end_time     TIME,
+  p_min_capacity INTEGER DEFAULT 1,
+  p_room_id      INTEGER DEFAULT NULL,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (room_id INTEGER, room_name VARCHAR, capacity INTEGER) AS $$
+  SELECT r.room_id, r.room_name, r.capacity
+  FROM rooms r
+  WHERE r.capacity >= p_min_capacity
+    AND (p_room_id IS NULL OR r.room_id = p_room_id)
+    AND NOT (p_skip_out_of_order AND r.out_of_order_equipment > 0)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.room_id = r.room_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(p_date + p_start_time, p_date + p_end_time)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.room_id = r.room_id
+        AND timerange(o.start_time, o.end_time) && timerange(p_start_time, p_end_time)
+    )
+  ORDER BY r.capacity, r.room_id
+$$ LANGUAGE sql STABLE;
+
+-- Every bookable slot of length p_length on p_date, stepping through each
+-- trainer's availability window p_step at a time (one trainer if
+-- p_trainer_id is given). A slot is listed when the trainer has nothing
+-- live overlapping it and at least one room is free; the free rooms come
+-- with it.
+CREATE OR REPLACE FUNCTION open_slots(
+  p_length     INTERVAL,
+  p_trainer_id INTEGER DEFAULT NULL,
+  p_step       INTERVAL DEFAULT '15 minutes',
+  p_date       DATE DEFAULT CURRENT_DATE,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+  trainer_id      INTEGER,
+  trainer_name    VARCHAR,
+  start_time      TIME,
+  end_time        TIME,
+  free_room_ids   INTEGER[],
+  free_room_names VARCHAR[]
+) AS $$
+  SELECT t.trainer_id, t.full_name, slot.start_time, slot.end_time, rooms.ids, rooms.names
+  FROM trainer t
+  -- Step through the window as timestamps on the day itself so slots
+  -- can't wrap past midnight
+  CROSS JOIN LATERAL generate_series(
+    p_date + t.availability_start,
+    p_date + t.availability_end - p_length,
+    p_step
+  ) AS step(slot_start)
+  CROSS JOIN LATERAL (
+    SELECT step.slot_start::time AS start_time,
+           (step.slot_start + p_length)::time AS end_time
+  ) slot
+  CROSS JOIN LATERAL (
+    SELECT array_agg(f.room_id) AS ids, array_agg(f.room_name) AS names
+    FROM free_rooms(p_date, slot.start_time, slot.end_time, p_skip_out_of_order => p_skip_out_of_order) f
+  ) rooms
+  WHERE (p_trainer_id IS NULL OR t.trainer_id = p_trainer_id)
+    AND rooms.ids IS NOT NULL
+    AND NOT EXISTS (
+      SELECT 1
+      FROM training_sessions ts
+      WHERE ts.trainer_id = t.trainer_id
+        AND ts.status IN ('active', 'full')
+        AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time)
+            && tsrange(step.slot_start, step.slot_start + p_length)
+    )
+    AND NOT EXISTS (
+      SELECT 1
+      FROM class_occurrences(p_date, p_date) o
+      WHERE o.trainer_id = t.trainer_id
+        AND timerange(o.start_time, o.end_time) && timerange(slot.start_time, slot.end_time)
+    )
+  ORDER BY t.trainer_id, slot.start_time
+$$ LANGUAGE sql STABLE;
+
+-- Books a personal session in one call: checks the trainer's availability,
+-- picks the smallest room free for that window, creates the session and
+-- enrols the member. Overlaps are rejected by the exclusion constraints
+-- (and the recurring-class trigger), so two concurrent bookings can't take
+-- the same trainer or room. With p_skip_out_of_order, rooms with
+-- out-of-order equipment aren't picked.
+CREATE OR REPLACE FUNCTION book_personal_session(
+  p_member_id  INTEGER,
+  p_trainer_id INTEGER,
+  p_date       DATE,
+  p_start_time TIME,
+  p_end_time   TIME,
+  p_skip_out_of_order BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (session_id INTEGER, room_id INTEGER, room_name VARCHAR) AS $$
+DECLARE
+  avail_start TIME;
+  avail_end   TIME;
+  conflict    TEXT;
+BEGIN
+  SELECT t.availability_start, t.availability_end
+    INTO avail_start, avail_end
+  FROM trainer t
+  WHERE t.trainer_id = p_trainer_id;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Trainer with ID % does not exist.', p_trainer_id;
+  END IF;
+
+  IF p_start_time < avail_start OR p_end_time > avail_end THEN
+    RAISE EXCEPTION 'Requested time is outside trainer''s availability.';
+  END IF;
+
+  -- A concurrent booking can take the room we picked between our lookup and
+  -- our insert; the room constraint catches that and we try the next room.
+  FOR attempt IN 1..3 LOOP
+    SELECT f.room_id, f.room_name
+      INTO room_id, room_name
+    FROM free_rooms(p_date, p_start_time, p_end_time, p_skip_out_of_order => p_skip_out_of_order) f
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'No rooms are available at this time.';
+    END IF;
+
+    BEGIN
+      INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, capacity)
+      VALUES (p_trainer_id, room_id, 'personal', p_date, p_start_time, p_end_time, 1)
+      RETURNING training_sessions.session_id INTO session_id;
+      EXIT;
+    EXCEPTION WHEN exclusion_violation THEN
+      GET STACKED DIAGNOSTICS conflict = CONSTRAINT_NAME;
+      IF conflict <> 'training_sessions_no_room_overlap' OR attempt = 3 THEN
+        RAISE;
+      END IF;
+    END;
+  END LOOP;
+
+  INSERT INTO session_members (session_id, member_id)
+  VALUES (session_id, p_member_id);
+
+  RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Inventory pages by room or by type, in equipment_id order
+CREATE INDEX idx_equipment_room
+ON equipment (room_id, equipment_id);
+
+CREATE INDEX idx_equipment_type
+ON equipment (type, equipment_id);
+
+-- Only the few items with an open issue: the maintenance queue and the
+-- status filters read this instead of the whole inventory
+CREATE INDEX idx_equipment_open_issues
+ON equipment (issue_since, equipment_id)
+WHERE status <> 0;
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Adds the indexes behind member search (app/member_search.py) to a
+-- database at migration 021, e.g.
+--   psql -d FinalProject -f SQL/migrations/022_member_search.sql
+-- Needs the pg_trgm contrib extension. Both indexes are built while the
+-- member table is locked against writes; on a large table consider running
+-- the CREATE INDEX statements by hand with CONCURRENTLY instead.
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION normalize_phone(p_phone TEXT)
+RETURNS TEXT AS $$
+  SELECT regexp_replace(p_phone, '[^0-9]', '', 'g')
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE INDEX idx_member_full_name_trgm
+ON member USING gist (full_name gist_trgm_ops);
+
+CREATE INDEX idx_member_phone_digits
+ON member ((normalize_phone(phone)) COLLATE "C");
+
+COMMIT;
@@ -1,12 +1,24 @@
+import json
+import os
 import psycopg2
-from app.validators import get_valid_time_input, validate_time
-
-def add_room(connection):
+from psycopg2 import errors
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from app.billing import billing_progress, get_rates, parse_period, set_rate, start_billing_run
+from app.dashboard import invalidate_dashboard
+from app.equipment import EQUIPMENT_PAGE_SIZE, EQUIPMENT_STATUS, SKIP_OUT_OF_ORDER_ROOMS, find_equipment, maintenance_queue, set_equipment_status, status_label
+from app.database import execute_prepared, get_connection, query_stats, replica_status, reset_query_stats, write_query_stats
+from app.jobs import job_counts, list_jobs, retry_dead_jobs, submit_job
+from app.member_search import choose_member, print_matches, search_members
+from app.refdata import get_equipment, get_room, get_trainer, invalidate_refdata
+from app.validators import get_valid_date_input, get_valid_time_input, parse_weekdays, validate_date, validate_time
+
+def add_room():
   room_name = input("Room name: ")
   capacity = input("Capacity: ")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         INSERT INTO rooms (room_name, capacity)
@@ -16,65 +28,78 @@ def add_room(connection):
         (room_name, capacity),
       )
       room_id = cur.fetchone()[0]
-    connection.commit()
+      connection.commit()
+    invalidate_refdata('rooms')
     print(f"Added Room with ID: {room_id}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Adding Room Failed, Error:", e)
 
-def create_class(connection):
+def create_class():
   trainer_id = input("Assign Trainer by ID: ")
   room_id = input("Select Room by ID: ")
   capacity = input("What is the max capacity of this class: ")
+  class_date = get_valid_date_input("Date (YYYY-MM-DD, blank for today; first date if it repeats): ")
+  if not validate_date(class_date):
+    return
+
+  weekdays = None
+  repeat_until = None
+  repeat = input("Repeat weekly on (e.g. Mon,Wed; blank for a one-off class): ").strip()
+  if repeat:
+    weekdays = parse_weekdays(repeat)
+    if weekdays is None:
+      print("Days must be given like Mon,Wed,Fri.")
+      return
+    until = input("Repeat until (YYYY-MM-DD, blank for no end date): ").strip()
+    if until:
+      try:
+        repeat_until = datetime.strptime(until, "%Y-%m-%d").date()
+      except ValueError:
+        print("Invalid date format. Format should be in YYYY-MM-DD.")
+        return
+      if repeat_until < class_date:
+        print("The end date must be on or after the first date.")
+        return
+
   start_time = get_valid_time_input("Start Time(HH:MM): ")
   end_time = get_valid_time_input("End Time (HH:MM): ")
 
   if not validate_time(start_time, end_time):
     return
+
+  try:
+    capacity = int(capacity)
+  except ValueError:
+    print("Capacity must be a whole number.")
+    return
   
   # Check if trainer exists
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT availability_start, availability_end
-        FROM trainer
-        WHERE trainer_id = %s
-        """,
-        (trainer_id,),
-      )
-      row = cur.fetchone()
+    trainer = get_trainer(trainer_id)
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error checking trainer:", e)
     return
 
-  if row is None:
+  if trainer is None:
       print(f"Trainer with ID {trainer_id} does not exist.")
       return
-  avail_start, avail_end = row
+  _, _, avail_start, avail_end = trainer
 
   #Check requested slot is within trainer availability
   if start_time < avail_start or end_time > avail_end:
     print( "Requested time is outside trainer's availability.\n")
     return
 
+  if weekdays:
+    create_class_schedule(trainer_id, room_id, capacity, weekdays, start_time, end_time, class_date, repeat_until)
+    return
+
   # Check for overlapping sessions for this trainer (any active session)
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT 1
-        FROM training_sessions
-        WHERE trainer_id = %s
-          AND status = 'active'
-          AND NOT (end_time <= %s OR start_time >= %s)
-        """,
-        (trainer_id, start_time, end_time),
-      )
+    with get_connection() as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'trainer_overlap', (trainer_id, class_date, start_time, end_time))
       conflict = cur.fetchone()
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error checking for overlapping sessions:", e)
     return
 
@@ -82,66 +107,117 @@ def create_class(connection):
     print("This trainer already has a session that overlaps this time.")
     return
   
-  # Check if room is already used
+  # Check the room exists, is big enough and is free for this time window
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
-        SELECT isBooked
-        FROM rooms
-        WHERE room_id = %s
+        SELECT r.capacity, r.out_of_order_equipment,
+               EXISTS (SELECT 1 FROM free_rooms(%s, %s, %s, 1, r.room_id))
+        FROM rooms r
+        WHERE r.room_id = %s
         """,
-        (room_id,),
+        (class_date, start_time, end_time, room_id),
       )
       row = cur.fetchone()
       if row is None:
         print(f"Room ID {room_id} does not exist.")
         return
-      isBooked = row[0]
+      room_capacity, out_of_order, is_free = row
+      usable = not (SKIP_OUT_OF_ORDER_ROOMS and out_of_order)
+
+      alternatives = []
+      if not is_free or not usable:
+        cur.execute(
+          """
+          SELECT room_id, room_name, capacity
+          FROM free_rooms(%s, %s, %s, %s, p_skip_out_of_order => %s)
+          """,
+          (class_date, start_time, end_time, capacity, SKIP_OUT_OF_ORDER_ROOMS),
+        )
+        alternatives = cur.fetchall()
   except psycopg2.Error as e:
-    connection.rollback()
-    print("Error checking trainer:", e)
+    print("Error checking room:", e)
     return
-  
-  if isBooked:
-    print(f"Room ID {room_id} is already booked")
+
+  if room_capacity < capacity:
+    print(f"Room ID {room_id} only holds {room_capacity} people")
+    return
+
+  if not is_free or not usable:
+    if not is_free:
+      print(f"Room ID {room_id} is already booked at this time")
+    else:
+      print(f"Room ID {room_id} has {out_of_order} out-of-order equipment")
+    for free_id, free_name, free_capacity in alternatives:
+      print(f"- Free: Room {free_id} | {free_name} | Capacity: {free_capacity}")
     return
   
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
-        INSERT INTO training_sessions (trainer_id, room_id, session_type, start_time, end_time, status, capacity)
-        VALUES(%s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO training_sessions (trainer_id, room_id, session_type, session_date, start_time, end_time, status, capacity)
+        VALUES(%s, %s, %s, %s, %s, %s, %s, %s)
         RETURNING session_id
         """,
-        (trainer_id, room_id, 'group', start_time, end_time, 'active', capacity),
+        (trainer_id, room_id, 'group', class_date, start_time, end_time, 'active', capacity),
       )
       session_id = cur.fetchone()[0]
+      connection.commit()
+    print(f"Class Created with ID: {session_id}")
+  except errors.ExclusionViolation as e:
+    # Lost a race with another booking after the checks above
+    if e.diag.constraint_name == 'training_sessions_no_room_overlap':
+      print(f"Room ID {room_id} is already booked at this time")
+    else:
+      print("This trainer already has a session that overlaps this time.")
+  except psycopg2.Error as e:
+    print("Failed Creating a class, Error:", e)
 
-      # Mark room as booked
+def create_class_schedule(trainer_id, room_id, capacity, weekdays, start_time, end_time, valid_from, valid_until):
+  """
+  Recurring class. add_class_schedule() checks it against the other
+  recurring classes and the dated sessions on its weekdays without
+  expanding it; occurrences become sessions only when someone joins one.
+  """
+  try:
+    room = get_room(room_id)
+  except psycopg2.Error as e:
+    print("Error checking room:", e)
+    return
+
+  if room is None:
+    print(f"Room ID {room_id} does not exist.")
+    return
+  if room[2] < capacity:
+    print(f"Room ID {room_id} only holds {room[2]} people")
+    return
+
+  try:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
-        """
-        UPDATE rooms
-        SET isBooked = TRUE
-        WHERE room_id = %s
-        """,
-        (room_id,),
+        "SELECT add_class_schedule(%s, %s, %s::smallint[], %s, %s, %s, %s, %s)",
+        (trainer_id, room_id, weekdays, start_time, end_time, capacity, valid_from, valid_until),
       )
-    connection.commit()
-    print(f"Class Created with ID: {session_id}")
+      schedule_id = cur.fetchone()[0]
+      connection.commit()
+    print(f"Recurring Class Created with ID: {schedule_id}")
+  except (errors.ExclusionViolation, errors.RaiseException) as e:
+    print(e.diag.message_primary)
   except psycopg2.Error as e:
-    connection.rollback()
     print("Failed Creating a class, Error:", e)
 
-def create_invoice(connection):
+def create_invoice():
   print("\n--------- Create Invoice --------")
-  member_id = input("Enter Member ID to bill: ")
+  member_id = choose_member(input("Enter Member ID to bill (or a name / phone number to search): "))
+  if member_id is None:
+    return
   amount = input("Enter total amount: ")
 
   # Check member exists
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
           "SELECT 1 FROM member WHERE member_id = %s",
           (member_id,),
@@ -156,7 +232,7 @@ def create_invoice(connection):
 
   # Create the invoice
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         INSERT INTO invoice (member_id, total_amount)
@@ -166,13 +242,13 @@ def create_invoice(connection):
         (member_id, amount),
       )
       invoice_id = cur.fetchone()[0]
-    connection.commit()
+      connection.commit()
+    invalidate_dashboard(member_id)
     print(f"Invoice created: ID {invoice_id} for Member {member_id}, Amount(CAD): {amount}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Creating invoice failed, Error:", e)
 
-def record_payment(connection):
+def record_payment():
   print("\n--------- Record Payment --------")
   invoice_id = input("Enter Invoice ID: ").strip()
   amount_str = input("Enter payment amount: ").strip()
@@ -189,61 +265,42 @@ def record_payment(connection):
     print("Amount must be greater than 0.")
     return
 
-  #Check invoice exists and get its info
+  # Lock the invoice row, check its balance and insert the payment in one
+  # transaction so concurrent payments can't overpay it
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
-        SELECT total_amount, status
+        SELECT remaining, status, member_id
         FROM invoice
         WHERE invoice_id = %s
+        FOR UPDATE
         """,
         (invoice_id,),
       )
       row = cur.fetchone()
-  except psycopg2.Error as e:
-    print(f"Error fetching invoice {invoice_id}:", e)
-    return
 
-  if row is None:
-    print(f"Invoice with ID {invoice_id} does not exist.")
-    return
-
-  total_amount, status = row
+      if row is None:
+        print(f"Invoice with ID {invoice_id} does not exist.")
+        return
 
-  if status == 'cancelled':
-    print("Cannot record payment on a cancelled invoice.")
-    return
+      remaining, status, member_id = row
 
-  if status == 'paid':
-    print("This invoice is already fully paid.")
-    return
+      if status == 'cancelled':
+        print("Cannot record payment on a cancelled invoice.")
+        return
 
-  #Check how much has already been paid
-  try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT COALESCE(SUM(amount), 0)
-        FROM payment
-        WHERE invoice_id = %s
-        """,
-        (invoice_id,),
-      )
-      paid_so_far = cur.fetchone()[0]
-  except psycopg2.Error as e:
-    print("Error checking existing payments:", e)
-    return
+      if status == 'paid':
+        print("This invoice is already fully paid.")
+        return
 
-  remaining = float(total_amount) - float(paid_so_far)
+      remaining = float(remaining)
 
-  if amount > remaining:
-    print(f"Cannot Process, payment exceeds remaining balance. Remaining: {remaining}")
-    return
+      if amount > remaining:
+        print(f"Cannot Process, payment exceeds remaining balance. Remaining: {remaining}")
+        return
 
-  #Insert payment and update invoice status if fully paid
-  try:
-    with connection.cursor() as cur:
+      # The payment trigger updates the invoice balance and status
       cur.execute(
         """
         INSERT INTO payment (invoice_id, amount, method)
@@ -251,20 +308,10 @@ def record_payment(connection):
         """,
         (invoice_id, amount, method),
       )
+      connection.commit()
+    invalidate_dashboard(member_id)
 
-      # Recompute remaining after this payment
-      new_remaining = remaining - amount
-      if new_remaining == 0:
-        cur.execute(
-          """
-          UPDATE invoice
-          SET status = 'paid'
-          WHERE invoice_id = %s
-          """,
-          (invoice_id,),
-        )
-
-    connection.commit()
+    new_remaining = remaining - amount
     if new_remaining == 0:
       print(f"Payment recorded. Invoice {invoice_id} is now PAID.")
     else:
@@ -273,29 +320,38 @@ def record_payment(connection):
       )
 
   except psycopg2.Error as e:
-    connection.rollback()
     print("Recording payment failed, Error:", e)
 
-def add_equipment(connection):
+def post_settlement_file():
+  print("\n--------- Post Settlement File --------")
+  print("CSV columns: invoice_id, amount, method, payment_date (optional)")
+  path = input("Path to settlement file: ").strip()
+
+  # Posting runs on a background worker; the file must be readable there too
+  path = os.path.abspath(path)
+  if not os.path.isfile(path):
+    print("Could not read file:", path)
+    return
+
+  try:
+    job_id = submit_job('post_settlement', {'path': path})
+  except psycopg2.Error as e:
+    print("Queueing settlement failed, nothing was posted. Error:", e)
+    return
+  print(f"Settlement queued as job {job_id}. The per-row report will be written to {path}.report.csv")
+  print("Check progress under Background jobs.")
+
+def add_equipment():
   print("\n--------- Add Equipment --------")
   room_id = input("Room ID: ")
   eq_type = input("Equipment type: ")
 
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT *
-        FROM rooms
-        WHERE room_id = %s
-        """,
-        (room_id,),
-      )
-      row = cur.fetchone()
-      if row is None:
-        print(f"Room ID {room_id} does not exist.")
-        return
-      
+    if get_room(room_id) is None:
+      print(f"Room ID {room_id} does not exist.")
+      return
+
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         INSERT INTO equipment (room_id, type, status)
@@ -305,29 +361,19 @@ def add_equipment(connection):
         (room_id, eq_type, 0),
       )
       equipment_id = cur.fetchone()[0]
-    connection.commit()
+      connection.commit()
+    invalidate_refdata('equipment')
     print(f"Equipment added with ID {equipment_id}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Adding equipment failed:", e)
 
-def update_equipment_issues(connection):
-  list_equipment(connection)
+def update_equipment_issues():
   print("\n--------- Log Equipment Issue --------")
   equipment_id = input("Enter equipment ID: ").strip()
 
   # 1) Check that equipment exists
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT type, status
-        FROM equipment
-        WHERE equipment_id = %s
-        """,
-        (equipment_id,),
-      )
-      row = cur.fetchone()
+    row = get_equipment(equipment_id)
   except psycopg2.Error as e:
     print(f"Error fetching equipment {equipment_id}:", e)
     return
@@ -335,11 +381,12 @@ def update_equipment_issues(connection):
   if row is None:
     print(f"Equipment with ID {equipment_id} does not exist.")
     return
+  _, room_id, eq_type, status = row
+  print(f"Equipment {equipment_id} | Room {room_id} | {eq_type} | Status: {status_label(status)}")
 
   print("\nSet new status code for this equipment")
-  print("  0 = operational")
-  print("  1 = needs maintenance")
-  print("  2 = out of order")
+  for code, label in EQUIPMENT_STATUS.items():
+    print(f"  {code} = {label}")
 
   status_str = input("Enter new status code: ")
   try:
@@ -347,52 +394,280 @@ def update_equipment_issues(connection):
   except ValueError:
     print("Status must be an integer.")
     return
+  if new_status not in EQUIPMENT_STATUS:
+    print("Unknown status code.")
+    return
+
+  note = None
+  if new_status != 0:
+    note = input("Describe the issue (blank to keep the current note): ").strip()[:200] or None
 
   # 2) Update equipment status
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        UPDATE equipment
-        SET status = %s
-        WHERE equipment_id = %s
-        """,
-        (new_status, equipment_id),
-      )
-    connection.commit()
-    print(f"Equipment {equipment_id} status updated to {new_status}.")
+    set_equipment_status(equipment_id, new_status, note)
+    print(f"Equipment {equipment_id} status updated to {status_label(new_status)}.")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Updating equipment status failed, Error:", e)
 
-def list_equipment(connection):
+def list_equipment():
   print("\n--------- Equipment ----------")
+  room_id = input("Room ID (blank for all rooms): ").strip()
+  eq_type = input("Type (blank for all types): ").strip()
+  status_str = input("Status code (0/1/2, 'i' for any open issue, blank for all): ").strip().lower()
+
+  filters = {'eq_type': eq_type or None}
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT equipment_id, room_id, type, status
-        FROM equipment
-        ORDER BY equipment_id
-        """
-      )
-      rows = cur.fetchall()
+    if room_id:
+      filters['room_id'] = int(room_id)
+    if status_str == 'i':
+      filters['open_issues'] = True
+    elif status_str:
+      filters['status'] = int(status_str)
+  except ValueError:
+    print("Room ID and status must be integers.")
+    return
+
+  after_id = 0
+  while True:
+    try:
+      rows = find_equipment(after_id=after_id, **filters)
+    except psycopg2.Error as e:
+      print("Error fetching equipment:", e)
+      return
+
+    if not rows:
+      print("No equipment found." if after_id == 0 else "No more equipment.")
+      return
+
+    for eq_id, room_id, eq_type, status, issue_since, issue_note in rows:
+      line = f"- ID {eq_id} | Room {room_id} | {eq_type} | Status: {status_label(status)}"
+      if issue_since is not None:
+        line += f" since {issue_since:%Y-%m-%d}"
+      if issue_note:
+        line += f" ({issue_note})"
+      print(line)
+
+    if len(rows) < EQUIPMENT_PAGE_SIZE or input("Enter n for the next page: ").strip().lower() != 'n':
+      return
+    after_id = rows[-1][0]
+
+def view_maintenance_queue():
+  print("\n--------- Maintenance Queue (oldest issue first) ----------")
+  room_id = input("Room ID (blank for all rooms): ").strip()
+  try:
+    rows = maintenance_queue(int(room_id) if room_id else None)
+  except ValueError:
+    print("Room ID must be an integer.")
+    return
   except psycopg2.Error as e:
-    print("Error fetching equipment:", e)
+    print("Error fetching the maintenance queue:", e)
     return
 
   if not rows:
-    print("No equipment found.")
+    print("Nothing needs attention.")
     return
 
-  for eq_id, room_id, eq_type, status in rows:
-    if status == 0:
-      status = "Operational"
-    elif status == 1:
-      status = "needs maintenance"
-    elif status == 2:
-      status = "out of order"
+  now = datetime.now().astimezone()
+  for eq_id, room_id, room_name, eq_type, status, issue_since, issue_note in rows:
+    days = (now - issue_since).days
+    print(f"- ID {eq_id} | {room_name} (Room {room_id}) | {eq_type} | {status_label(status)} | "
+          f"open {days} days | {issue_note or 'no note'}")
+
+def import_health_metrics():
+  print("\n--------- Import Health Metrics --------")
+  path = input("Path to metrics export (.csv or .jsonl): ").strip()
+
+  path = os.path.abspath(path)
+  if not os.path.isfile(path):
+    print("Could not read file:", path)
+    return
+
+  try:
+    job_id = submit_job('import_health_metrics', {'path': path})
+  except psycopg2.Error as e:
+    print("Queueing import failed, Error:", e)
+    return
+  print(f"Import queued as job {job_id}. Rejected rows will be written to {path}.rejected.csv")
+  print("Check progress under Background jobs.")
+
+def background_jobs():
+  print("\n--------- Background Jobs --------")
+  try:
+    counts = job_counts()
+  except psycopg2.Error as e:
+    print("Error fetching jobs:", e)
+    return
+
+  if not counts:
+    print("No jobs.")
+    return
+  for kind, status, jobs, oldest in counts:
+    print(f"- {kind:<24}{status:<9}{jobs:>7} | oldest run_at {oldest:%Y-%m-%d %H:%M}")
+
+  choice = input("Show (d)one, (f)ailed/dead, (q)ueued jobs, blank to go back: ").strip().lower()
+  status = {'d': 'done', 'f': 'dead', 'q': 'queued'}.get(choice)
+  if status is None:
+    return
+  try:
+    rows = list_jobs(status)
+  except psycopg2.Error as e:
+    print("Error fetching jobs:", e)
+    return
+  if not rows:
+    print(f"No {status} jobs.")
+    return
+
+  for job_id, kind, payload, attempts, run_at, finished_at, last_error, result in rows:
+    when = finished_at or run_at
+    print(f"- Job {job_id} | {kind} | {json.dumps(payload)} | attempts {attempts} | {when:%Y-%m-%d %H:%M}")
+    if status == 'done':
+      print(f"    result: {json.dumps(result)}")
+    elif last_error:
+      print(f"    last error: {last_error}")
+
+  if status == 'dead':
+    ids = input("Job IDs to retry (comma separated, 'all', blank for none): ").strip().lower()
+    if not ids:
+      return
+    try:
+      job_ids = None if ids == 'all' else [int(i) for i in ids.split(',')]
+    except ValueError:
+      print("Job IDs must be integers.")
+      return
+    try:
+      print(f"Requeued {retry_dead_jobs(job_ids)} jobs.")
+    except psycopg2.Error as e:
+      print("Requeueing jobs failed, Error:", e)
+
+def monthly_billing():
+  print("\n--------- Monthly Billing Run --------")
+  try:
+    rates = get_rates()
+  except psycopg2.Error as e:
+    print("Error fetching billing rates:", e)
+    return
+
+  print("Rates per session:")
+  for session_type, rate in rates.items():
+    print(f"- {session_type}: {rate} CAD")
+
+  session_type = input("Session type to change the rate of (blank to keep): ").strip().lower()
+  if session_type:
+    if session_type not in ('personal', 'group'):
+      print("Session type must be personal or group.")
+      return
+    try:
+      set_rate(session_type, Decimal(input("New rate (CAD): ").strip()))
+    except InvalidOperation:
+      print("Rate must be a number.")
+      return
+    except psycopg2.Error as e:
+      print("Updating the rate failed, Error:", e)
+      return
+    print(f"Rate for {session_type} sessions updated.")
+
+  period_str = input("Month to bill (YYYY-MM, blank to skip): ").strip()
+  if not period_str:
+    return
+  try:
+    period = parse_period(period_str)
+  except ValueError as e:
+    print(e)
+    return
+
+  try:
+    queued, requeued = start_billing_run(period)
+    counts, invoices = billing_progress(period)
+  except psycopg2.Error as e:
+    print("Starting the billing run failed, Error:", e)
+    return
+  print(f"Queued {queued} member ranges for {period:%Y-%m}, requeued {requeued} failed ones.")
+  print(f"So far: {counts.get('done', 0)} ranges billed, {invoices} invoices, {counts.get('dead', 0)} failed.")
+  print("The background workers bill the ranges; run this again to check progress or resume.")
+
+def find_members():
+  print("\n--------- Find a Member ----------")
+  while True:
+    text = input("Name or phone number (blank to go back): ").strip()
+    if not text:
+      return
+    try:
+      matches = search_members(text)
+    except psycopg2.Error as e:
+      print("Member search failed, Error:", e)
+      return
+    if matches:
+      print_matches(matches)
     else:
-      status = "N/A"
+      print("No members found.")
+
+def view_reports():
+  print("\n--------- Reports --------")
+  try:
+    from app import analytics
+  except ImportError:
+    print("Reports need NumPy: pip install numpy")
+    return
+
+  print("1) Room occupancy")
+  print("2) Trainer utilization")
+  print("3) Group class fill rates")
+  print("4) Revenue per period")
+  name = {'1': 'occupancy', '2': 'utilization', '3': 'fill', '4': 'revenue'}.get(input("Enter: ").strip())
+  if name is None:
+    return
+
+  today = date.today()
+  date_from = get_valid_date_input(f"From (YYYY-MM-DD, blank for {today.replace(day=1)}): ", today.replace(day=1))
+  date_to = get_valid_date_input(f"To (YYYY-MM-DD, blank for {today}): ", today)
+  if date_from is None or date_to is None:
+    return
+  if date_to < date_from:
+    print("The end date must be on or after the start date.")
+    return
+  period = 'month'
+  if name == 'revenue':
+    period = input("Per day, week or month (blank for month): ").strip().lower() or 'month'
+    if period not in ('day', 'week', 'month'):
+      print("Period must be day, week or month.")
+      return
+
+  age = analytics.snapshot_age()
+  refresh = input("Take a fresh snapshot first? (y/n): ").strip().lower() == 'y' if age is not None else True
+  try:
+    snap = analytics.load_snapshot(refresh=refresh)
+  except psycopg2.Error as e:
+    print("Extracting the snapshot failed, Error:", e)
+    return
+  except OSError as e:
+    print("Could not write the snapshot file:", e)
+    return
+
+  print(f"\n--- {date_from} to {date_to}, data as of {analytics.snapshot_age() / 60:.0f} minutes ago ---")
+  analytics.print_report(name, snap, date_from, date_to, period)
+
+def query_latency_report():
+  print("\n--------- Query Latency (slowest p99 first) --------")
+  for name, lag, _, down in replica_status():
+    state = "down" if down else "lag unknown" if lag is None else f"{lag:.1f}s behind"
+    print(f"Replica {name}: {state}")
+  stats = query_stats()
+  if not stats:
+    print("Nothing recorded yet.")
+    return
 
-    print(f"- ID {eq_id} | Room {room_id} | {eq_type} | Status: {status}")
\ No newline at end of file
+  print(f"{'operation':<24}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>10}  statement")
+  for row in stats[:20]:
+    print(f"{row['operation']:<24}{row['calls']:>7}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+          f"{row['p99_ms']:>9}{row['max_ms']:>10}  {row['statement'][:60]}")
+
+  path = input("Write full report to file (blank to skip): ").strip()
+  if path:
+    try:
+      write_query_stats(path)
+      print(f"Report written to {path}")
+    except OSError as e:
+      print("Could not write file:", e)
+
+  if input("Reset the counters? (y/n): ").strip().lower() == 'y':
+    reset_query_stats()
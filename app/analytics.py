@@ -0,0 +1,322 @@
+"""
+Reports over sessions, enrolments, invoices and payments, computed with
+NumPy on a columnar snapshot instead of against the live tables.
+
+  python -m app.analytics occupancy --from 2025-01-01 --to 2025-12-31
+  python -m app.analytics revenue --period week --refresh
+
+The snapshot is taken in one read-only REPEATABLE READ transaction: each
+table is streamed out with COPY as integers only (dates as days since
+1970-01-01, times as minutes, money in cents, statuses as codes) and parsed
+straight into arrays, then cached in SNAPSHOT_PATH. Reports read the cached
+file until it is SNAPSHOT_MAX_AGE seconds old, so running them again costs
+the database nothing.
+
+Needs NumPy (pip install numpy).
+"""
+import argparse
+import io
+import os
+import time
+from datetime import date
+
+import numpy as np
+import psycopg2
+from app.database import get_connection
+
+SNAPSHOT_PATH = 'analytics_snapshot.npz'
+# Seconds a snapshot is reused before reports extract a fresh one
+SNAPSHOT_MAX_AGE = 3600
+# Hours a room can be booked each day, for room occupancy
+CLUB_OPEN_MINUTES = 6 * 60
+CLUB_CLOSE_MINUTES = 22 * 60
+
+SESSION_STATUS = ('active', 'full', 'completed', 'cancelled')
+SESSION_TYPE = ('personal', 'group')
+INVOICE_STATUS = ('unpaid', 'paid', 'cancelled')
+
+# table: (columns, query). Every column comes out as an integer.
+EXTRACTS = {
+  'sessions': (
+    ('session_id', 'trainer_id', 'room_id', 'session_type', 'day', 'start_minute', 'end_minute',
+     'status', 'capacity'),
+    f"""
+    SELECT session_id, trainer_id, COALESCE(room_id, 0),
+           array_position(ARRAY{list(SESSION_TYPE)}::varchar[], session_type) - 1,
+           session_date - DATE '1970-01-01',
+           EXTRACT(epoch FROM start_time)::int / 60,
+           EXTRACT(epoch FROM end_time)::int / 60,
+           array_position(ARRAY{list(SESSION_STATUS)}::varchar[], status) - 1,
+           capacity
+    FROM training_sessions
+    """,
+  ),
+  'members': (
+    ('session_id', 'member_id'),
+    "SELECT session_id, member_id FROM session_members",
+  ),
+  'invoices': (
+    ('invoice_id', 'member_id', 'day', 'total_cents', 'paid_cents', 'status'),
+    f"""
+    SELECT invoice_id, member_id, issue_date - DATE '1970-01-01',
+           (total_amount * 100)::bigint, (amount_paid * 100)::bigint,
+           array_position(ARRAY{list(INVOICE_STATUS)}::varchar[], status) - 1
+    FROM invoice
+    """,
+  ),
+  'payments': (
+    ('payment_id', 'invoice_id', 'day', 'amount_cents'),
+    """
+    SELECT payment_id, invoice_id, payment_date - DATE '1970-01-01', (amount * 100)::bigint
+    FROM payment
+    """,
+  ),
+  'trainers': (
+    ('trainer_id', 'available_from', 'available_to'),
+    """
+    SELECT trainer_id,
+           EXTRACT(epoch FROM availability_start)::int / 60,
+           EXTRACT(epoch FROM availability_end)::int / 60
+    FROM trainer
+    """,
+  ),
+  'rooms': (
+    ('room_id', 'capacity'),
+    "SELECT room_id, capacity FROM rooms",
+  ),
+}
+
+
+def _copy_columns(cur, columns, query):
+  buf = io.BytesIO()
+  cur.copy_expert(f"COPY ({query}) TO STDOUT", buf)
+  values = np.fromstring(buf.getvalue(), dtype=np.int64, sep=' ')
+  table = values.reshape(-1, len(columns))
+  # Ids, days, minutes and codes fit in 32 bits; money stays 64
+  return {
+    column: table[:, i].astype(np.int64 if column.endswith('_cents') else np.int32)
+    for i, column in enumerate(columns)
+  }
+
+def extract_snapshot(path=SNAPSHOT_PATH):
+  """
+  Copies every table in EXTRACTS out of one consistent read-only snapshot
+  into path. Returns the snapshot ({'table.column': array}).
+  """
+  snapshot = {}
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    for table, (columns, query) in EXTRACTS.items():
+      for column, values in _copy_columns(cur, columns, query).items():
+        snapshot[f"{table}.{column}"] = values
+    connection.commit()
+
+  # Written aside and renamed, so a concurrent reader never sees half a
+  # file. Not compressed: zlib would cost more than the extract itself.
+  tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+  np.savez(tmp_path, **snapshot)
+  os.replace(tmp_path, path)
+  return snapshot
+
+def load_snapshot(path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE, refresh=False):
+  """
+  The cached snapshot at path, or a fresh one if it is missing, older than
+  max_age seconds, or refresh is set.
+  """
+  if not refresh:
+    try:
+      if time.time() - os.path.getmtime(path) < max_age:
+        with np.load(path) as cached:
+          return {name: cached[name] for name in cached.files}
+    except (OSError, ValueError):
+      pass
+  return extract_snapshot(path)
+
+def snapshot_age(path=SNAPSHOT_PATH):
+  """
+  Seconds since the cached snapshot was taken, None if there is none.
+  """
+  try:
+    return time.time() - os.path.getmtime(path)
+  except OSError:
+    return None
+
+
+def _day(d):
+  return (d - date(1970, 1, 1)).days
+
+def _in_range(days, date_from, date_to):
+  return (days >= _day(date_from)) & (days <= _day(date_to))
+
+def _held_sessions(snap, date_from, date_to):
+  """
+  Mask of sessions in [date_from, date_to] that weren't cancelled.
+  """
+  return (_in_range(snap['sessions.day'], date_from, date_to) &
+          (snap['sessions.status'] != SESSION_STATUS.index('cancelled')))
+
+def _attendance(snap):
+  """
+  Members per session, aligned with the sessions arrays.
+  """
+  session_ids = snap['sessions.session_id']
+  counts = np.bincount(snap['members.session_id'], minlength=session_ids.max(initial=0) + 1)
+  return counts[session_ids]
+
+def room_occupancy(snap, date_from, date_to):
+  """
+  Per room: sessions held, hours booked, share of the club's opening hours
+  booked, and average seats used per session (members / room capacity).
+  [(room_id, sessions, booked_hours, booked_share, seat_use), ...]
+  """
+  held = _held_sessions(snap, date_from, date_to) & (snap['sessions.room_id'] > 0)
+  room_ids = snap['sessions.room_id'][held]
+  minutes = (snap['sessions.end_minute'] - snap['sessions.start_minute'])[held]
+  size = snap['rooms.room_id'].max(initial=0) + 1
+
+  capacity = np.zeros(size, dtype=np.int64)
+  capacity[snap['rooms.room_id']] = snap['rooms.capacity']
+  seat_use = _attendance(snap)[held] / np.maximum(capacity[room_ids], 1)
+
+  sessions = np.bincount(room_ids, minlength=size)
+  booked = np.bincount(room_ids, weights=minutes, minlength=size)
+  seat_total = np.bincount(room_ids, weights=seat_use, minlength=size)
+  open_minutes = (CLUB_CLOSE_MINUTES - CLUB_OPEN_MINUTES) * ((date_to - date_from).days + 1)
+
+  rooms = np.sort(snap['rooms.room_id'])
+  return [
+    (int(r), int(sessions[r]), round(booked[r] / 60, 1), round(booked[r] / open_minutes, 3),
+     round(seat_total[r] / sessions[r], 3) if sessions[r] else 0.0)
+    for r in rooms
+  ]
+
+def trainer_utilization(snap, date_from, date_to):
+  """
+  Per trainer: hours of sessions held against the hours they were
+  available (availability_start to availability_end every day).
+  [(trainer_id, sessions, session_hours, available_hours, utilization), ...]
+  """
+  held = _held_sessions(snap, date_from, date_to)
+  trainer_ids = snap['sessions.trainer_id'][held]
+  minutes = (snap['sessions.end_minute'] - snap['sessions.start_minute'])[held]
+  size = snap['trainers.trainer_id'].max(initial=0) + 1
+
+  sessions = np.bincount(trainer_ids, minlength=size)
+  worked = np.bincount(trainer_ids, weights=minutes, minlength=size)
+  available = np.zeros(size, dtype=np.int64)
+  available[snap['trainers.trainer_id']] = (
+    (snap['trainers.available_to'] - snap['trainers.available_from']) * ((date_to - date_from).days + 1)
+  )
+
+  trainers = np.sort(snap['trainers.trainer_id'])
+  return [
+    (int(t), int(sessions[t]), round(worked[t] / 60, 1), round(available[t] / 60, 1),
+     round(worked[t] / available[t], 3) if available[t] else 0.0)
+    for t in trainers
+  ]
+
+def class_fill_rates(snap, date_from, date_to):
+  """
+  Group classes held in the range: (classes, average fill, classes that
+  were full, [(trainer_id, classes, average fill), ...]). Fill is members /
+  class capacity.
+  """
+  held = (_held_sessions(snap, date_from, date_to) &
+          (snap['sessions.session_type'] == SESSION_TYPE.index('group')))
+  fill = _attendance(snap)[held] / np.maximum(snap['sessions.capacity'][held], 1)
+  trainer_ids = snap['sessions.trainer_id'][held]
+  size = snap['trainers.trainer_id'].max(initial=0) + 1
+
+  classes = np.bincount(trainer_ids, minlength=size)
+  fill_total = np.bincount(trainer_ids, weights=fill, minlength=size)
+  per_trainer = [
+    (int(t), int(classes[t]), round(fill_total[t] / classes[t], 3))
+    for t in np.flatnonzero(classes)
+  ]
+  average = round(float(fill.mean()), 3) if fill.size else 0.0
+  return int(fill.size), average, int((fill >= 1).sum()), per_trainer
+
+def revenue(snap, date_from, date_to, period='month'):
+  """
+  Invoiced (by issue date, cancelled invoices left out) and collected (by
+  payment date) per period: 'day', 'week' (starting Monday) or 'month'.
+  [(period_start, invoiced, collected), ...] in dollars.
+  """
+  unit = {'day': 'D', 'week': 'W', 'month': 'M'}[period]
+
+  def per_period(days, cents):
+    stamps = days.astype('datetime64[D]')
+    if unit == 'W':
+      # datetime64 weeks start on Thursday (1970-01-01); shift to Monday
+      starts = (stamps + np.timedelta64(3, 'D')).astype('datetime64[W]').astype('datetime64[D]') - np.timedelta64(3, 'D')
+    else:
+      starts = stamps.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+    keys, index = np.unique(starts, return_inverse=True)
+    return dict(zip(keys.tolist(), np.bincount(index, weights=cents, minlength=len(keys))))
+
+  live = (_in_range(snap['invoices.day'], date_from, date_to) &
+          (snap['invoices.status'] != INVOICE_STATUS.index('cancelled')))
+  invoiced = per_period(snap['invoices.day'][live], snap['invoices.total_cents'][live])
+  paid = _in_range(snap['payments.day'], date_from, date_to)
+  collected = per_period(snap['payments.day'][paid], snap['payments.amount_cents'][paid])
+
+  return [
+    (start, round(invoiced.get(start, 0) / 100, 2), round(collected.get(start, 0) / 100, 2))
+    for start in sorted(invoiced.keys() | collected.keys())
+  ]
+
+
+def print_report(name, snap, date_from, date_to, period='month'):
+  if name == 'occupancy':
+    print(f"{'room':>6}{'sessions':>10}{'hours':>10}{'booked':>9}{'seats':>8}")
+    for room_id, sessions, hours, share, seats in room_occupancy(snap, date_from, date_to):
+      print(f"{room_id:>6}{sessions:>10}{hours:>10}{share:>9.1%}{seats:>8.1%}")
+  elif name == 'utilization':
+    print(f"{'trainer':>8}{'sessions':>10}{'hours':>10}{'available':>11}{'used':>8}")
+    for trainer_id, sessions, hours, available, used in trainer_utilization(snap, date_from, date_to):
+      print(f"{trainer_id:>8}{sessions:>10}{hours:>10}{available:>11}{used:>8.1%}")
+  elif name == 'fill':
+    classes, average, full, per_trainer = class_fill_rates(snap, date_from, date_to)
+    print(f"{classes} group classes, {average:.1%} average fill, {full} full")
+    print(f"{'trainer':>8}{'classes':>9}{'fill':>8}")
+    for trainer_id, trainer_classes, fill in per_trainer:
+      print(f"{trainer_id:>8}{trainer_classes:>9}{fill:>8.1%}")
+  elif name == 'revenue':
+    print(f"{period:<12}{'invoiced':>14}{'collected':>14}")
+    for start, invoiced, collected in revenue(snap, date_from, date_to, period):
+      print(f"{start.isoformat():<12}{invoiced:>14,.2f}{collected:>14,.2f}")
+  else:
+    raise ValueError(f"unknown report {name}")
+
+REPORTS = ('occupancy', 'utilization', 'fill', 'revenue')
+
+
+def main(argv=None):
+  today = date.today()
+  parser = argparse.ArgumentParser(description="Occupancy, utilization, class fill and revenue reports.")
+  parser.add_argument('report', choices=REPORTS + ('all',))
+  parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=today.replace(month=1, day=1))
+  parser.add_argument('--to', dest='date_to', type=date.fromisoformat, default=today)
+  parser.add_argument('--period', choices=('day', 'week', 'month'), default='month')
+  parser.add_argument('--snapshot', default=SNAPSHOT_PATH)
+  parser.add_argument('--refresh', action='store_true', help="extract a fresh snapshot first")
+  args = parser.parse_args(argv)
+
+  try:
+    started = time.perf_counter()
+    snap = load_snapshot(args.snapshot, refresh=args.refresh)
+    loaded = time.perf_counter()
+  except psycopg2.Error as e:
+    print("Extracting the snapshot failed, Error:", e)
+    return 1
+
+  for name in (REPORTS if args.report == 'all' else (args.report,)):
+    print(f"\n--- {name} {args.date_from} to {args.date_to} ---")
+    print_report(name, snap, args.date_from, args.date_to, args.period)
+  print(f"\nSnapshot {snapshot_age(args.snapshot):.0f}s old, loaded in {loaded - started:.2f}s, "
+        f"reports in {time.perf_counter() - loaded:.2f}s")
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,311 @@
+"""
+Times the hot database operations against the configured Postgres.
+
+  python -m app.datagen --scale medium --yes
+  python -m app.benchmark --iterations 1000 --output bench.json
+  python -m app.benchmark --compare bench.json
+
+Every operation runs through the same pool and SQL the menus use. Writes
+(booking, joins, payments) are rolled back so runs stay comparable.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2 import errors
+from app.dashboard import DASHBOARD_QUERY
+from app.database import execute_prepared, get_connection
+from app.equipment import SKIP_OUT_OF_ORDER_ROOMS
+from app.trainer import ROSTER_QUERY
+
+# Errors that are a normal answer for an operation (slot taken, class full
+# ...) rather than a failure of the benchmark
+EXPECTED_ERRORS = (errors.RaiseException, errors.ExclusionViolation, errors.CheckViolation)
+
+
+class Sample:
+  """
+  Id ranges and lookup lists the operations draw random arguments from.
+  """
+  def __init__(self, cur):
+    cur.execute("SELECT COALESCE(MAX(member_id), 0) FROM member")
+    self.max_member_id = cur.fetchone()[0]
+    cur.execute("SELECT trainer_id, availability_start, availability_end FROM trainer")
+    self.trainers = cur.fetchall()
+    cur.execute(
+      """
+      SELECT session_id
+      FROM training_sessions
+      WHERE session_type = 'group' AND status = 'active'
+      LIMIT 10000
+      """
+    )
+    self.group_sessions = [r[0] for r in cur.fetchall()]
+    cur.execute("SELECT invoice_id FROM invoice WHERE status = 'unpaid' LIMIT 10000")
+    self.unpaid_invoices = [r[0] for r in cur.fetchall()]
+    # The day the live sessions are on, so checks hit a busy schedule
+    cur.execute(
+      """
+      SELECT COALESCE(MIN(session_date), CURRENT_DATE)
+      FROM training_sessions
+      WHERE status IN ('active', 'full')
+      """
+    )
+    self.day = cur.fetchone()[0]
+    # Free slots so booking measures the success path, not just conflicts
+    cur.execute(
+      "SELECT trainer_id, start_time, end_time FROM open_slots(%s, p_date => %s, p_skip_out_of_order => %s)",
+      (timedelta(minutes=15), self.day, SKIP_OUT_OF_ORDER_ROOMS),
+    )
+    self.open_slots = cur.fetchall()
+
+  def member(self, rng):
+    return rng.randint(1, self.max_member_id)
+
+  def trainer(self, rng):
+    return rng.choice(self.trainers)[0]
+
+  def slot(self, rng, minutes=30):
+    """
+    A random trainer and a [start, end) inside their availability.
+    """
+    trainer_id, avail_start, avail_end = rng.choice(self.trainers)
+    day = datetime(2000, 1, 1)
+    start = day + timedelta(hours=avail_start.hour, minutes=avail_start.minute)
+    end = day + timedelta(hours=avail_end.hour, minutes=avail_end.minute)
+    steps = max(int((end - start - timedelta(minutes=minutes)).total_seconds() // 900), 0)
+    slot_start = start + timedelta(minutes=15 * rng.randint(0, steps))
+    return trainer_id, slot_start.time(), (slot_start + timedelta(minutes=minutes)).time()
+
+
+def bench_dashboard(cur, rng, sample):
+  cur.execute(DASHBOARD_QUERY, {'member_id': sample.member(rng)})
+  cur.fetchone()
+
+def bench_booking(cur, rng, sample):
+  if sample.open_slots:
+    trainer_id, start_time, end_time = rng.choice(sample.open_slots)
+  else:
+    trainer_id, start_time, end_time = sample.slot(rng)
+  execute_prepared(cur, 'book_personal_session', (sample.member(rng), trainer_id, sample.day, start_time, end_time, SKIP_OUT_OF_ORDER_ROOMS))
+  cur.fetchone()
+
+def bench_overlap_check(cur, rng, sample):
+  trainer_id, start_time, end_time = sample.slot(rng)
+  execute_prepared(cur, 'trainer_overlap', (trainer_id, sample.day, start_time, end_time))
+  cur.fetchone()
+
+def bench_open_slots(cur, rng, sample):
+  cur.execute(
+    "SELECT * FROM open_slots(%s, %s, p_date => %s, p_skip_out_of_order => %s)",
+    (timedelta(minutes=45), sample.trainer(rng), sample.day, SKIP_OUT_OF_ORDER_ROOMS),
+  )
+  cur.fetchall()
+
+def bench_join_group(cur, rng, sample):
+  if not sample.group_sessions:
+    return
+  execute_prepared(cur, 'join_class', (rng.choice(sample.group_sessions), None, None, sample.member(rng)))
+  cur.fetchone()
+
+def bench_member_lookup(cur, rng, sample):
+  cur.execute(
+    """
+    SELECT DISTINCT m.member_id, m.full_name
+    FROM session_members sm JOIN training_sessions ts
+      ON sm.session_id = ts.session_id
+    JOIN member m
+      ON sm.member_id = m.member_id
+    WHERE ts.trainer_id = %s AND ts.status IN ('active', 'full')
+    ORDER BY m.member_id
+    """,
+    (sample.trainer(rng),),
+  )
+  cur.fetchall()
+
+def bench_roster(cur, rng, sample):
+  cur.execute(ROSTER_QUERY, (sample.trainer(rng),))
+  cur.fetchall()
+
+def bench_payment(cur, rng, sample):
+  if not sample.unpaid_invoices:
+    return
+  invoice_id = rng.choice(sample.unpaid_invoices)
+  cur.execute(
+    "SELECT remaining, status, member_id FROM invoice WHERE invoice_id = %s FOR UPDATE",
+    (invoice_id,),
+  )
+  cur.fetchone()
+  cur.execute(
+    "INSERT INTO payment (invoice_id, amount, method) VALUES (%s, %s, %s)",
+    (invoice_id, 0.01, 'card'),
+  )
+
+# name -> (function, runs in autocommit). Writes run in a transaction that is
+# rolled back when the connection goes back to the pool.
+OPERATIONS = {
+  'dashboard': (bench_dashboard, True),
+  'booking': (bench_booking, False),
+  'overlap_check': (bench_overlap_check, True),
+  'open_slots': (bench_open_slots, True),
+  'join_group': (bench_join_group, False),
+  'member_lookup': (bench_member_lookup, True),
+  'roster': (bench_roster, True),
+  'payment': (bench_payment, False),
+}
+
+
+def _percentile(sorted_values, pct):
+  if not sorted_values:
+    return 0.0
+  index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+  return sorted_values[index]
+
+def summarize(latencies, rejected, failed, elapsed):
+  ms = sorted(v * 1000 for v in latencies)
+  return {
+    'iterations': len(latencies),
+    'rejected': rejected,
+    'failed': failed,
+    'mean_ms': round(sum(ms) / len(ms), 3) if ms else 0.0,
+    'p50_ms': round(_percentile(ms, 50), 3),
+    'p95_ms': round(_percentile(ms, 95), 3),
+    'p99_ms': round(_percentile(ms, 99), 3),
+    'max_ms': round(ms[-1], 3) if ms else 0.0,
+    'ops_per_sec': round(len(ms) / elapsed, 1) if elapsed else 0.0,
+  }
+
+def run_operation(name, iterations, warmup, sample, seed):
+  func, autocommit = OPERATIONS[name]
+  rng = random.Random(f"{seed}-{name}")
+  latencies = []
+  rejected = 0
+  failed = 0
+
+  started = time.perf_counter()
+  for i in range(warmup + iterations):
+    if i == warmup:
+      started = time.perf_counter()
+    t0 = time.perf_counter()
+    outcome = None
+    try:
+      with get_connection(autocommit=autocommit, operation=name) as connection, connection.cursor() as cur:
+        func(cur, rng, sample)
+    except EXPECTED_ERRORS:
+      outcome = 'rejected'
+    except psycopg2.Error:
+      outcome = 'failed'
+    elapsed = time.perf_counter() - t0
+    if i < warmup:
+      continue
+    latencies.append(elapsed)
+    if outcome == 'rejected':
+      rejected += 1
+    elif outcome == 'failed':
+      failed += 1
+  return summarize(latencies, rejected, failed, time.perf_counter() - started)
+
+def collect_meta(cur, iterations, seed):
+  cur.execute("SHOW server_version")
+  server_version = cur.fetchone()[0]
+  cur.execute(
+    """
+    SELECT c.relname, c.reltuples::bigint
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+    ORDER BY c.relname
+    """
+  )
+  row_estimates = dict(cur.fetchall())
+  try:
+    commit = subprocess.run(
+      ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  return {
+    'started_at': datetime.now().isoformat(timespec='seconds'),
+    'git_commit': commit,
+    'python': platform.python_version(),
+    'server_version': server_version,
+    'iterations': iterations,
+    'seed': seed,
+    'row_estimates': row_estimates,
+  }
+
+def print_report(report, baseline=None):
+  print(f"\n{'operation':<15}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'rejected':>10}{'failed':>8}")
+  for name, r in report['results'].items():
+    line = (f"{name:<15}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+            f"{r['ops_per_sec']:>10.1f}{r['rejected']:>10}{r['failed']:>8}")
+    if baseline and name in baseline['results'] and baseline['results'][name]['p95_ms']:
+      ratio = r['p95_ms'] / baseline['results'][name]['p95_ms']
+      line += f"   p95 x{ratio:.2f} vs baseline"
+    print(line)
+
+def regressions(report, baseline, threshold):
+  """
+  Operations whose p95 grew by more than threshold (e.g. 1.2 = +20%).
+  """
+  slower = []
+  for name, r in report['results'].items():
+    old = baseline['results'].get(name)
+    if old and old['p95_ms'] and r['p95_ms'] > old['p95_ms'] * threshold:
+      slower.append(name)
+  return slower
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the hot database operations.")
+  parser.add_argument('--iterations', type=int, default=500)
+  parser.add_argument('--warmup', type=int, default=20)
+  parser.add_argument('--ops', default=','.join(OPERATIONS),
+                      help=f"comma separated subset of: {', '.join(OPERATIONS)}")
+  parser.add_argument('--seed', type=int, default=3005)
+  parser.add_argument('--output', help="write the JSON report here")
+  parser.add_argument('--compare', help="previous JSON report to compare against")
+  parser.add_argument('--threshold', type=float, default=1.2,
+                      help="p95 ratio vs baseline that counts as a regression")
+  args = parser.parse_args(argv)
+
+  names = [n.strip() for n in args.ops.split(',') if n.strip()]
+  unknown = [n for n in names if n not in OPERATIONS]
+  if unknown:
+    parser.error(f"unknown operations: {', '.join(unknown)}")
+
+  with get_connection() as connection, connection.cursor() as cur:
+    sample = Sample(cur)
+    meta = collect_meta(cur, args.iterations, args.seed)
+
+  report = {'meta': meta, 'results': {}}
+  for name in names:
+    print(f"running {name} ...")
+    report['results'][name] = run_operation(name, args.iterations, args.warmup, sample, args.seed)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print_report(report, baseline)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+  if baseline:
+    slower = regressions(report, baseline, args.threshold)
+    if slower:
+      print(f"\nREGRESSION (p95 > x{args.threshold}): {', '.join(slower)}")
+      return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Monthly billing run: one invoice per member for the sessions they were
+enrolled in during a month, priced per session type from billing_rate.
+
+  python -m app.billing 2025-12
+  python -m app.billing 2025-12 --chunk-size 20000 --wait
+
+The membership is split into member_id ranges of BILLING_CHUNK_SIZE and
+each range is queued as a bill_members job, so the app.worker processes
+bill the ranges in parallel, each with one INSERT ... SELECT. A range
+commits together with its job, and running the same month again only
+queues the ranges that haven't been billed (and requeues failed ones), so
+an interrupted run is simply started again.
+"""
+import argparse
+import time
+from datetime import date
+
+import psycopg2
+from app.database import get_connection
+from app.jobs import JOB_KINDS
+
+# member_ids per bill_members job
+BILLING_CHUNK_SIZE = 10000
+# Seconds between progress lines with --wait
+BILLING_PROGRESS_SECONDS = 2
+
+
+def parse_period(text):
+  """
+  'YYYY-MM' -> first day of that month. Only months that have ended can be
+  billed. Raises ValueError.
+  """
+  try:
+    year, month = (int(part) for part in text.strip().split('-'))
+    period = date(year, month, 1)
+  except ValueError:
+    raise ValueError(f"{text!r} is not a month (YYYY-MM)")
+  if period >= date.today().replace(day=1):
+    raise ValueError(f"{period:%Y-%m} has not ended yet")
+  return period
+
+def get_rates():
+  """
+  {session_type: rate}
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute("SELECT session_type, rate FROM billing_rate ORDER BY session_type")
+    return dict(cur.fetchall())
+
+def set_rate(session_type, rate):
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      INSERT INTO billing_rate (session_type, rate)
+      VALUES (%s, %s)
+      ON CONFLICT (session_type) DO UPDATE SET rate = EXCLUDED.rate
+      """,
+      (session_type, rate),
+    )
+
+def start_billing_run(period, chunk_size=BILLING_CHUNK_SIZE):
+  """
+  Queues a bill_members job for every member_id range of the month that
+  isn't queued, running or done yet, and requeues the month's dead ones, in
+  one transaction. Ranges are priced at today's billing_rate.
+  Returns (ranges_queued, ranges_requeued).
+  """
+  _, max_attempts = JOB_KINDS['bill_members']
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    # Two admins starting the same month queue each range once
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('bill_members ' || %s))", (period.isoformat(),))
+    cur.execute(
+      """
+      UPDATE job
+      SET status = 'queued', attempts = 0, run_at = now(), finished_at = NULL
+      WHERE kind = 'bill_members'
+        AND status = 'dead'
+        AND payload ->> 'period' = %s
+      """,
+      (period.isoformat(),),
+    )
+    requeued = cur.rowcount
+    cur.execute(
+      """
+      SELECT COUNT(enqueue_job(
+        'bill_members',
+        jsonb_build_object('period', %(period)s::text, 'from_member', lo,
+                           'to_member', lo + %(chunk)s, 'rates', r.rates),
+        now(),
+        %(max_attempts)s
+      ))
+      FROM (SELECT jsonb_object_agg(session_type, rate) AS rates FROM billing_rate) r,
+           (SELECT MIN(member_id) AS first, MAX(member_id) AS last FROM member) m,
+           generate_series(m.first, m.last, %(chunk)s) lo
+      WHERE NOT EXISTS (
+        SELECT 1
+        FROM job j
+        WHERE j.kind = 'bill_members'
+          AND j.payload ->> 'period' = %(period)s::text
+          AND (j.payload ->> 'from_member')::int = lo
+          AND j.status <> 'dead'
+      )
+      """,
+      {'period': period.isoformat(), 'chunk': chunk_size, 'max_attempts': max_attempts},
+    )
+    queued = cur.fetchone()[0]
+    if requeued:
+      cur.execute("NOTIFY job_queued, 'bill_members'")
+    connection.commit()
+  return queued, requeued
+
+def billing_progress(period):
+  """
+  ({job status: ranges}, invoices created so far) for one month's run.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT status, COUNT(*), COALESCE(SUM((result ->> 'invoices')::int), 0)
+      FROM job
+      WHERE kind = 'bill_members'
+        AND payload ->> 'period' = %s
+      GROUP BY status
+      """,
+      (period.isoformat(),),
+    )
+    rows = cur.fetchall()
+  return {status: ranges for status, ranges, _ in rows}, sum(invoices for _, _, invoices in rows)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Queue the monthly billing run for app.worker.")
+  parser.add_argument('period', help="month to bill, YYYY-MM")
+  parser.add_argument('--chunk-size', type=int, default=BILLING_CHUNK_SIZE)
+  parser.add_argument('--wait', action='store_true', help="print progress until every range is billed")
+  args = parser.parse_args(argv)
+
+  try:
+    period = parse_period(args.period)
+  except ValueError as e:
+    parser.error(str(e))
+
+  try:
+    queued, requeued = start_billing_run(period, args.chunk_size)
+    print(f"Queued {queued} member ranges for {period:%Y-%m}, requeued {requeued} failed ones")
+    while args.wait:
+      counts, invoices = billing_progress(period)
+      print(f"{counts.get('done', 0)} done, {counts.get('queued', 0) + counts.get('running', 0)} to go, "
+            f"{counts.get('dead', 0)} failed | {invoices} invoices")
+      if not counts.get('queued') and not counts.get('running'):
+        break
+      time.sleep(BILLING_PROGRESS_SECONDS)
+  except psycopg2.Error as e:
+    print("Billing run failed, Error:", e)
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
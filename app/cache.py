@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+  """
+  Small thread-safe LRU cache. Entries also expire ttl seconds after they
+  were stored, so writes made by other processes show up eventually.
+  """
+  def __init__(self, maxsize=1024, ttl=60):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return default
+      expires, value = entry
+      if expires < time.monotonic():
+        del self._data[key]
+        return default
+      self._data.move_to_end(key)
+      return value
+
+  def put(self, key, value):
+    if self.ttl <= 0 or self.maxsize <= 0:
+      return
+    with self._lock:
+      self._data[key] = (time.monotonic() + self.ttl, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def invalidate(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
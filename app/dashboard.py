@@ -0,0 +1,128 @@
+from app.cache import TTLCache
+from app.database import get_connection, record_write
+
+# Seconds a rendered dashboard may be served from memory (0 turns caching off).
+# Writes made through this process invalidate right away; the TTL only
+# bounds staleness from writes made by other processes.
+DASHBOARD_CACHE_TTL = 30
+DASHBOARD_CACHE_SIZE = 10000
+
+_cache = TTLCache(maxsize=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL)
+
+# Everything the dashboard shows, as one JSON document in one round trip.
+# Numbers and dates are sent as text so they print exactly as stored.
+DASHBOARD_QUERY = """
+SELECT json_build_object(
+  'member', (
+    SELECT json_build_object(
+      'full_name', m.full_name,
+      'date_of_birth', m.date_of_birth::text,
+      'phone', m.phone,
+      'gender', m.gender
+    )
+    FROM member m
+    WHERE m.member_id = %(member_id)s
+  ),
+  'metric', (
+    SELECT json_build_object(
+      'height', h.height::text,
+      'weight', h.weight::text,
+      'heart_rate', h.heart_rate,
+      'date', h.date::text
+    )
+    FROM health_metric h
+    WHERE h.member_id = %(member_id)s
+      -- the rollup knows the latest day, so only that day's partition is read
+      AND h.date >= (
+        SELECT MAX(d.day)
+        FROM health_metric_daily d
+        WHERE d.member_id = %(member_id)s
+      )
+      AND h.date < (
+        SELECT MAX(d.day) + 1
+        FROM health_metric_daily d
+        WHERE d.member_id = %(member_id)s
+      )
+    ORDER BY h.date DESC
+    LIMIT 1
+  ),
+  'goal', (
+    SELECT json_build_object(
+      'weight', g.weight::text,
+      'target_date', g.target_date::text
+    )
+    FROM fitness_goal g
+    WHERE g.member_id = %(member_id)s
+    LIMIT 1
+  ),
+  'sessions', (
+    SELECT COALESCE(json_agg(json_build_object(
+             'session_id', ts.session_id,
+             'session_type', ts.session_type,
+             'session_date', ts.session_date::text,
+             'start_time', ts.start_time::text,
+             'end_time', ts.end_time::text,
+             'status', ts.status,
+             'room_name', r.room_name,
+             'trainer_name', t.full_name
+           ) ORDER BY ts.session_date, ts.start_time), '[]'::json)
+    FROM session_members sm
+    JOIN training_sessions ts
+      ON sm.session_id = ts.session_id
+    LEFT JOIN rooms r
+      ON ts.room_id = r.room_id
+    JOIN trainer t
+      ON ts.trainer_id = t.trainer_id
+    WHERE sm.member_id = %(member_id)s
+      AND ts.status IN ('active', 'full')
+  ),
+  'invoices', (
+    SELECT COALESCE(json_agg(json_build_object(
+             'invoice_id', s.invoice_id,
+             'issue_date', s.issue_date::text,
+             'total_amount', s.total_amount::text,
+             'total_paid', s.total_paid::text,
+             'remaining', s.remaining::text,
+             'status', s.status
+           ) ORDER BY s.issue_date DESC), '[]'::json)
+    FROM member_invoice_summary s
+    WHERE s.member_id = %(member_id)s
+  ),
+  'outstanding', (
+    SELECT b.outstanding::text
+    FROM member_balance b
+    WHERE b.member_id = %(member_id)s
+  )
+)
+"""
+
+
+def load_dashboard(member_id):
+  """
+  Returns the dashboard document for a member (a dict with member, metric,
+  goal, sessions, invoices and outstanding keys), or None if the member
+  doesn't exist.
+  Raises psycopg2.Error on database failure.
+  """
+  member_id = int(member_id)
+  dashboard = _cache.get(member_id)
+  if dashboard is not None:
+    return dashboard
+
+  # A replica is fine once it has the member's own last change
+  with get_connection(autocommit=True, read_only=True, reader=('member', member_id)) as connection, connection.cursor() as cur:
+    cur.execute(DASHBOARD_QUERY, {'member_id': member_id})
+    dashboard = cur.fetchone()[0]
+
+  if dashboard['member'] is None:
+    return None
+  _cache.put(member_id, dashboard)
+  return dashboard
+
+def invalidate_dashboard(*member_ids):
+  """
+  Drops cached dashboards. Call after committing anything a dashboard shows.
+  """
+  record_write(*[('member', int(member_id)) for member_id in member_ids])
+  for member_id in member_ids:
+    _cache.invalidate(int(member_id))
@@ -1,19 +1,571 @@
+import contextlib
+import csv
+import itertools
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
+from app.cache import TTLCache
+from psycopg2 import errors, pool
+
+DB_CONFIG = {
+  'dbname': 'FinalProject',
+  'user': 'postgres',
+  'password': '1234',
+  'host': 'localhost',
+  'port': '5433',
+}
+
+# Hot standbys of DB_CONFIG that serve read-only actions, each given as the
+# DB_CONFIG keys that differ, e.g. [{'host': 'replica1'}, {'host': 'replica2'}].
+# With none, everything runs on the primary.
+REPLICA_CONFIGS = []
+# Replicas further behind the primary than this many seconds aren't read from
+REPLICA_MAX_LAG_SECONDS = 5
+# Seconds between replication lag checks of a replica
+REPLICA_CHECK_INTERVAL = 1
+# Seconds a replica that refused a connection is left alone, and how long a
+# connection attempt may take
+REPLICA_RETRY_SECONDS = 30
+REPLICA_CONNECT_TIMEOUT = 2
+# After a write recorded with record_write(), reads for the same key only go
+# to replicas that have replayed it, for this many seconds
+READ_YOUR_WRITES_SECONDS = 60
+
+# Pool sizing: connections kept open while idle / hard cap on open connections
+# (per server: the primary and each replica get a pool of their own)
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+# Seconds to wait for a free connection before giving up
+CHECKOUT_TIMEOUT = 30
+# Connections idle longer than this are pinged before being handed out
+HEALTH_CHECK_INTERVAL = 30
+# Default statement_timeout applied to every checkout (0 disables it)
+STATEMENT_TIMEOUT_MS = 5000
+# Record latency/row counts of every statement and transaction
+QUERY_STATS_ENABLED = True
+# Histogram bucket upper bounds in milliseconds (anything slower lands in +inf)
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Hot statements, prepared server-side on first use on each pooled
+# connection and then run by name with execute_prepared():
+#   name -> (parameter types, statement using $1, $2, ...)
+PREPARED_STATEMENTS = {
+  'login_member': (
+    ('integer',),
+    "SELECT * FROM member WHERE member_id = $1",
+  ),
+  'login_trainer': (
+    ('integer',),
+    "SELECT * FROM trainer WHERE trainer_id = $1",
+  ),
+  'book_personal_session': (
+    ('integer', 'integer', 'date', 'time', 'time', 'boolean'),
+    "SELECT session_id, room_id, room_name FROM book_personal_session($1, $2, $3, $4, $5, $6)",
+  ),
+  # Any live session or recurring class occurrence of the trainer
+  # overlapping [start, end) on that day
+  'trainer_overlap': (
+    ('integer', 'date', 'time', 'time'),
+    """
+    SELECT 1
+    FROM training_sessions
+    WHERE trainer_id = $1
+      AND status IN ('active', 'full')
+      AND tsrange(session_date + start_time, session_date + end_time) && tsrange($2 + $3, $2 + $4)
+    UNION ALL
+    SELECT 1
+    FROM class_occurrences($2, $2) o
+    WHERE o.trainer_id = $1
+      AND NOT (o.end_time <= $3 OR o.start_time >= $4)
+    LIMIT 1
+    """,
+  ),
+  # Same, for moving session $1 to [start, end) on that day
+  'session_overlap': (
+    ('integer', 'date', 'time', 'time'),
+    """
+    WITH moving AS (
+      SELECT trainer_id
+      FROM training_sessions
+      WHERE session_id = $1
+    )
+    SELECT 1
+    FROM training_sessions ts
+    WHERE ts.trainer_id = (SELECT trainer_id FROM moving)
+      AND ts.status IN ('active', 'full')
+      AND ts.session_id <> $1
+      AND tsrange(ts.session_date + ts.start_time, ts.session_date + ts.end_time) && tsrange($2 + $3, $2 + $4)
+    UNION ALL
+    SELECT 1
+    FROM class_occurrences($2, $2) o
+    WHERE o.trainer_id = (SELECT trainer_id FROM moving)
+      AND NOT (o.end_time <= $3 OR o.start_time >= $4)
+    LIMIT 1
+    """,
+  ),
+  # Join a dated group class ($1), or the occurrence of recurring class $2
+  # on $3 when $1 is NULL; returns the seats left
+  'join_class': (
+    ('integer', 'integer', 'date', 'integer'),
+    "SELECT join_class(COALESCE($1, class_session($2, $3)), $4)",
+  ),
+}
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_replicas = []
+_replica_turn = itertools.count()
+# key -> primary WAL position (bytes) right after the key's last write
+_write_positions = TTLCache(maxsize=100000, ttl=READ_YOUR_WRITES_SECONDS)
+# Written position unknown: read the key from the primary
+_PRIMARY_ONLY = float('inf')
+
+# Replay position and lag of a standby. A standby whose WAL receiver isn't
+# running (primary unreachable) is as far behind as it is, so lag is NULL.
+REPLICA_LAG_QUERY = """
+SELECT pg_last_wal_replay_lsn() - '0/0',
+       CASE
+         WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN NULL
+         WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+         ELSE EXTRACT(epoch FROM now() - pg_last_xact_replay_timestamp())
+       END
+"""
+
+
+class LatencyHistogram:
+  """
+  Fixed-bucket latency histogram for one (operation, statement) pair.
+  """
+  def __init__(self):
+    self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    self.calls = 0
+    self.rows = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+
+  def add(self, ms, rows):
+    self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+    self.calls += 1
+    self.rows += max(rows, 0)
+    self.total_ms += ms
+    self.max_ms = max(self.max_ms, ms)
+
+  def copy(self):
+    h = LatencyHistogram()
+    h.counts, h.calls, h.rows, h.total_ms, h.max_ms = list(self.counts), self.calls, self.rows, self.total_ms, self.max_ms
+    return h
+
+  def percentile(self, pct):
+    """
+    Upper bound of the bucket holding the pct-th call (capped at the max seen).
+    """
+    target = self.calls * pct / 100
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS, self.counts):
+      seen += count
+      if count and seen >= target:
+        return min(bound, self.max_ms)
+    return self.max_ms
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(operation, statement, ms, rows=0):
+  key = (operation, statement)
+  with _stats_lock:
+    histogram = _stats.get(key)
+    if histogram is None:
+      histogram = _stats[key] = LatencyHistogram()
+    histogram.add(ms, rows)
+
+def _statement_label(cur, query):
+  if not isinstance(query, (str, bytes)):
+    query = query.as_string(cur)
+  if isinstance(query, bytes):
+    query = query.decode(errors='replace')
+  label = ' '.join(query.split())
+  return label if len(label) <= 100 else label[:97] + '...'
+
+def _caller_name():
+  """
+  Name of the first function outside this module and contextlib, i.e. the
+  one that asked for the connection (book_training, view_dashboard, ...).
+  """
+  frame = sys._getframe(1)
+  while frame is not None and frame.f_code.co_filename in (__file__, contextlib.__file__):
+    frame = frame.f_back
+  return frame.f_code.co_name if frame is not None else '?'
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+  """
+  Cursor that times each statement and records it under the operation
+  that checked the connection out.
+  """
+  def _timed(self, method, query, *args):
+    connection = self.connection
+    if not QUERY_STATS_ENABLED:
+      return method(query, *args)
+    t0 = time.perf_counter()
+    if connection.txn_started is None and not connection.autocommit:
+      connection.txn_started = t0
+    try:
+      return method(query, *args)
+    finally:
+      ms = (time.perf_counter() - t0) * 1000
+      _record(connection.operation, _statement_label(self, query), ms, self.rowcount)
+
+  def execute(self, query, vars=None):
+    return self._timed(super().execute, query, vars)
+
+  def executemany(self, query, vars_list):
+    return self._timed(super().executemany, query, vars_list)
+
+  def copy_expert(self, sql, file, size=8192):
+    return self._timed(super().copy_expert, sql, file, size)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+  """
+  Connection handed out by the pool. Remembers the statement_timeout it was
+  last set to and when it was last returned so checkouts can skip needless
+  round trips. Hands out InstrumentedCursors and records how long each
+  transaction stayed open.
+  """
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.cursor_factory = InstrumentedCursor
+    self.statement_timeout_ms = None
+    self.last_used = 0.0
+    self.operation = '?'
+    self.txn_started = None
+    # Names from PREPARED_STATEMENTS already prepared on this session
+    self.prepared = set()
+    # The Replica this connection belongs to, None for the primary
+    self.replica = None
+
+  def _end_transaction(self, method):
+    started, self.txn_started = self.txn_started, None
+    try:
+      return method()
+    finally:
+      if started is not None and QUERY_STATS_ENABLED:
+        _record(self.operation, 'TRANSACTION', (time.perf_counter() - started) * 1000)
+
+  def commit(self):
+    return self._end_transaction(super().commit)
+
+  def rollback(self):
+    return self._end_transaction(super().rollback)
+
+
+class Replica:
+  """
+  One read replica: its own pool, plus how far it had replayed and how far
+  behind it was when last checked.
+  """
+  def __init__(self, config, maxconn):
+    self.config = dict(DB_CONFIG, connect_timeout=REPLICA_CONNECT_TIMEOUT, **config)
+    self.name = f"{self.config['host']}:{self.config['port']}"
+    # Connects lazily, so a replica that is down doesn't stop the app
+    self.pool = pool.ThreadedConnectionPool(0, maxconn, connection_factory=PooledConnection, **self.config)
+    self.slots = threading.BoundedSemaphore(maxconn)
+    self.replayed = -1
+    self.lag = None
+    self.checked = 0.0
+    self.down_until = 0.0
+
 
 #Connect to the db
-def get_connection():
+def init_pool(minconn=POOL_MIN_SIZE, maxconn=POOL_MAX_SIZE):
     """
-    Returns a connection to the database.
+    Opens the shared connection pool, and one per replica. Safe to call more
+    than once.
     """
-    connection = psycopg2.connect(
-            dbname='FinalProject',
-            user='postgres',
-            password='1234',
-            host='localhost',
-            port='5433'
+    global _pool, _pool_slots
+    with _pool_lock:
+      if _pool is None:
+        _pool = pool.ThreadedConnectionPool(
+          minconn, maxconn, connection_factory=PooledConnection, **DB_CONFIG
         )
-    print("Connected to database FinalProject")
-    return connection
+        _pool_slots = threading.BoundedSemaphore(maxconn)
+        _replicas[:] = [Replica(config, maxconn) for config in REPLICA_CONFIGS]
+        print(f"Connected to database {DB_CONFIG['dbname']} (pool {minconn}-{maxconn})")
+        if _replicas:
+          print(f"Read-only actions use replicas {', '.join(r.name for r in _replicas)}")
+    return _pool
+
+def close_pool():
+    """
+    Closes every pooled connection.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+      if _pool is not None:
+        _pool.closeall()
+        _pool = None
+        _pool_slots = None
+        for replica in _replicas:
+          replica.pool.closeall()
+        _replicas.clear()
+
+def _prepare(connection, statement_timeout_ms):
+  """
+  Health check + per-checkout settings. The SET doubles as the ping, so a
+  fresh or recently used connection with the right timeout costs nothing.
+  """
+  if connection.closed:
+    raise psycopg2.InterfaceError("connection already closed")
+
+  stale = time.monotonic() - connection.last_used > HEALTH_CHECK_INTERVAL
+  if not stale and connection.statement_timeout_ms == statement_timeout_ms:
+    return
+
+  connection.autocommit = True
+  try:
+    with connection.cursor() as cur:
+      cur.execute("SET statement_timeout = %s", (statement_timeout_ms,))
+  finally:
+    connection.autocommit = False
+  connection.statement_timeout_ms = statement_timeout_ms
+
+def _checkout(statement_timeout_ms, autocommit, operation, replica=None):
+  if _pool is None:
+    init_pool()
+  source, slots = (_pool, _pool_slots) if replica is None else (replica.pool, replica.slots)
+  # A busy replica isn't waited for, the read goes elsewhere
+  timeout = CHECKOUT_TIMEOUT if replica is None else 0
+  if not slots.acquire(timeout=timeout):
+    raise pool.PoolError(f"No database connection free after {timeout}s")
+
+  try:
+    # One retry: a dead connection is discarded and replaced by a fresh one
+    for attempt in range(2):
+      connection = source.getconn()
+      connection.operation = operation
+      connection.txn_started = None
+      connection.replica = replica
+      try:
+        _prepare(connection, statement_timeout_ms)
+        connection.autocommit = autocommit
+        return connection
+      except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        source.putconn(connection, close=True)
+        if attempt == 1:
+          raise
+  except BaseException:
+    slots.release()
+    raise
+
+def _release(connection):
+  replica = connection.replica
+  source, slots = (_pool, _pool_slots) if replica is None else (replica.pool, replica.slots)
+  try:
+    if connection.closed:
+      source.putconn(connection, close=True)
+      return
+    try:
+      # Never hand out a connection with an open transaction
+      if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+      connection.autocommit = False
+    except psycopg2.Error:
+      source.putconn(connection, close=True)
+      return
+    connection.last_used = time.monotonic()
+    source.putconn(connection)
+  finally:
+    slots.release()
+
+def _check_replica(replica, connection):
+  """
+  Measures replay position and lag on one of the replica's connections.
+  """
+  with connection.cursor() as cur:
+    cur.execute(REPLICA_LAG_QUERY)
+    replayed, lag = cur.fetchone()
+  if not connection.autocommit:
+    connection.rollback()
+  # NULL replay position: not a standby (e.g. promoted), never read from it
+  replica.replayed = -1 if replayed is None else int(replayed)
+  replica.lag = None if replayed is None or lag is None else float(lag)
+  replica.checked = time.monotonic()
+
+def _checkout_replica(statement_timeout_ms, autocommit, operation, reader):
+  """
+  A connection to the next replica, in turn, that is within
+  REPLICA_MAX_LAG_SECONDS and has replayed reader's last recorded write,
+  or None if no replica qualifies.
+  """
+  if not _replicas:
+    return None
+  needed = _write_positions.get(reader, -1) if reader is not None else -1
+  if needed == _PRIMARY_ONLY:
+    return None
+
+  turn = next(_replica_turn)
+  for i in range(len(_replicas)):
+    replica = _replicas[(turn + i) % len(_replicas)]
+    now = time.monotonic()
+    if replica.down_until > now:
+      continue
+    due = now - replica.checked >= REPLICA_CHECK_INTERVAL
+    # Known to be too far behind until the next check
+    if not due and (replica.lag is None or replica.lag > REPLICA_MAX_LAG_SECONDS):
+      continue
+
+    try:
+      connection = _checkout(statement_timeout_ms, autocommit, operation, replica)
+    except pool.PoolError:
+      continue
+    except psycopg2.OperationalError:
+      replica.down_until = now + REPLICA_RETRY_SECONDS
+      continue
+    try:
+      if due or replica.replayed < needed:
+        _check_replica(replica, connection)
+    except psycopg2.Error:
+      _release(connection)
+      replica.down_until = now + REPLICA_RETRY_SECONDS
+      continue
+    if replica.lag is not None and replica.lag <= REPLICA_MAX_LAG_SECONDS and replica.replayed >= needed:
+      return connection
+    _release(connection)
+  return None
+
+def record_write(*keys):
+  """
+  Read-your-writes: call right after committing a change made for keys
+  (e.g. ('member', 42)). For READ_YOUR_WRITES_SECONDS, reads that name one
+  of them as reader= only go to replicas that have replayed the change.
+  Does nothing without replicas.
+  """
+  if not _replicas or not keys:
+    return
+  try:
+    with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+      cur.execute("SELECT pg_current_wal_lsn() - '0/0'")
+      position = int(cur.fetchone()[0])
+  except psycopg2.Error:
+    position = _PRIMARY_ONLY
+  for key in keys:
+    _write_positions.put(key, position)
+
+def replica_status():
+  """
+  [(name, lag seconds or None, seconds since checked, down), ...]
+  """
+  now = time.monotonic()
+  return [
+    (r.name, r.lag, round(now - r.checked, 1) if r.checked else None, r.down_until > now)
+    for r in _replicas
+  ]
+
+def execute_prepared(cur, name, params=()):
+  """
+  Runs PREPARED_STATEMENTS[name] with params on cur, preparing it on this
+  connection first if needed. A fresh or recycled connection simply
+  prepares again. If the server forgot the statement (e.g. after DISCARD
+  ALL), it is re-prepared and retried when no transaction work is lost.
+  """
+  connection = cur.connection
+  placeholders = ', '.join(['%s'] * len(params))
+  execute = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+  for attempt in range(2):
+    # The retry is only safe if it doesn't throw away earlier statements
+    retry_safe = (connection.autocommit or
+                  connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+    try:
+      if name not in connection.prepared:
+        argtypes, statement = PREPARED_STATEMENTS[name]
+        cur.execute(f"PREPARE {name} ({', '.join(argtypes)}) AS {statement}")
+        connection.prepared.add(name)
+      cur.execute(execute, params)
+      return cur
+    except errors.InvalidSqlStatementName:
+      connection.prepared.discard(name)
+      if attempt == 1 or not retry_safe:
+        raise
+      if not connection.autocommit:
+        connection.rollback()
+
+@contextmanager
+def get_connection(statement_timeout_ms=STATEMENT_TIMEOUT_MS, autocommit=False, operation=None,
+                   read_only=False, reader=None):
+    """
+    Borrows a pooled connection for one action. Anything not committed when
+    the block exits is rolled back before the connection goes back.
+
+    autocommit=True skips the BEGIN/COMMIT round trips, for actions that are
+    a single atomic statement (e.g. a call to a server-side function).
+
+    read_only=True lets the action run on a replica at most
+    REPLICA_MAX_LAG_SECONDS behind, one that has also replayed the last
+    record_write() of reader if given. Falls back to the primary.
+
+    Statements are recorded under operation, which defaults to the name of
+    the calling function.
+    """
+    if operation is None:
+      operation = _caller_name()
+    connection = None
+    if read_only:
+      connection = _checkout_replica(statement_timeout_ms, autocommit, operation, reader)
+    if connection is None:
+      connection = _checkout(statement_timeout_ms, autocommit, operation)
+    try:
+      yield connection
+    finally:
+      _release(connection)
+
+
+def query_stats(order_by='p99_ms', buckets=False):
+  """
+  Snapshot of the recorded latencies, one dict per (operation, statement),
+  slowest first. statement is 'TRANSACTION' for whole-transaction times.
+  buckets=True adds each histogram's raw bucket counts as 'buckets'.
+  """
+  # Copied under the lock, so every figure of a row comes from the same calls
+  with _stats_lock:
+    items = [(key, h.copy()) for key, h in _stats.items()]
+  rows = []
+  for (operation, statement), h in items:
+    row = {
+      'operation': operation,
+      'statement': statement,
+      'calls': h.calls,
+      'rows': h.rows,
+      'mean_ms': round(h.total_ms / h.calls, 3),
+      'p50_ms': round(h.percentile(50), 3),
+      'p95_ms': round(h.percentile(95), 3),
+      'p99_ms': round(h.percentile(99), 3),
+      'max_ms': round(h.max_ms, 3),
+      'total_ms': round(h.total_ms, 3),
+    }
+    if buckets:
+      row['buckets'] = h.counts
+    rows.append(row)
+  rows.sort(key=lambda r: r[order_by], reverse=True)
+  return rows
+
+def reset_query_stats():
+  with _stats_lock:
+    _stats.clear()
 
-def remove_connection(connection):
-    connection.close()
+def write_query_stats(path):
+  """
+  Dumps query_stats() plus the raw histogram buckets to a CSV file.
+  """
+  columns = ['operation', 'statement', 'calls', 'rows', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'total_ms']
+  with open(path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(columns + [f"le_{b}ms" for b in LATENCY_BUCKETS_MS] + ['le_inf'])
+    for row in query_stats(buckets=True):
+      writer.writerow([row[c] for c in columns] + row['buckets'])
@@ -0,0 +1,393 @@
+"""
+Deterministic synthetic data for load testing.
+
+  python -m app.datagen --scale small
+  python -m app.datagen --members 1000000 --metrics 50000000 --yes
+
+Wipes every table, then streams generated rows in with COPY. The same seed
+and sizes always produce the same database.
+"""
+import argparse
+import random
+import sys
+from array import array
+from datetime import date, datetime, timedelta
+
+from app.database import get_connection
+
+SCALES = {
+  'small': dict(members=10000, trainers=100, metrics=200000, sessions=50000,
+                invoices=20000, payments=40000),
+  'medium': dict(members=100000, trainers=500, metrics=5000000, sessions=500000,
+                 invoices=500000, payments=1000000),
+  'production': dict(members=1000000, trainers=2000, metrics=50000000, sessions=5000000,
+                     invoices=5000000, payments=10000000),
+}
+
+# Generated lines handed to COPY per read
+LINES_PER_CHUNK = 10000
+
+# Dates are spread over this window ending at EPOCH
+EPOCH = date(2025, 12, 1)
+HISTORY_DAYS = 730
+
+FIRST_NAMES = ['Alice', 'Bob', 'Charlie', 'Diana', 'Ethan', 'Fatima', 'George', 'Hana',
+               'Ivan', 'Julia', 'Kenji', 'Lina', 'Marco', 'Nadia', 'Omar', 'Priya',
+               'Quinn', 'Rosa', 'Sam', 'Tara', 'Umar', 'Vera', 'Wei', 'Yara', 'Zoe']
+LAST_NAMES = ['Smith', 'Johnson', 'Wong', 'Carter', 'Nguyen', 'Garcia', 'Martin', 'Lee',
+              'Brown', 'Singh', 'Kim', 'Lopez', 'Chen', 'Patel', 'Cohen', 'Rossi']
+EQUIPMENT_TYPES = ['Treadmill', 'Exercise Bike', 'Rowing Machine', 'Bench Press',
+                   'Dumbbells Set', 'Smith Machine', 'Cable Machine', 'Kettlebells']
+PAYMENT_METHODS = ['card', 'cash', 'debit']
+
+# (table, serial column) for every table whose ids we write explicitly
+SERIAL_COLUMNS = [
+  ('member', 'member_id'), ('trainer', 'trainer_id'), ('rooms', 'room_id'),
+  ('equipment', 'equipment_id'), ('fitness_goal', 'goal_id'),
+  ('health_metric', 'metric_id'), ('class_schedule', 'schedule_id'),
+  ('training_sessions', 'session_id'),
+  ('session_members', 'session_member_id'), ('invoice', 'invoice_id'),
+  ('payment', 'payment_id'),
+]
+
+# Tables whose triggers are off during the load: derived state (balances,
+# daily metrics, seat counters) is rebuilt set-wise afterwards, and
+# generated sessions never clash with generated recurring classes, so the
+# per-row schedule check is skipped
+TRIGGER_TABLES = ['payment', 'invoice', 'health_metric', 'training_sessions', 'session_members']
+
+
+class LineStream:
+  """
+  File-like wrapper so copy_expert can pull generated rows lazily instead
+  of building the whole table in memory.
+  """
+  def __init__(self, lines):
+    self._lines = iter(lines)
+    self._buf = ''
+
+  def _fill(self, size):
+    parts = [self._buf]
+    length = len(self._buf)
+    while size < 0 or length < size:
+      chunk = []
+      for line in self._lines:
+        chunk.append(line)
+        if len(chunk) >= LINES_PER_CHUNK:
+          break
+      if not chunk:
+        break
+      text = ''.join(chunk)
+      parts.append(text)
+      length += len(text)
+    self._buf = ''.join(parts)
+
+  def read(self, size=-1):
+    self._fill(size)
+    if size < 0:
+      data, self._buf = self._buf, ''
+    else:
+      data, self._buf = self._buf[:size], self._buf[size:]
+    return data
+
+
+def _day(rng):
+  return EPOCH - timedelta(days=rng.randrange(HISTORY_DAYS))
+
+def _clock(minutes):
+  return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+def gen_members(rng, n):
+  for member_id in range(1, n + 1):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    dob = date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))
+    phone = f"555-{rng.randrange(1000):03d}-{rng.randrange(10000):04d}"
+    gender = rng.choice('MF')
+    yield f"{member_id}\t{name}\t{dob}\t{phone}\t{gender}\n"
+
+def gen_trainers(rng, n, windows):
+  for trainer_id in range(1, n + 1):
+    start = rng.randrange(6, 13) * 60
+    windows.append((start, start + 8 * 60))
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    phone = f"555-{rng.randrange(1000):03d}-{rng.randrange(10000):04d}"
+    yield f"{trainer_id}\t{name}\t{phone}\t{_clock(start)}\t{_clock(start + 8 * 60)}\n"
+
+def gen_rooms(rng, n):
+  for room_id in range(1, n + 1):
+    yield f"{room_id}\tRoom {room_id}\t{rng.choice((2, 10, 15, 20, 30))}\n"
+
+def gen_equipment(rng, rooms):
+  equipment_id = 0
+  for room_id in range(1, rooms + 1):
+    for _ in range(3):
+      equipment_id += 1
+      status = rng.choices((0, 1, 2), weights=(90, 7, 3))[0]
+      issue_since = _day(rng) if status else '\\N'
+      yield f"{equipment_id}\t{room_id}\t{rng.choice(EQUIPMENT_TYPES)}\t{status}\t{issue_since}\n"
+
+def gen_goals(rng, members):
+  goal_id = 0
+  for member_id in range(1, members + 1):
+    if rng.random() < 0.6:
+      goal_id += 1
+      yield f"{goal_id}\t{member_id}\t{rng.randrange(110, 220)}.0\t{EPOCH + timedelta(days=rng.randrange(365))}\n"
+
+def gen_metrics(rng, n, members):
+  for metric_id in range(1, n + 1):
+    member_id = rng.randrange(1, members + 1)
+    # Per-member baseline so a member's history looks like one person
+    height = 150 + member_id % 50
+    weight = 110 + member_id % 110 + rng.randrange(-50, 50) / 10
+    taken = datetime.combine(_day(rng), datetime.min.time()) + timedelta(minutes=rng.randrange(1440))
+    yield f"{metric_id}\t{member_id}\t{height}\t{weight:.1f}\t{rng.randrange(55, 100)}\t{taken}\n"
+
+def gen_schedules(rng, windows):
+  """
+  A weekly class for every other trainer, in their own room. EPOCH is a
+  Monday and every live session is on EPOCH, so the classes skip Mondays
+  and never clash with them.
+  """
+  schedule_id = 0
+  for trainer_id, (start, end) in enumerate(windows, start=1):
+    if trainer_id % 2:
+      continue
+    schedule_id += 1
+    weekdays = sorted(rng.sample(range(2, 8), rng.randrange(1, 4)))
+    minute = start + rng.randrange((end - start - 60) // 60 + 1) * 60
+    yield (f"{schedule_id}\t{trainer_id}\t{trainer_id}\t{{{','.join(map(str, weekdays))}}}\t"
+           f"{_clock(minute)}\t{_clock(minute + 60)}\t{rng.randrange(10, 21)}\t"
+           f"{EPOCH - timedelta(days=HISTORY_DAYS)}\n")
+
+def gen_sessions(rng, n, windows, members, enrolments):
+  """
+  Live (active/full) sessions are laid out so they never overlap: trainer t
+  works hourly in room t through their window, on EPOCH. Everything else is
+  history ('completed' / 'cancelled') on earlier days, which the overlap
+  constraints ignore.
+  """
+  session_id = 0
+  for trainer_id, (start, end) in enumerate(windows, start=1):
+    for minute in range(start, end, 60):
+      if session_id >= n:
+        return
+      session_id += 1
+      yield _session(rng, session_id, trainer_id, trainer_id, EPOCH, minute, 45, True, members, enrolments)
+
+  while session_id < n:
+    session_id += 1
+    trainer_id = rng.randrange(1, len(windows) + 1)
+    start, end = windows[trainer_id - 1]
+    length = rng.choice((30, 45, 60))
+    minute = start + rng.randrange((end - start - length) // 15 + 1) * 15
+    yield _session(rng, session_id, trainer_id, rng.randrange(1, len(windows) + 1),
+                   _day(rng), minute, length, False, members, enrolments)
+
+def _session(rng, session_id, trainer_id, room_id, day, minute, length, live, members, enrolments):
+  group = rng.random() < 0.3
+  capacity = rng.randrange(10, 21) if group else 1
+  enrolled = rng.randrange(capacity + 1) if group else 1
+  if live:
+    status = 'full' if enrolled == capacity and group else 'active'
+  else:
+    status = rng.choices(('completed', 'cancelled'), weights=(85, 15))[0]
+  for member_id in rng.sample(range(1, members + 1), enrolled):
+    enrolments.append(session_id)
+    enrolments.append(member_id)
+  return (f"{session_id}\t{trainer_id}\t{room_id}\t{'group' if group else 'personal'}\t{day}\t"
+          f"{_clock(minute)}\t{_clock(minute + length)}\t{status}\t{capacity}\n")
+
+def gen_session_members(enrolments):
+  for i in range(0, len(enrolments), 2):
+    yield f"{i // 2 + 1}\t{enrolments[i]}\t{enrolments[i + 1]}\n"
+
+def gen_invoices(rng, n, members, totals):
+  for invoice_id in range(1, n + 1):
+    cents = rng.randrange(2000, 20001, 500)
+    cancelled = rng.random() < 0.05
+    totals.append(0 if cancelled else cents)
+    status = 'cancelled' if cancelled else 'unpaid'
+    yield f"{invoice_id}\t{rng.randrange(1, members + 1)}\t{_day(rng)}\t{cents / 100:.2f}\t{status}\n"
+
+def gen_payments(rng, n, totals):
+  """
+  Splits roughly n payments over the invoices without ever overpaying one.
+  """
+  per_invoice = n / max(len(totals), 1)
+  payment_id = 0
+  for invoice_id, cents in enumerate(totals, start=1):
+    if payment_id >= n:
+      return
+    if not cents:
+      continue
+    count = min(rng.randrange(int(per_invoice * 2) + 1), n - payment_id)
+    if not count:
+      continue
+    # Most invoices end up fully paid, the rest part paid
+    paid = cents if rng.random() < 0.7 else cents * rng.randrange(1, 10) // 10
+    share = paid // count
+    if not share:
+      continue
+    for _ in range(count):
+      payment_id += 1
+      yield f"{payment_id}\t{invoice_id}\t{EPOCH}\t{share / 100:.2f}\t{rng.choice(PAYMENT_METHODS)}\n"
+
+def _copy(cur, table, columns, lines):
+  cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", LineStream(lines))
+  print(f"  {table}: {cur.rowcount} rows")
+
+def rebuild_derived_state(cur):
+  """
+  Recomputes what the triggers normally maintain, set-wise, after a load
+  that ran with them disabled.
+  """
+  cur.execute(
+    """
+    UPDATE invoice i
+    SET amount_paid = p.paid,
+        status = invoice_status_for(i.status, p.paid, i.total_amount)
+    FROM (
+      SELECT invoice_id, SUM(amount) AS paid
+      FROM payment
+      GROUP BY invoice_id
+    ) p
+    WHERE i.invoice_id = p.invoice_id
+    """
+  )
+  cur.execute("TRUNCATE member_balance")
+  cur.execute(
+    """
+    INSERT INTO member_balance (member_id, outstanding)
+    SELECT member_id, COALESCE(SUM(remaining) FILTER (WHERE status <> 'cancelled'), 0)
+    FROM invoice
+    GROUP BY member_id
+    """
+  )
+  cur.execute("TRUNCATE health_metric_daily")
+  cur.execute(
+    """
+    INSERT INTO health_metric_daily
+    SELECT member_id, date::date,
+           COUNT(*), COUNT(weight), COALESCE(SUM(weight), 0), MIN(weight), MAX(weight),
+           COUNT(heart_rate), COALESCE(SUM(heart_rate), 0), MIN(heart_rate), MAX(heart_rate)
+    FROM health_metric
+    GROUP BY member_id, date::date
+    """
+  )
+  # Generated statuses already say 'full' exactly when a class is
+  cur.execute(
+    """
+    UPDATE training_sessions ts
+    SET enrolled = sm.members
+    FROM (
+      SELECT session_id, COUNT(*) AS members
+      FROM session_members
+      GROUP BY session_id
+    ) sm
+    WHERE ts.session_id = sm.session_id
+    """
+  )
+  # The close job the insert trigger would have queued for each live session
+  cur.execute(
+    """
+    INSERT INTO job (kind, payload, run_at)
+    SELECT 'complete_session', jsonb_build_object('session_id', session_id),
+           (session_date + end_time)::timestamptz
+    FROM training_sessions
+    WHERE status IN ('active', 'full')
+    """
+  )
+
+def generate(members, trainers, metrics, sessions, invoices, payments, rooms=None, seed=3005):
+  rng = random.Random(seed)
+  rooms = rooms or trainers
+  if rooms < trainers:
+    raise ValueError("Need at least one room per trainer to lay out live sessions")
+
+  windows = []
+  enrolments = array('l')
+  totals = array('l')
+
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      TRUNCATE member, trainer, rooms, equipment, fitness_goal, health_metric, health_metric_daily,
+               class_schedule, training_sessions, session_members, invoice, payment, member_balance, job
+      RESTART IDENTITY CASCADE
+      """
+    )
+    for table in TRIGGER_TABLES:
+      cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+    # Monthly health_metric partitions for the whole generated history
+    cur.execute(
+      "SELECT ensure_health_metric_partitions(%s, %s)",
+      (EPOCH - timedelta(days=HISTORY_DAYS), EPOCH),
+    )
+
+    _copy(cur, 'member', ('member_id', 'full_name', 'date_of_birth', 'phone', 'gender'),
+          gen_members(rng, members))
+    _copy(cur, 'trainer', ('trainer_id', 'full_name', 'phone', 'availability_start', 'availability_end'),
+          gen_trainers(rng, trainers, windows))
+    _copy(cur, 'rooms', ('room_id', 'room_name', 'capacity'), gen_rooms(rng, rooms))
+    _copy(cur, 'equipment', ('equipment_id', 'room_id', 'type', 'status', 'issue_since'), gen_equipment(rng, rooms))
+    _copy(cur, 'fitness_goal', ('goal_id', 'member_id', 'weight', 'target_date'), gen_goals(rng, members))
+    _copy(cur, 'health_metric', ('metric_id', 'member_id', 'height', 'weight', 'heart_rate', 'date'),
+          gen_metrics(rng, metrics, members))
+    _copy(cur, 'class_schedule',
+          ('schedule_id', 'trainer_id', 'room_id', 'weekdays', 'start_time', 'end_time', 'capacity', 'valid_from'),
+          gen_schedules(rng, windows))
+    _copy(cur, 'training_sessions',
+          ('session_id', 'trainer_id', 'room_id', 'session_type', 'session_date', 'start_time', 'end_time',
+           'status', 'capacity'),
+          gen_sessions(rng, sessions, windows, members, enrolments))
+    _copy(cur, 'session_members', ('session_member_id', 'session_id', 'member_id'),
+          gen_session_members(enrolments))
+    _copy(cur, 'invoice', ('invoice_id', 'member_id', 'issue_date', 'total_amount', 'status'),
+          gen_invoices(rng, invoices, members, totals))
+    _copy(cur, 'payment', ('payment_id', 'invoice_id', 'payment_date', 'amount', 'method'),
+          gen_payments(rng, payments, totals))
+
+    print("  rebuilding derived state")
+    rebuild_derived_state(cur)
+    for table in TRIGGER_TABLES:
+      cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+    for table, column in SERIAL_COLUMNS:
+      cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), COALESCE(MAX({column}), 0) + 1, false) FROM {table}"
+      )
+    connection.commit()
+
+  # ANALYZE can't run inside the load transaction's snapshot usefully
+  with get_connection(statement_timeout_ms=0, autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute("ANALYZE")
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Fill the database with deterministic synthetic data.")
+  parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+  for name in SCALES['small']:
+    parser.add_argument(f'--{name}', type=int, help=f"override the {name} count of the chosen scale")
+  parser.add_argument('--rooms', type=int, help="defaults to one room per trainer")
+  parser.add_argument('--seed', type=int, default=3005)
+  parser.add_argument('--yes', action='store_true', help="don't ask before wiping the database")
+  args = parser.parse_args(argv)
+
+  sizes = dict(SCALES[args.scale])
+  for name in sizes:
+    if getattr(args, name) is not None:
+      sizes[name] = getattr(args, name)
+
+  if not args.yes:
+    answer = input("This deletes ALL data in the database. Continue? (y/n): ")
+    if answer.strip().lower() != 'y':
+      print("Cancelled.")
+      return 1
+
+  print(f"Generating {sizes} (seed {args.seed})")
+  generate(rooms=args.rooms, seed=args.seed, **sizes)
+  print("Done.")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
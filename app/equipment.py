@@ -0,0 +1,87 @@
+from app.database import get_connection
+from app.refdata import invalidate_refdata
+
+EQUIPMENT_STATUS = {0: 'operational', 1: 'needs maintenance', 2: 'out of order'}
+# Items per page of the inventory and the maintenance queue
+EQUIPMENT_PAGE_SIZE = 50
+# Leave rooms with out-of-order equipment out of automatic room selection
+# (bookings, open slots) and of the free rooms offered for new classes
+SKIP_OUT_OF_ORDER_ROOMS = True
+
+
+def status_label(status):
+  return EQUIPMENT_STATUS.get(status, 'N/A')
+
+def find_equipment(room_id=None, eq_type=None, status=None, open_issues=False,
+                   after_id=0, limit=EQUIPMENT_PAGE_SIZE):
+  """
+  One page of the inventory in equipment_id order, filtered by any of
+  room, type, status, or open_issues (any status but operational).
+  Pass the last equipment_id of a page as after_id for the next one.
+  [(equipment_id, room_id, type, status, issue_since, issue_note), ...]
+  """
+  conditions = ["equipment_id > %s"]
+  params = [after_id]
+  if room_id is not None:
+    conditions.append("room_id = %s")
+    params.append(room_id)
+  if eq_type:
+    conditions.append("type = %s")
+    params.append(eq_type)
+  if status is not None:
+    conditions.append("status = %s")
+    params.append(status)
+  if open_issues:
+    # Matches the predicate of idx_equipment_open_issues
+    conditions.append("status <> 0")
+  params.append(limit)
+
+  with get_connection(autocommit=True, read_only=True, reader=('refdata', 'equipment')) as connection, connection.cursor() as cur:
+    cur.execute(
+      f"""
+      SELECT equipment_id, room_id, type, status, issue_since, issue_note
+      FROM equipment
+      WHERE {' AND '.join(conditions)}
+      ORDER BY equipment_id
+      LIMIT %s
+      """,
+      params,
+    )
+    return cur.fetchall()
+
+def maintenance_queue(room_id=None, limit=EQUIPMENT_PAGE_SIZE):
+  """
+  Equipment with an open issue, oldest issue first:
+  [(equipment_id, room_id, room_name, type, status, issue_since, issue_note), ...]
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT equipment_id, room_id, room_name, type, status, issue_since, issue_note
+      FROM maintenance_queue
+      WHERE %(room_id)s::int IS NULL OR room_id = %(room_id)s
+      ORDER BY issue_since, equipment_id
+      LIMIT %(limit)s
+      """,
+      {'room_id': room_id, 'limit': limit},
+    )
+    return cur.fetchall()
+
+def set_equipment_status(equipment_id, status, note=None):
+  """
+  Logs an issue (or a fix, with status 0). The issue date is kept by the
+  equipment trigger. Returns False if there is no such equipment.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      UPDATE equipment
+      SET status = %s, issue_note = COALESCE(%s, issue_note)
+      WHERE equipment_id = %s
+      """,
+      (status, note, equipment_id),
+    )
+    updated = cur.rowcount == 1
+  if updated:
+    invalidate_refdata('equipment')
+  return updated
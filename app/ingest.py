@@ -0,0 +1,181 @@
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+from app.dashboard import invalidate_dashboard
+from app.database import get_connection
+
+# Rows validated and COPY'd per transaction
+CHUNK_SIZE = 50000
+
+METRIC_COLUMNS = ('member_id', 'height', 'weight', 'heart_rate', 'date')
+
+# NUMERIC(5,2) columns can't hold 1000 or more
+MAX_MEASUREMENT = Decimal('999.99')
+
+
+def read_records(path):
+  """
+  Streams (line_no, record) pairs from a CSV file with a header row or a
+  JSON-lines file (.jsonl / .ndjson).
+  """
+  with open(path, newline='') as f:
+    if path.endswith(('.jsonl', '.ndjson')):
+      for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+          continue
+        try:
+          record = json.loads(line)
+        except ValueError:
+          record = None
+        yield line_no, record
+    else:
+      # line 1 is the header
+      for line_no, record in enumerate(csv.DictReader(f), start=2):
+        yield line_no, record
+
+def _measurement(value, field):
+  if value in (None, ''):
+    return None
+  try:
+    number = Decimal(str(value))
+  except InvalidOperation:
+    raise ValueError(f"{field} is not a number")
+  if not number.is_finite() or abs(number) > MAX_MEASUREMENT:
+    raise ValueError(f"{field} out of range")
+  return number
+
+def parse_record(record):
+  """
+  Turns one raw record into a health_metric row tuple or raises ValueError
+  with the reason it was rejected.
+  """
+  if not isinstance(record, dict):
+    raise ValueError("malformed record")
+
+  try:
+    member_id = int(record.get('member_id'))
+  except (TypeError, ValueError):
+    raise ValueError("member_id missing or not an integer")
+
+  height = _measurement(record.get('height'), 'height')
+  weight = _measurement(record.get('weight'), 'weight')
+
+  heart_rate = record.get('heart_rate')
+  if heart_rate in (None, ''):
+    heart_rate = None
+  else:
+    try:
+      heart_rate = int(heart_rate)
+    except (TypeError, ValueError):
+      raise ValueError("heart_rate is not an integer")
+    if not 0 < heart_rate < 1000:
+      raise ValueError("heart_rate out of range")
+
+  date = record.get('date')
+  if date in (None, ''):
+    date = datetime.now()
+  else:
+    try:
+      date = datetime.fromisoformat(str(date))
+    except ValueError:
+      raise ValueError("date is not an ISO timestamp")
+
+  return (member_id, height, weight, heart_rate, date)
+
+def _copy_line(row):
+  return '\t'.join('\\N' if v is None else str(v) for v in row) + '\n'
+
+def copy_chunk(cur, chunk):
+  """
+  Loads one chunk of (line_no, row) pairs. Member IDs are checked with a
+  single lookup for the whole chunk; rows for unknown members are returned
+  as rejects and everything else goes through COPY FROM STDIN.
+  """
+  member_ids = list({row[0] for _, row in chunk})
+  cur.execute(
+    """
+    SELECT member_id
+    FROM member
+    WHERE member_id = ANY(%s)
+    """,
+    (member_ids,),
+  )
+  known = {r[0] for r in cur.fetchall()}
+
+  rejected = []
+  buf = io.StringIO()
+  loaded = 0
+  for line_no, row in chunk:
+    if row[0] in known:
+      buf.write(_copy_line(row))
+      loaded += 1
+    else:
+      rejected.append((line_no, f"member {row[0]} does not exist"))
+
+  if loaded:
+    buf.seek(0)
+    cur.copy_expert(
+      f"COPY health_metric ({', '.join(METRIC_COLUMNS)}) FROM STDIN",
+      buf,
+    )
+  return loaded, rejected
+
+def ingest_metrics(path, chunk_size=CHUNK_SIZE):
+  """
+  Bulk loads health metrics from a CSV/JSON-lines export. Each chunk commits
+  on its own, so a bad row (or even a failed chunk) never aborts the batch.
+  Returns (rows_loaded, [(line_no, reason), ...]).
+  """
+  loaded = 0
+  rejected = []
+  chunk = []
+
+  def flush():
+    nonlocal loaded
+    try:
+      with get_connection() as connection, connection.cursor() as cur:
+        chunk_loaded, chunk_rejected = copy_chunk(cur, chunk)
+        connection.commit()
+      loaded += chunk_loaded
+      rejected.extend(chunk_rejected)
+      invalidate_dashboard(*{row[0] for _, row in chunk})
+    except psycopg2.Error as e:
+      reason = f"chunk failed: {str(e).strip()}"
+      rejected.extend((line_no, reason) for line_no, _ in chunk)
+    chunk.clear()
+
+  for line_no, record in read_records(path):
+    try:
+      chunk.append((line_no, parse_record(record)))
+    except ValueError as e:
+      rejected.append((line_no, str(e)))
+      continue
+    if len(chunk) >= chunk_size:
+      flush()
+
+  if chunk:
+    flush()
+  rejected.sort()
+  return loaded, rejected
+
+def write_rejects(rejected, path):
+  with open(path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['line', 'reason'])
+    writer.writerows(rejected)
+
+
+if __name__ == "__main__":
+  if len(sys.argv) != 2:
+    print("Usage: python -m app.ingest <metrics.csv|metrics.jsonl>")
+    sys.exit(1)
+  rows_loaded, rows_rejected = ingest_metrics(sys.argv[1])
+  print(f"Loaded {rows_loaded} metrics, rejected {len(rows_rejected)}")
+  if rows_rejected:
+    write_rejects(rows_rejected, sys.argv[1] + '.rejected.csv')
+    print(f"Rejected rows written to {sys.argv[1]}.rejected.csv")
@@ -0,0 +1,147 @@
+"""
+Background jobs: what each kind does, and how the app queues and inspects
+them. app.worker runs them.
+
+A handler is called as handler(cur, payload) and returns a JSON-able
+result. cur is the transaction that marks the job done, so work done on it
+commits exactly once with the job; handlers that commit on their own
+connections (imports, settlements) can't be undone by a failure after they
+commit and are queued with max_attempts 1.
+"""
+import json
+
+from app.database import get_connection
+from app.ingest import ingest_metrics, write_rejects
+from app.payments import post_settlement, write_report
+
+# Queued / done / dead jobs listed on the admin screen
+JOB_LIST_LIMIT = 20
+
+
+def complete_session(cur, payload):
+  """
+  Marks a live session completed once its end time has passed, which also
+  takes it out of the trainer and room overlap constraints.
+  """
+  cur.execute(
+    """
+    UPDATE training_sessions
+    SET status = 'completed'
+    WHERE session_id = %s
+      AND status IN ('active', 'full')
+      AND session_date + end_time <= localtimestamp
+    """,
+    (payload['session_id'],),
+  )
+  return {'completed': cur.rowcount}
+
+def import_health_metrics(cur, payload):
+  path = payload['path']
+  loaded, rejected = ingest_metrics(path)
+  result = {'loaded': loaded, 'rejected': len(rejected)}
+  if rejected:
+    result['rejects_file'] = path + '.rejected.csv'
+    write_rejects(rejected, result['rejects_file'])
+  return result
+
+def post_settlement_file(cur, payload):
+  path = payload['path']
+  report = post_settlement(path)
+  accepted = sum(1 for _, _, _, reason in report if reason is None)
+  report_path = path + '.report.csv'
+  write_report(report, report_path)
+  return {'accepted': accepted, 'rejected': len(report) - accepted, 'report_file': report_path}
+
+def bill_members(cur, payload):
+  """
+  One member_id range of a monthly billing run (see app/billing.py). The
+  invoices commit with the job, so a retried chunk never bills twice.
+  """
+  cur.execute(
+    "SELECT bill_members(%s, %s, %s, %s)",
+    (payload['period'], payload['from_member'], payload['to_member'], json.dumps(payload['rates'])),
+  )
+  return {'invoices': cur.fetchone()[0]}
+
+# kind: (handler, max_attempts)
+JOB_KINDS = {
+  'complete_session': (complete_session, 5),
+  'bill_members': (bill_members, 5),
+  'import_health_metrics': (import_health_metrics, 1),
+  'post_settlement': (post_settlement_file, 1),
+}
+
+
+def enqueue(cur, kind, payload, delay_seconds=0):
+  """
+  Queues a job in cur's transaction and returns its id.
+  """
+  _, max_attempts = JOB_KINDS[kind]
+  cur.execute(
+    "SELECT enqueue_job(%s, %s, now() + make_interval(secs => %s), %s)",
+    (kind, json.dumps(payload), delay_seconds, max_attempts),
+  )
+  return cur.fetchone()[0]
+
+def submit_job(kind, payload):
+  """
+  Queues a job on its own and returns its id.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    return enqueue(cur, kind, payload)
+
+def job_counts():
+  """
+  [(kind, status, jobs, oldest_run_at), ...]
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT kind, status, COUNT(*), MIN(run_at)
+      FROM job
+      GROUP BY kind, status
+      ORDER BY kind, status
+      """
+    )
+    return cur.fetchall()
+
+def list_jobs(status, limit=JOB_LIST_LIMIT):
+  """
+  Most recent jobs in one status:
+  [(job_id, kind, payload, attempts, run_at, finished_at, last_error, result), ...]
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT job_id, kind, payload, attempts, run_at, finished_at, last_error, result
+      FROM job
+      WHERE status = %s
+      ORDER BY job_id DESC
+      LIMIT %s
+      """,
+      (status, limit),
+    )
+    return cur.fetchall()
+
+def retry_dead_jobs(job_ids=None):
+  """
+  Puts dead jobs (all of them if job_ids is None) back in the queue with a
+  fresh set of attempts. Returns how many were requeued.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      WITH requeued AS (
+        UPDATE job
+        SET status = 'queued', attempts = 0, run_at = now(),
+            locked_by = NULL, locked_at = NULL, finished_at = NULL
+        WHERE status = 'dead'
+          AND (%s::bigint[] IS NULL OR job_id = ANY(%s::bigint[]))
+        RETURNING kind
+      )
+      SELECT COUNT(*), pg_notify('job_queued', MIN(kind))
+      FROM requeued
+      """,
+      (job_ids, job_ids),
+    )
+    return cur.fetchone()[0]
@@ -0,0 +1,183 @@
+"""
+Serves the menus to many kiosk terminals from one process.
+
+  python -m app.kiosk --port 7000            # TCP
+  python -m app.kiosk --unix /tmp/gym.sock   # Unix socket
+
+Terminals speak a plain line protocol (nc localhost 7000 works): the server
+sends menu text and prompts, the terminal sends one line per answer.
+
+asyncio owns every socket. Each session runs the ordinary blocking menu
+code on a worker thread from a bounded executor, with print()/input()
+routed to that session's socket, and all sessions share the one
+connection pool, so Postgres sees POOL_MAX_SIZE backends however many
+kiosks are connected.
+"""
+import argparse
+import asyncio
+import io
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.database import close_pool, init_pool
+from app.main import main_menu
+
+# Sessions served at once; further terminals are told to retry
+MAX_SESSIONS = 256
+# Seconds a terminal may sit at a prompt before its session is closed
+SESSION_IDLE_TIMEOUT = 600
+# Menu threads mostly wait on input(), they don't need a full-size stack
+SESSION_STACK_SIZE = 512 * 1024
+
+_terminal = threading.local()
+
+
+class Terminal:
+  """
+  One connected kiosk. write() and readline() are called from the session's
+  worker thread; the socket itself is only touched on the event loop.
+  """
+  def __init__(self, loop, writer):
+    self.loop = loop
+    self.writer = writer
+    self.lines = queue.Queue()
+
+  def write(self, text):
+    if text:
+      self.loop.call_soon_threadsafe(self._send, text.encode())
+    return len(text)
+
+  def _send(self, data):
+    if not self.writer.is_closing():
+      self.writer.write(data)
+
+  def readline(self):
+    try:
+      line = self.lines.get(timeout=SESSION_IDLE_TIMEOUT)
+    except queue.Empty:
+      self.write("\nSession timed out.\n")
+      line = None
+    # '' makes input() raise EOFError, which ends the session
+    return '' if line is None else line
+
+
+class _ThreadRouted(io.TextIOBase):
+  """
+  Stands in for sys.stdin / sys.stdout: the calling thread's terminal if it
+  is a session thread, the real stream otherwise.
+  """
+  def __init__(self, real):
+    self.real = real
+
+  def _target(self):
+    return getattr(_terminal, 'current', None) or self.real
+
+  def write(self, text):
+    return self._target().write(text)
+
+  def readline(self, size=-1):
+    return self._target().readline()
+
+  def flush(self):
+    if getattr(_terminal, 'current', None) is None:
+      self.real.flush()
+
+  def isatty(self):
+    return False
+
+
+def _run_session(terminal):
+  _terminal.current = terminal
+  try:
+    main_menu()
+    terminal.write("Goodbye.\n")
+  except EOFError:
+    pass
+  except Exception as e:
+    terminal.write(f"\nSomething went wrong, closing this terminal. Error: {e}\n")
+    print(f"kiosk session failed: {e!r}", file=sys.__stderr__)
+  finally:
+    _terminal.current = None
+
+
+class KioskServer:
+  def __init__(self, max_sessions=MAX_SESSIONS):
+    self.max_sessions = max_sessions
+    self.active = 0
+    self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix='kiosk')
+
+  async def handle(self, reader, writer):
+    if self.active >= self.max_sessions:
+      writer.write(b"All terminals are busy, please try again shortly.\n")
+      await writer.drain()
+      writer.close()
+      return
+
+    self.active += 1
+    loop = asyncio.get_running_loop()
+    terminal = Terminal(loop, writer)
+    session = loop.run_in_executor(self.executor, _run_session, terminal)
+    try:
+      while not session.done():
+        read = asyncio.ensure_future(reader.readline())
+        await asyncio.wait({read, session}, return_when=asyncio.FIRST_COMPLETED)
+        if not read.done():
+          read.cancel()
+          break
+        line = read.result()
+        if not line:
+          break
+        terminal.lines.put(line.decode(errors='replace').rstrip('\r\n') + '\n')
+    except ConnectionError:
+      pass
+    finally:
+      # Unblocks a session still waiting at a prompt
+      terminal.lines.put(None)
+      await session
+      self.active -= 1
+      if not writer.is_closing():
+        await writer.drain()
+        writer.close()
+
+  def shutdown(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def serve(host, port, unix_path, max_sessions):
+  server = KioskServer(max_sessions)
+  if unix_path:
+    listener = await asyncio.start_unix_server(server.handle, path=unix_path)
+  else:
+    listener = await asyncio.start_server(server.handle, host=host, port=port)
+  where = unix_path or f"{host}:{port}"
+  print(f"Kiosk server listening on {where} (up to {max_sessions} terminals)")
+  try:
+    async with listener:
+      await listener.serve_forever()
+  finally:
+    server.shutdown()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Serve the club menus to kiosk terminals.")
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=7000)
+  parser.add_argument('--unix', help="listen on this Unix socket path instead of TCP")
+  parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS)
+  args = parser.parse_args(argv)
+
+  threading.stack_size(SESSION_STACK_SIZE)
+  sys.stdin = _ThreadRouted(sys.stdin)
+  sys.stdout = _ThreadRouted(sys.stdout)
+  init_pool()
+  try:
+    asyncio.run(serve(args.host, args.port, args.unix, args.max_sessions))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    close_pool()
+
+
+if __name__ == "__main__":
+  main()
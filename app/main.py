@@ -1,11 +1,14 @@
-from app.member import register_member, login_member, update_profile, update_goal, add_metric, book_training, reschedule_training,cancel_training, join_group, view_dashboard
-from app.trainer import register_trainer, login_trainer, view_sessions, view_classes, member_lookup, set_availability
-from app.admin import add_room, create_class, create_invoice, record_payment, add_equipment, list_equipment, update_equipment_issues
-from app.database import get_connection, remove_connection 
+from app.member import register_member, login_member, update_profile, update_goal, add_metric, book_training, reschedule_training,cancel_training, join_group, view_dashboard, find_open_slots
+from app.trainer import register_trainer, login_trainer, view_sessions, view_classes, member_lookup, set_availability, view_roster
+from app.admin import add_room, create_class, create_invoice, record_payment, add_equipment, list_equipment, update_equipment_issues, import_health_metrics, post_settlement_file, query_latency_report, background_jobs, monthly_billing, view_maintenance_queue, view_reports, find_members
+from app.database import init_pool, close_pool
    
 def main():
-    connection = get_connection()
+    init_pool()
+    main_menu()
+    close_pool()
 
+def main_menu():
     while True:
         print("\n === Health and Fitness Club Management System ===")
         print("1) Register as Member")
@@ -17,25 +20,23 @@ def main():
         choice = input("Enter: ")
 
         if choice == '1':
-          register_member(connection)
+          register_member()
         elif choice == '2':
-          register_trainer(connection)
+          register_trainer()
         elif choice == '3':
-          member_id = login_member(connection)
+          member_id = login_member()
           if member_id is not None:
-            member_menu(connection, member_id)
+            member_menu(member_id)
         elif choice == '4':
-          trainer_id = login_trainer(connection)
+          trainer_id = login_trainer()
           if trainer_id is not None:
-            trainer_menu(connection, trainer_id)
+            trainer_menu(trainer_id)
         elif choice == '5':
-          admin_menu(connection)
+          admin_menu()
         elif choice == '0':
            break
-      
-    remove_connection(connection)
     
-def member_menu(connection, member_id):
+def member_menu(member_id):
     while True:
         print("\n=== Member Menu ===")
         print("1) View Dashboard")
@@ -46,52 +47,58 @@ def member_menu(connection, member_id):
         print("6) Reschedule Training Session")
         print("7) Cancel Training Session")
         print("8) Join A Group Training Class")
+        print("9) Find Open Training Slots")
         print("0) Back to main menu")
         choice = input("Enter: ")
 
         if choice == '1':
-          view_dashboard(connection, member_id)
+          view_dashboard(member_id)
         elif choice == '2':
-          update_profile(connection, member_id)
+          update_profile(member_id)
         elif choice == '3':
-          update_goal(connection, member_id)
+          update_goal(member_id)
         elif choice == '4':
-          add_metric(connection, member_id)
+          add_metric(member_id)
         elif choice == '5':
-          book_training(connection, member_id)
+          book_training(member_id)
         elif choice == '6':
-          reschedule_training(connection, member_id)
+          reschedule_training(member_id)
         elif choice == '7':
-          cancel_training(connection, member_id)
+          cancel_training(member_id)
         elif choice == '8':
-          join_group(connection, member_id)
+          join_group(member_id)
+        elif choice == '9':
+          find_open_slots(member_id)
         elif choice == '0':
           break
 
 
-def trainer_menu(connection, trainer_id):
+def trainer_menu(trainer_id):
     while True:
         print("\n=== Trainer Menu ===")
         print("1) Set availability")
         print("2) View Upcoming Personal Sessions")
         print("3) View Upcoming Classes")
         print("4) Member lookup")
+        print("5) Class roster")
         print("0) Back to main menu")
         choice = input("Enter: ")
 
         if choice == '1':
-          set_availability(connection, trainer_id)
+          set_availability(trainer_id)
         elif choice == '2':
-          view_sessions(connection, trainer_id)
+          view_sessions(trainer_id)
         elif choice == '3':
-          view_classes(connection, trainer_id)
+          view_classes(trainer_id)
         elif choice == '4':
-          member_lookup(connection, trainer_id)
+          member_lookup(trainer_id)
+        elif choice == '5':
+          view_roster(trainer_id)
         elif choice == '0':
           break
 
 
-def admin_menu(connection):
+def admin_menu():
     while True:
         print("\n=== Admin Menu ===")
         print("1) Add room ")
@@ -101,23 +108,47 @@ def admin_menu(connection):
         print("5) Update equipment issues")
         print("6) Create invoice")
         print("7) Record payment")
+        print("8) Import health metrics file")
+        print("9) Post settlement file (batch payments)")
+        print("10) Query latency report")
+        print("11) Background jobs")
+        print("12) Monthly billing run")
+        print("13) Maintenance queue")
+        print("14) Reports")
+        print("15) Find a member")
         print("0) Back to main menu")
         choice = input("Enter: ")
 
         if choice == '1':
-          add_room(connection)
+          add_room()
         elif choice == '2':
-          create_class(connection)
+          create_class()
         elif choice == '3':
-          add_equipment(connection)
+          add_equipment()
         elif choice == '4':
-          list_equipment(connection)
+          list_equipment()
         elif choice == '5':
-          update_equipment_issues(connection)
+          update_equipment_issues()
         elif choice == '6':
-          create_invoice(connection)
+          create_invoice()
         elif choice == '7':
-          record_payment(connection)
+          record_payment()
+        elif choice == '8':
+          import_health_metrics()
+        elif choice == '9':
+          post_settlement_file()
+        elif choice == '10':
+          query_latency_report()
+        elif choice == '11':
+          background_jobs()
+        elif choice == '12':
+          monthly_billing()
+        elif choice == '13':
+          view_maintenance_queue()
+        elif choice == '14':
+          view_reports()
+        elif choice == '15':
+          find_members()
         elif choice == '0':
           break
            
@@ -0,0 +1,152 @@
+"""
+Housekeeping for the monthly health_metric partitions and the job queue.
+Run it daily (cron):
+
+  python -m app.maintenance
+  python -m app.maintenance --retention-months 36 --dry-run
+
+Creates the partitions for the coming months, then compacts months older
+than the retention window: their readings are folded into
+health_metric_daily (which the trends, roster and progress read) and the
+raw partition is dropped. Finished background jobs older than
+JOB_RETENTION_DAYS are deleted.
+"""
+import argparse
+import re
+from datetime import date
+
+import psycopg2
+from app.database import get_connection
+
+# Months of raw readings kept; older months survive only as daily summaries
+HEALTH_METRIC_RETENTION_MONTHS = 24
+# Partitions created ahead of time so new readings never hit the default
+HEALTH_METRIC_MONTHS_AHEAD = 3
+# Days done and dead jobs stay listed under Background jobs
+JOB_RETENTION_DAYS = 30
+PARTITION_NAME = re.compile(r'^health_metric_(\d{4})_(\d{2})$')
+
+
+def _add_months(day, months):
+  month = day.year * 12 + day.month - 1 + months
+  return date(month // 12, month % 12 + 1, 1)
+
+def ensure_partitions(months_ahead=HEALTH_METRIC_MONTHS_AHEAD, today=None):
+  """
+  Creates any missing partition from this month to months_ahead months out.
+  Returns how many were created.
+  """
+  this_month = (today or date.today()).replace(day=1)
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    cur.execute(
+      "SELECT ensure_health_metric_partitions(%s, %s)",
+      (this_month, _add_months(this_month, months_ahead)),
+    )
+    created = cur.fetchone()[0]
+    connection.commit()
+  return created
+
+def expired_partitions(retention_months=HEALTH_METRIC_RETENTION_MONTHS, today=None):
+  """
+  Names of monthly partitions that lie entirely before the retention window,
+  oldest first.
+  """
+  cutoff = _add_months((today or date.today()).replace(day=1), -retention_months)
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT c.relname
+      FROM pg_inherits i
+      JOIN pg_class c
+        ON c.oid = i.inhrelid
+      WHERE i.inhparent = 'health_metric'::regclass
+      ORDER BY c.relname
+      """
+    )
+    names = [r[0] for r in cur.fetchall()]
+
+  expired = []
+  for name in names:
+    match = PARTITION_NAME.match(name)
+    if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+      expired.append(name)
+  return expired
+
+def compact_partition(name):
+  """
+  Re-derives the daily summaries for every (member, day) in one partition,
+  then detaches and drops it, in one transaction. Returns the number of raw
+  readings removed.
+  """
+  if not PARTITION_NAME.match(name):
+    raise ValueError(f"{name} is not a monthly health_metric partition")
+
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    cur.execute(f"SELECT COUNT(*) FROM {name}")
+    readings = cur.fetchone()[0]
+    # The triggers normally keep these current; recomputing guards against
+    # rows that were loaded with triggers disabled
+    cur.execute(
+      f"""
+      SELECT refresh_health_metric_days(array_agg(member_id), array_agg(day))
+      FROM (
+        SELECT DISTINCT member_id, date::date AS day
+        FROM {name}
+      ) days
+      """
+    )
+    cur.execute(f"ALTER TABLE health_metric DETACH PARTITION {name}")
+    cur.execute(f"DROP TABLE {name}")
+    connection.commit()
+  return readings
+
+def purge_jobs(retention_days=JOB_RETENTION_DAYS):
+  """
+  Deletes done and dead jobs that finished more than retention_days ago.
+  Returns how many were deleted.
+  """
+  with get_connection(statement_timeout_ms=0, autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      DELETE FROM job
+      WHERE status IN ('done', 'dead')
+        AND finished_at < now() - make_interval(days => %s)
+      """,
+      (retention_days,),
+    )
+    return cur.rowcount
+
+def run(retention_months=HEALTH_METRIC_RETENTION_MONTHS, months_ahead=HEALTH_METRIC_MONTHS_AHEAD, dry_run=False):
+  expired = expired_partitions(retention_months)
+  if dry_run:
+    print(f"Would create partitions up to {months_ahead} months ahead")
+    for name in expired:
+      print(f"Would compact {name}")
+    print(f"Would delete jobs finished more than {JOB_RETENTION_DAYS} days ago")
+    return
+
+  created = ensure_partitions(months_ahead)
+  print(f"Created {created} partitions")
+  for name in expired:
+    readings = compact_partition(name)
+    print(f"Compacted {name}: {readings} readings folded into daily summaries")
+  print(f"Deleted {purge_jobs()} finished jobs")
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Create and compact health_metric partitions, purge finished jobs.")
+  parser.add_argument('--retention-months', type=int, default=HEALTH_METRIC_RETENTION_MONTHS)
+  parser.add_argument('--months-ahead', type=int, default=HEALTH_METRIC_MONTHS_AHEAD)
+  parser.add_argument('--dry-run', action='store_true')
+  args = parser.parse_args(argv)
+
+  try:
+    run(args.retention_months, args.months_ahead, args.dry_run)
+  except psycopg2.Error as e:
+    print("Maintenance failed, Error:", e)
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
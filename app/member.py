@@ -1,10 +1,18 @@
 import psycopg2
-import random
-from datetime import datetime
-from app.validators import get_valid_time_input, validate_time
+from psycopg2 import errors
+from datetime import date, datetime, timedelta
+from app.dashboard import load_dashboard, invalidate_dashboard
+from app.database import execute_prepared, get_connection
+from app.equipment import SKIP_OUT_OF_ORDER_ROOMS
+from app.member_search import choose_member, invalidate_member_search
+from app.refdata import get_room, get_trainer, get_trainers
+from app.validators import get_valid_date_input, get_valid_time_input, validate_date, validate_time
+
+# Days ahead the group class list covers
+CLASS_LOOKAHEAD_DAYS = 14
 
 # ---------- MEMBER FUNCTIONS ----------
-def register_member(connection):
+def register_member():
     print("\n---------Member Registration--------")
     full_name = input("Full name: ")
     dob = None
@@ -18,7 +26,7 @@ def register_member(connection):
     phone = input("Phone: ")
 
     try:
-      with connection.cursor() as cur:
+      with get_connection() as connection, connection.cursor() as cur:
         cur.execute(
           """
           INSERT INTO member (full_name, date_of_birth, gender, phone)
@@ -28,23 +36,20 @@ def register_member(connection):
           (full_name, dob, gender, phone),
         )
         member_id = cur.fetchone()[0]
-      connection.commit()
+        connection.commit()
+      invalidate_member_search()
       print(f"Member registered successfully, Your Member ID is {member_id}")
     except psycopg2.Error as e:
-      connection.rollback()
       print("Registering Members Failed, Error:", e)
 
-def login_member(connection):
-  member_id = input("Enter your member ID: ")
+def login_member():
+  member_id = choose_member(input("Enter your member ID (or your name / phone number to search): "))
+  if member_id is None:
+    return None
 
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT * FROM member WHERE member_id = %s
-        """,
-        (member_id,),
-      )
+    with get_connection() as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'login_member', (member_id,))
       row = cur.fetchone()
   except psycopg2.Error as e:
     print(f"Retreiving Info For Member:{member_id} Failed, Error:", e)
@@ -56,7 +61,7 @@ def login_member(connection):
 
   return row[0]
 
-def update_profile(connection, member_id):
+def update_profile(member_id):
   print("\n--------- Update Member Profile--------")
   full_name = input("Full name: ")
   dob = None
@@ -70,7 +75,7 @@ def update_profile(connection, member_id):
   phone = input("Phone: ")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         UPDATE member
@@ -82,13 +87,14 @@ def update_profile(connection, member_id):
         """,
         (full_name, dob, gender, phone, member_id),
       )
-    connection.commit()
+      connection.commit()
+    invalidate_dashboard(member_id)
+    invalidate_member_search()
     print(f"Profile Updated for Member ID {member_id}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Profile Update Failed, Error:", e)
 
-def update_goal(connection, member_id):
+def update_goal(member_id):
   print("\n--------- Update Goal--------")
   weight = input("Weight in lbs: ")
   target = None
@@ -101,7 +107,7 @@ def update_goal(connection, member_id):
       print("Invalid date format. Try again.")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         UPDATE fitness_goal
@@ -119,20 +125,20 @@ def update_goal(connection, member_id):
             """,
             (member_id, weight, target),
         )
-    connection.commit()
+      connection.commit()
+    invalidate_dashboard(member_id)
     print(f"Goal Updated for: {member_id}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Goal Update Failed, Error:", e)
 
-def add_metric(connection, member_id):
+def add_metric(member_id):
   print("\n--------- Add Metric--------")
   height = input("Your Current Height in cm: ")
   weight = input("Your Current Weight in lbs: ")
   heart_rate = input("Your Heart Rate: ")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         INSERT INTO health_metric (member_id, height, weight, heart_rate )
@@ -140,29 +146,20 @@ def add_metric(connection, member_id):
         """,
         (member_id, height, weight, heart_rate),
       )
-    connection.commit()
+      connection.commit()
+    invalidate_dashboard(member_id)
     print(f"Metric Added For Member ID {member_id}")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Metric Failed, Error:", e)
 
 
-def book_training(connection, member_id):
+def book_training(member_id):
   print("\n--------- Book A Personal Training Session --------")
 
   # List all trainers and their availability
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT trainer_id, full_name, availability_start, availability_end
-        FROM trainer
-        ORDER BY trainer_id
-        """
-      )
-      trainers = cur.fetchall()
+    trainers = get_trainers()
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error fetching trainers:", e)
     return
 
@@ -178,28 +175,16 @@ def book_training(connection, member_id):
 
   trainer_id = input("Enter Your Trainer's ID: ")
 
-  # Check if trainer exists
-  try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT availability_start, availability_end
-        FROM trainer
-        WHERE trainer_id = %s
-        """,
-        (trainer_id,),
-      )
-      row = cur.fetchone()
-  except psycopg2.Error as e:
-    connection.rollback()
-    print("Error checking trainer:", e)
-    return
-  
-  if row is None:
+  availability = {str(t_id): (a_start, a_end) for t_id, _, a_start, a_end in trainers}
+  if trainer_id not in availability:
       print(f"Trainer with ID {trainer_id} does not exist.")
       return
-  avail_start, avail_end = row
+  avail_start, avail_end = availability[trainer_id]
 
+  session_date = get_valid_date_input("Enter date (YYYY-MM-DD, blank for today): ")
+  if not validate_date(session_date):
+    print("Exited Booking.")
+    return
   start_time = get_valid_time_input("Enter start time (HH:MM): ")
   end_time = get_valid_time_input("Enter end time (HH:MM): ")
 
@@ -212,87 +197,92 @@ def book_training(connection, member_id):
     print( "Requested time is outside trainer's availability.\n")
     return
 
-  # Check trainer does not already have a session that overlaps
+  book_personal_session(member_id, trainer_id, session_date, start_time, end_time)
+
+def book_personal_session(member_id, trainer_id, session_date, start_time, end_time):
+  """
+  One atomic call: the database re-checks availability, picks a room,
+  creates the session and enrols the member. Overlaps are rejected by the
+  exclusion constraints on training_sessions and by the recurring-class
+  trigger.
+  """
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT 1
-        FROM training_sessions
-        WHERE trainer_id = %s
-          AND status = 'active'
-          AND session_type = 'personal'
-          AND NOT (end_time <= %s OR start_time >= %s)
-        """,
-        (trainer_id, start_time, end_time),
-      )
-      conflict = cur.fetchone()
-  except psycopg2.Error as e:
-    connection.rollback()
-    print("Error checking for overlapping sessions:", e)
-    return
+    with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'book_personal_session', (member_id, trainer_id, session_date, start_time, end_time, SKIP_OUT_OF_ORDER_ROOMS))
+      session_id, room_id, room_name = cur.fetchone()
+    invalidate_dashboard(member_id)
+    print(f"Session Booked ID: {session_id} | Room: {room_name} (RoomID: {room_id})")
 
-  if conflict:
-    print("This trainer already has a session that overlaps this time.")
-    return
+  except errors.ExclusionViolation as e:
+    if e.diag.constraint_name == 'training_sessions_no_room_overlap':
+      print("No rooms are available at this time.")
+    else:
+      print("This trainer already has a session that overlaps this time.")
+  except errors.RaiseException as e:
+    print(e.diag.message_primary)
+  except psycopg2.Error as e:
+    print("Booking Session Failed, Error:", e)
 
-  #Find an available room, create session, add member
+def find_open_slots(member_id):
+  print("\n--------- Find Open Training Slots --------")
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT room_id, room_name
-        FROM rooms
-        WHERE isBooked = FALSE
-        """
-      )
-      rooms_available = cur.fetchall()
+    length = int(input("Session length in minutes: ").strip())
+  except ValueError:
+    print("Length must be a whole number of minutes.")
+    return
+  if length <= 0:
+    print("Length must be greater than 0.")
+    return
 
-      if not rooms_available:
-        print("No rooms are available at this time.")
-        return
+  trainer_id = input("Trainer ID (leave blank for all trainers): ").strip()
+  if trainer_id:
+    try:
+      trainer = get_trainer(trainer_id)
+    except psycopg2.Error as e:
+      print("Error checking trainer:", e)
+      return
+    if trainer is None:
+      print(f"Trainer with ID {trainer_id} does not exist.")
+      return
+    trainer_id = trainer[0]
 
-      room_id, room_name = random.choice(rooms_available)
+  session_date = get_valid_date_input("Date (YYYY-MM-DD, blank for today): ")
+  if not validate_date(session_date):
+    return
 
+  try:
+    with get_connection(autocommit=True) as connection, connection.cursor() as cur:
       cur.execute(
         """
-        INSERT INTO training_sessions (trainer_id, room_id,session_type, start_time, end_time, capacity)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        RETURNING session_id
+        SELECT trainer_id, trainer_name, start_time, end_time, free_room_names
+        FROM open_slots(%s, %s, p_date => %s, p_skip_out_of_order => %s)
         """,
-        (trainer_id, room_id,'personal', start_time, end_time, 1),
+        (timedelta(minutes=length), trainer_id or None, session_date, SKIP_OUT_OF_ORDER_ROOMS),
       )
-      session_id = cur.fetchone()[0]
+      slots = cur.fetchall()
+  except psycopg2.Error as e:
+    print("Error finding open slots:", e)
+    return
 
-      #Add member to session
-      cur.execute(
-        """
-        INSERT INTO session_members (session_id, member_id)
-        VALUES (%s, %s)
-        """,
-        (session_id, member_id),
-      )
+  if not slots:
+    print("No open slots of that length.")
+    return
 
-      # Mark room as booked
-      cur.execute(
-        """
-        UPDATE rooms
-        SET isBooked = TRUE
-        WHERE room_id = %s
-        """,
-        (room_id,),
-      )
-      
-    connection.commit()
-    print(f"Session Booked ID: {session_id} | Room: {room_name} (RoomID: {room_id})")
-    
-  except psycopg2.Error as e:
-    connection.rollback()
-    print("Booking Session Failed, Error:", e)
+  for number, (t_id, name, start_time, end_time, room_names) in enumerate(slots, start=1):
+    print(
+      f"{number}) {name} (ID {t_id}) | {session_date} {start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')} | "
+      f"Free rooms: {', '.join(room_names)}"
+    )
+
+  choice = input("Enter a slot number to book it (0 to go back): ").strip()
+  if not choice.isdigit() or not 1 <= int(choice) <= len(slots):
+    return
+  t_id, _, start_time, end_time, _ = slots[int(choice) - 1]
+  book_personal_session(member_id, t_id, session_date, start_time, end_time)
 
-def reschedule_training(connection, member_id):
+def reschedule_training(member_id):
   print("\n--------- Reschedule Training Session --------")
-  format_rows = get_training_sessions(connection, member_id)
+  format_rows = get_training_sessions(member_id)
   if not format_rows: 
     return
 
@@ -302,30 +292,25 @@ def reschedule_training(connection, member_id):
     print("You don't have access to this session ID")
     return 
 
+  trainer_id, current_date = format_rows[session_id]
+
   # Get trainer availability for this session
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT t.availability_start, t.availability_end
-        FROM training_sessions ts
-        JOIN trainer t
-          ON ts.trainer_id = t.trainer_id
-        WHERE ts.session_id = %s
-        """,
-        (session_id,),
-      )
-      row = cur.fetchone()
+    trainer = get_trainer(trainer_id)
   except psycopg2.Error as e:
     print("Error fetching trainer availability for this session:", e)
     return
 
-  if row is None:
+  if trainer is None:
     print("Could not find trainer or session for this ID.")
     return
   
-  avail_start, avail_end = row
+  _, _, avail_start, avail_end = trainer
 
+  session_date = get_valid_date_input(f"New date (YYYY-MM-DD, blank for {current_date}): ", current_date)
+  if not validate_date(session_date):
+    print("Exited rescheduling.")
+    return
   start_time = get_valid_time_input("New start time: ")
   end_time = get_valid_time_input("New end time: ")
 
@@ -339,25 +324,10 @@ def reschedule_training(connection, member_id):
 
   #Check for overlapping sessions for this trainer, excluding this session
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT 1
-        FROM training_sessions ts
-        WHERE ts.trainer_id = (
-          SELECT trainer_id
-          FROM training_sessions
-          WHERE session_id = %s
-        )
-          AND ts.status = 'active'
-          AND ts.session_id <> %s
-          AND NOT (ts.end_time <= %s OR ts.start_time >= %s)
-        """,
-        (session_id, session_id, start_time, end_time),
-      )
+    with get_connection() as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'session_overlap', (session_id, session_date, start_time, end_time))
       conflict = cur.fetchone()
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error checking for overlapping sessions while rescheduling:", e)
     return
 
@@ -367,24 +337,30 @@ def reschedule_training(connection, member_id):
   
   #Update the session times
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         UPDATE training_sessions 
-        SET start_time = %s, end_time = %s 
+        SET session_date = %s, start_time = %s, end_time = %s 
         WHERE session_id = %s
         """,
-        (start_time, end_time, session_id),
+        (session_date, start_time, end_time, session_id),
       )
-    connection.commit()
+      connection.commit()
+    invalidate_dashboard(member_id)
     print(f"Session Rescheduled: {session_id}")
     
+  except errors.ExclusionViolation as e:
+    if e.diag.constraint_name == 'training_sessions_no_room_overlap':
+      print("The room for this session is already booked at the new time.")
+    else:
+      # Lost a race with another booking after the check above
+      print("This new time overlaps with another session for this trainer.")
   except psycopg2.Error as e:
-    connection.rollback()
     print("Rescheduling Session Failed, Error:", e)
 
-def cancel_training(connection, member_id):
-  format_rows = get_training_sessions(connection, member_id)
+def cancel_training(member_id):
+  format_rows = get_training_sessions(member_id)
   if not format_rows: 
     return
   
@@ -394,53 +370,39 @@ def cancel_training(connection, member_id):
     print("You don't have access to this session ID")
     return 
   
+  # Cancelled sessions drop out of the overlap constraints, so the room and
+  # trainer are free for that window again as soon as this commits
   try:
-    with connection.cursor() as cur:
+    with get_connection(autocommit=True) as connection, connection.cursor() as cur:
       cur.execute(
         """
         UPDATE training_sessions SET status = %s WHERE session_id = %s
-        RETURNING room_id
         """,
         ('cancelled', session_id),
       )
-
-      row = cur.fetchone()
-      if row is None:
-          room_id = None
-      else:
-          room_id = row[0]
-      # Mark room as unbooked
-      cur.execute(
-        """
-        UPDATE rooms
-        SET isBooked = FALSE
-        WHERE room_id = %s
-        """,
-        (room_id,),
-      )
-    connection.commit()
+    invalidate_dashboard(member_id)
     print(f"Session Cancelled: {session_id}")
     
   except psycopg2.Error as e:
-    connection.rollback()
     print("Canceling Session Failed, Error:", e)
 
-def join_group(connection, member_id):
+def join_group(member_id):
   print("\n--------- Join A Group Session --------")
+  today = date.today()
 
+  # Recurring classes are expanded for the lookahead window only
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
-          SELECT session_id, start_time, end_time, status, capacity
-          FROM training_sessions
-          WHERE status = %s AND session_type = %s
+          SELECT session_id, schedule_id, session_date, start_time, end_time, status, capacity, enrolled
+          FROM class_calendar(%s, %s)
+          WHERE status = %s
         """,
-        ('active', 'group'),
+        (today, today + timedelta(days=CLASS_LOOKAHEAD_DAYS), 'active'),
       )
       rows = cur.fetchall()
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error getting group classes", e)
     return
 
@@ -448,90 +410,42 @@ def join_group(connection, member_id):
     print("No Group Class Scheduled.")
     return
 
-  format_rows = {str(r[0]) for r in rows}
-
   print("Group Classes Available: ")
-  for ses_id, start_time, end_time, status, capacity in rows:
-    print(f" {ses_id} | {start_time}-{end_time} | {status} | Max:{capacity}")
+  for number, (ses_id, schedule_id, session_date, start_time, end_time, status, capacity, enrolled) in enumerate(rows, start=1):
+    print(f" {number}) {session_date} {start_time}-{end_time} | {status} | {enrolled}/{capacity} seats taken")
 
-  session_id = input("Enter Session ID you want to join: ")
+  choice = input("Enter the number of the class you want to join: ").strip()
 
-  if session_id not in format_rows:
-    print("That session ID is not in the available list.")
+  if not choice.isdigit() or not 1 <= int(choice) <= len(rows):
+    print("That class is not in the available list.")
     return
+  session_id, schedule_id, session_date = rows[int(choice) - 1][:3]
 
+  # One statement: the seat counter update in the database refuses the join
+  # once the class is full, however many members join at once
   try:
-    with connection.cursor() as cur:
-      # Check if user already in this session
-      cur.execute(
-        """
-          SELECT 1
-          FROM session_members
-          WHERE session_id = %s AND member_id = %s
-        """,
-        (session_id, member_id),
-      )
-      already = cur.fetchone()
-      if already:
-        print("You have already joined this class.")
-        return
-
-      # Optional: check capacity
-      cur.execute(
-        """
-          SELECT capacity
-          FROM training_sessions
-          WHERE session_id = %s
-        """,
-        (session_id,),
-      )
-      row = cur.fetchone()
-      if row is None:
-        print("Session no longer exists.")
-        return
-      capacity = row[0]
-
-      cur.execute(
-        """
-          SELECT COUNT(*) 
-          FROM session_members
-          WHERE session_id = %s
-        """,
-        (session_id,),
-      )
-      current_count = cur.fetchone()[0]
-      if current_count >= capacity:
-        print("This class is already full.")
-        return
-
-      # Insert membership
-      cur.execute(
-        """
-        INSERT INTO session_members (session_id, member_id) 
-        VALUES (%s, %s)
-        """,
-        (session_id, member_id),
-      )
-
-    connection.commit()
-    print(f"Successfully Added Member:{member_id} into Session: {session_id}")
-
+    with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'join_class', (session_id, schedule_id, session_date, member_id))
+      seats_left = cur.fetchone()[0]
+    invalidate_dashboard(member_id)
+    print(f"Successfully Added Member:{member_id} into Class on {session_date} ({seats_left} seats left)")
+
+  except errors.RaiseException as e:
+    print(e.diag.message_primary)
   except psycopg2.Error as e:
-    connection.rollback()
     print("Inserting Member Into Session Failed, Error:", e)
 
 #Helper funtion
-def get_training_sessions(connection, member_id):
+def get_training_sessions(member_id):
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
           """
-            SELECT session_members.session_id, ts.start_time, ts.end_time, ts.status, ts.room_id, r.room_name
+            SELECT session_members.session_id, ts.session_date, ts.start_time, ts.end_time, ts.status, ts.room_id, ts.trainer_id
             FROM session_members JOIN training_sessions ts
               ON session_members.session_id = ts.session_id
-            JOIN rooms r
-              ON ts.room_id = r.room_id
             WHERE session_members.member_id = %s AND ts.status = %s AND ts.session_type = 'personal'
+            ORDER BY ts.session_date, ts.start_time
           """,
           (member_id, 'active'),
       )
@@ -541,145 +455,73 @@ def get_training_sessions(connection, member_id):
       return
 
     print("Your Active Bookings: ")
-    for session_id, start_time, end_time, status, room_id, room_name in rows:
+    for session_id, session_date, start_time, end_time, status, room_id, trainer_id in rows:
+      room = get_room(room_id)
+      room_name = room[1] if room else None
       if room_id is None:
         room_id = "TBD"
-      print(f"{session_id} | {start_time}-{end_time} | {room_id}-{room_name} | {status}")
+      print(f"{session_id} | {session_date} {start_time}-{end_time} | {room_id}-{room_name} | {status}")
 
-    format_rows = {str(r[0]) for r in rows}
+    # session id -> (trainer id, date)
+    format_rows = {str(r[0]): (r[6], r[1]) for r in rows}
     return format_rows
   except psycopg2.Error as e:
-    connection.rollback()
     print(f"Error checking sessions for member: {member_id}", e)
     return
   
-def view_dashboard(connection, member_id):
+def view_dashboard(member_id):
   print("\n========= Member Dashboard =========")
   try:
-    with connection.cursor() as cur:
-      #Basic member info
-      cur.execute(
-        """
-        SELECT full_name, date_of_birth, phone, gender
-        FROM member
-        WHERE member_id = %s
-        """,
-        (member_id,),
-      )
-      member_row = cur.fetchone()
-
-      if member_row is None:
-        print(f"Member with ID {member_id} does not exist.")
-        return
-
-      full_name, dob, phone, gender = member_row
-
-      #Latest health metric
-      cur.execute(
-        """
-        SELECT height, weight, heart_rate, date
-        FROM health_metric
-        WHERE member_id = %s
-        ORDER BY date DESC
-        LIMIT 1
-        """,
-        (member_id,),
-      )
-      metric_row = cur.fetchone()
-
-      #Latest fitness goal
-      cur.execute(
-        """
-        SELECT weight, target_date
-        FROM fitness_goal
-        WHERE member_id = %s
-        """,
-        (member_id,),
-      )
-      goal_row = cur.fetchone()
-
-      # 4) Active sessions (personal + group)
-      cur.execute(
-        """
-        SELECT ts.session_id,
-               ts.session_type,
-               ts.start_time,
-               ts.end_time,
-               ts.status,
-               r.room_name,
-               t.full_name
-        FROM session_members sm
-        JOIN training_sessions ts
-          ON sm.session_id = ts.session_id
-        LEFT JOIN rooms r
-          ON ts.room_id = r.room_id
-        JOIN trainer t
-          ON ts.trainer_id = t.trainer_id
-        WHERE sm.member_id = %s
-          AND ts.status = 'active'
-        ORDER BY ts.start_time
-        """,
-        (member_id,),
-      )
-      sessions = cur.fetchall()
-
-      #Invoices + payments summary
-      cur.execute(
-        """
-        SELECT invoice_id,
-              issue_date,
-              total_amount,
-              total_paid,
-              remaining,
-              status
-        FROM member_invoice_summary
-        WHERE member_id = %s
-        ORDER BY issue_date DESC
-        """,
-        (member_id,),
-      )
-      invoices = cur.fetchall()
-
+    dashboard = load_dashboard(member_id)
   except psycopg2.Error as e:
     print("Error loading dashboard:", e)
     return
 
+  if dashboard is None:
+    print(f"Member with ID {member_id} does not exist.")
+    return
+
+  member = dashboard['member']
+  metric = dashboard['metric']
+  goal = dashboard['goal']
+  sessions = dashboard['sessions']
+  invoices = dashboard['invoices']
+
   # ---- Print section: Profile ----
-  print(f"\nMember: {full_name} (ID: {member_id})")
-  print(f"Date of Birth: {dob}")
-  print(f"Gender: {gender}")
-  print(f"Phone: {phone}")
+  print(f"\nMember: {member['full_name']} (ID: {member_id})")
+  print(f"Date of Birth: {member['date_of_birth']}")
+  print(f"Gender: {member['gender']}")
+  print(f"Phone: {member['phone']}")
 
   # ---- Latest Health Metric ----
   print("\n--- Latest Health Metric ---")
-  if metric_row is None:
+  if metric is None:
     print("No health metrics recorded yet.")
   else:
-    height, weight, heart_rate, metric_date = metric_row
-    print(f"Recorded on: {metric_date}")
-    print(f"Height: {height} cm")
-    print(f"Weight: {weight} lbs")
-    print(f"Heart Rate: {heart_rate} bpm")
+    print(f"Recorded on: {metric['date']}")
+    print(f"Height: {metric['height']} cm")
+    print(f"Weight: {metric['weight']} lbs")
+    print(f"Heart Rate: {metric['heart_rate']} bpm")
 
   # Fitness Goal
   print("\n--- Fitness Goal ---")
-  if goal_row is None:
+  if goal is None:
     print("No fitness goal set yet.")
   else:
-    goal_weight, target_date = goal_row
-    print(f"Target Weight: {goal_weight}")
-    print(f"Target Date: {target_date}")
+    print(f"Target Weight: {goal['weight']}")
+    print(f"Target Date: {goal['target_date']}")
 
   # Active Sessions
   print("\n--- Active Sessions ---")
   if not sessions:
     print("No active training sessions booked.")
   else:
-    for session_id, session_type, start_time, end_time, status, room_name, trainer_name in sessions:
-      room_label = room_name if room_name is not None else "No room assigned"
+    for session in sessions:
+      room_label = session['room_name'] if session['room_name'] is not None else "No room assigned"
       print(
-        f"- Session ID {session_id} | {session_type} | "
-        f"{start_time}-{end_time} | Room: {room_label} | Trainer: {trainer_name} | Status: {status}"
+        f"- Session ID {session['session_id']} | {session['session_type']} | "
+        f"{session['session_date']} {session['start_time']}-{session['end_time']} | Room: {room_label} | "
+        f"Trainer: {session['trainer_name']} | Status: {session['status']}"
       )
 
   #Invoices / Payments
@@ -687,14 +529,11 @@ def view_dashboard(connection, member_id):
   if not invoices:
     print("No invoices on file.")
   else:
-    overall_outstanding = 0.0
-    for invoice_id, issue_date, total_amount, total_paid , remaining, status in invoices:
-      remaining = float(total_amount) - float(total_paid)
-      if status != 'cancelled' and remaining > 0:
-        overall_outstanding += remaining
+    for invoice in invoices:
       print(
-        f"- Invoice {invoice_id} | Date: {issue_date} | "
-        f"Total: {total_amount} | Paid: {total_paid} | Status: {status} | Remaining: {remaining:.2f}"
+        f"- Invoice {invoice['invoice_id']} | Date: {invoice['issue_date']} | "
+        f"Total: {invoice['total_amount']} | Paid: {invoice['total_paid']} | "
+        f"Status: {invoice['status']} | Remaining: {invoice['remaining']}"
       )
 
-    print(f"\nTotal Outstanding Balance: {overall_outstanding:.2f}")
+    print(f"\nTotal Outstanding Balance: {dashboard['outstanding'] or '0.00'}")
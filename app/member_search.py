@@ -0,0 +1,351 @@
+"""
+Front-desk member search by name or phone number:
+
+  python -m app.member_search "alice wong"
+  python -m app.member_search 555-111
+
+Names are matched by pg_trgm word similarity, so partial names and typos
+still find the member; the GiST trigram index returns the closest
+SEARCH_LIMIT names without ranking every match. A query without letters
+is a phone number prefix, compared digits only ('(555) 111' finds
+'555-111-1111') through the index on normalize_phone(phone).
+
+With MEMBER_PREFIX_INDEX on, each process also keeps every member's name
+words and phone digits in a sorted in-memory index and answers type-ahead
+prefix queries from it, going to the database only when it has fewer than
+SEARCH_LIMIT matches (fuzzy names, members it doesn't have yet). The index
+is rebuilt in the background once it is PREFIX_INDEX_TTL seconds old, so
+members added elsewhere show up in it after a while. A change made by this
+process starts a rebuild right away, and until it is in the index the
+database answers instead.
+
+The database search runs on a replica when there is one. Members
+registered or updated by this process are found right away (the change
+goes through invalidate_member_search(), which keeps searches off
+replicas that haven't replayed it); ones changed by another process may
+take up to REPLICA_MAX_LAG_SECONDS to show up.
+"""
+import argparse
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import psycopg2
+from app.database import get_connection, record_write
+
+# Matches returned per search
+SEARCH_LIMIT = 10
+# Fewest digits a phone search needs; shorter prefixes match too much
+PHONE_MIN_DIGITS = 3
+# Longest digits-only input read as a member_id; longer ones are phone numbers
+MEMBER_ID_MAX_DIGITS = 9
+# Keep an in-process prefix index of all members for type-ahead
+MEMBER_PREFIX_INDEX = False
+# Seconds before the prefix index is rebuilt
+PREFIX_INDEX_TTL = 600
+# Members fetched per round trip while building the prefix index
+PREFIX_INDEX_FETCH_SIZE = 50000
+# Read-your-writes key of the member search, see invalidate_member_search()
+SEARCH_READER = ('member_search', 'member')
+
+_index = None
+_index_built = 0.0
+_index_lock = threading.Lock()
+_rebuilding = False
+# Bumped by invalidate_member_search(); an index built before the latest
+# bump is missing one of this process's changes
+_changes = 0
+
+
+def normalize_phone(text):
+  """
+  The digits of a phone number, like normalize_phone() in the database.
+  """
+  return re.sub(r'[^0-9]', '', text or '')
+
+def invalidate_member_search():
+  """
+  Call after committing a new member or a name/phone change, so this
+  process's next searches see it even on a replica, and the prefix index
+  is rebuilt.
+  """
+  global _changes
+  record_write(SEARCH_READER)
+  with _index_lock:
+    _changes += 1
+    if _index is not None:
+      _start_rebuild()
+
+def is_phone_query(text):
+  return not re.search(r'[^\W\d_]', text) and len(normalize_phone(text)) >= PHONE_MIN_DIGITS
+
+def search_by_name(text, limit=SEARCH_LIMIT):
+  """
+  [(member_id, full_name, phone, date_of_birth), ...], the names most
+  similar to text first.
+  """
+  with get_connection(autocommit=True, read_only=True, reader=SEARCH_READER) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      SELECT member_id, full_name, phone, date_of_birth
+      FROM member
+      WHERE %(text)s <%% full_name
+      ORDER BY %(text)s <<-> full_name
+      LIMIT %(limit)s
+      """,
+      {'text': text, 'limit': limit},
+    )
+    return cur.fetchall()
+
+def search_by_phone(text, limit=SEARCH_LIMIT):
+  """
+  [(member_id, full_name, phone, date_of_birth), ...] whose phone digits
+  start with the digits of text, in phone order.
+  """
+  with get_connection(autocommit=True, read_only=True, reader=SEARCH_READER) as connection, connection.cursor() as cur:
+    # Digits only, so the prefix has no LIKE wildcards to escape
+    cur.execute(
+      """
+      SELECT member_id, full_name, phone, date_of_birth
+      FROM member
+      WHERE normalize_phone(phone) COLLATE "C" LIKE %s
+      ORDER BY normalize_phone(phone) COLLATE "C", member_id
+      LIMIT %s
+      """,
+      (normalize_phone(text) + '%', limit),
+    )
+    return cur.fetchall()
+
+def search_members(text, limit=SEARCH_LIMIT):
+  """
+  Up to limit members matching a name or a phone number prefix, best
+  first: [(member_id, full_name, phone, date_of_birth), ...].
+  Raises psycopg2.Error on database failure.
+  """
+  text = ' '.join(text.split())
+  if not text:
+    return []
+  phone = is_phone_query(text)
+  if not phone and len(text) < 2:
+    return []
+
+  matches = []
+  if MEMBER_PREFIX_INDEX:
+    index = get_prefix_index()
+    # Skipped while it is missing (or has stale rows of) this process's changes
+    if index.changes == _changes:
+      matches = index.search(text, limit)
+      if len(matches) >= limit:
+        return matches
+
+  seen = {row[0] for row in matches}
+  found = search_by_phone(text, limit) if phone else search_by_name(text, limit)
+  matches += [row for row in found if row[0] not in seen]
+  return matches[:limit]
+
+
+class PrefixIndex:
+  """
+  Every member's lower-cased name words and phone digits as one sorted
+  list of keys, with the member row of each key alongside. The keys
+  starting with a prefix are one contiguous range, found by bisection.
+  """
+  def __init__(self, members, changes=0):
+    """
+    members: (member_id, full_name, phone, date_of_birth) rows; changes:
+    the invalidate_member_search() count they were read after.
+    """
+    self.changes = changes
+    self.members = []
+    pairs = []
+    for member in members:
+      row = len(self.members)
+      self.members.append(member)
+      # Interned: the same first and last names come up over and over
+      for word in set(member[1].lower().split()):
+        pairs.append((sys.intern(word), row))
+      digits = normalize_phone(member[2])
+      if digits:
+        pairs.append((digits, row))
+    pairs.sort()
+    self.keys = [key for key, _ in pairs]
+    self.rows = array('l', (row for _, row in pairs))
+
+  def __len__(self):
+    return len(self.members)
+
+  def _range(self, prefix):
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return bisect_left(self.keys, prefix), bisect_left(self.keys, upper)
+
+  def search(self, text, limit=SEARCH_LIMIT):
+    """
+    Members with a name word starting with every word of text, or whose
+    phone digits start with text's digits, in key order.
+    """
+    if is_phone_query(text):
+      words = [normalize_phone(text)]
+    else:
+      words = text.lower().split()
+    if not words:
+      return []
+
+    # Walk the narrowest range and check the other words on each member
+    ranges = {word: self._range(word) for word in words}
+    first = min(words, key=lambda w: ranges[w][1] - ranges[w][0])
+    others = [w for w in words if w != first]
+    start, end = ranges[first]
+
+    matches = []
+    seen = set()
+    for i in range(start, end):
+      row = self.rows[i]
+      if row in seen:
+        continue
+      member = self.members[row]
+      if others:
+        name_words = member[1].lower().split()
+        if not all(any(nw.startswith(w) for nw in name_words) for w in others):
+          continue
+      seen.add(row)
+      matches.append(member)
+      if len(matches) >= limit:
+        break
+    return matches
+
+
+def build_prefix_index():
+  """
+  Reads every member into a new PrefixIndex.
+  Raises psycopg2.Error on database failure.
+  """
+  changes = _changes
+  with get_connection(statement_timeout_ms=0, read_only=True, reader=SEARCH_READER) as connection, \
+       connection.cursor(name='member_prefix_index') as cur:
+    cur.itersize = PREFIX_INDEX_FETCH_SIZE
+    cur.execute("SELECT member_id, full_name, phone, date_of_birth FROM member ORDER BY member_id")
+    return PrefixIndex(cur, changes)
+
+def _install(index):
+  global _index, _index_built
+  with _index_lock:
+    _index, _index_built = index, time.monotonic()
+    # A change made while it was being built needs another build
+    if index.changes != _changes:
+      _start_rebuild()
+
+def _rebuild():
+  global _rebuilding
+  try:
+    index = build_prefix_index()
+  except psycopg2.Error:
+    index = None
+  with _index_lock:
+    _rebuilding = False
+  if index is not None:
+    _install(index)
+
+def _start_rebuild():
+  """
+  Starts a background rebuild unless one is running. Call with _index_lock.
+  """
+  global _rebuilding
+  if not _rebuilding:
+    _rebuilding = True
+    threading.Thread(target=_rebuild, name='member-prefix-index', daemon=True).start()
+
+def get_prefix_index():
+  """
+  The process's PrefixIndex. Built on first use; once stale it keeps being
+  served while a background thread builds the next one.
+  """
+  with _index_lock:
+    index = _index
+    if index is not None and (time.monotonic() - _index_built > PREFIX_INDEX_TTL or index.changes != _changes):
+      _start_rebuild()
+  if index is None:
+    index = build_prefix_index()
+    _install(index)
+  return index
+
+
+def print_matches(matches):
+  for number, (member_id, full_name, phone, date_of_birth) in enumerate(matches, start=1):
+    print(f"{number}) ID {member_id} | {full_name} | Phone: {phone} | Born: {date_of_birth}")
+
+def choose_member(text):
+  """
+  The member_id for what was typed at a member ID prompt: the ID itself if
+  it is one of a member, else the member picked from a search for it (a
+  name, or a phone number typed with or without punctuation). None if no
+  member was chosen.
+  """
+  text = text.strip()
+  if not text:
+    return None
+  if text.isdigit() and len(text) <= MEMBER_ID_MAX_DIGITS:
+    try:
+      # The primary, so a member registered a moment ago can log in
+      with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM member WHERE member_id = %s", (int(text),))
+        if cur.fetchone() is not None:
+          return int(text)
+    except psycopg2.Error as e:
+      print("Error checking member:", e)
+      return None
+  return find_member(text)
+
+def find_member(text=None):
+  """
+  Interactive search for text (asked for if None): lists the matches and
+  returns the chosen member_id, or None.
+  """
+  if text is None:
+    text = input("Name or phone number: ").strip()
+  if not text:
+    return None
+  try:
+    matches = search_members(text)
+  except psycopg2.Error as e:
+    print("Member search failed, Error:", e)
+    return None
+  if not matches:
+    print("No members found.")
+    return None
+
+  print_matches(matches)
+  choice = input("Enter a number to choose that member (0 to go back): ").strip()
+  if not choice.isdigit() or not 1 <= int(choice) <= len(matches):
+    return None
+  return matches[int(choice) - 1][0]
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Search members by name or phone number.")
+  parser.add_argument('text', help="name, part of a name, or the start of a phone number")
+  parser.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+  parser.add_argument('--prefix-index', action='store_true', help="answer from an in-process prefix index")
+  args = parser.parse_args(argv)
+
+  global MEMBER_PREFIX_INDEX
+  MEMBER_PREFIX_INDEX = MEMBER_PREFIX_INDEX or args.prefix_index
+  try:
+    if MEMBER_PREFIX_INDEX:
+      started = time.perf_counter()
+      index = get_prefix_index()
+      print(f"Prefix index of {len(index)} members built in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    matches = search_members(args.text, args.limit)
+  except psycopg2.Error as e:
+    print("Member search failed, Error:", e)
+    return 1
+  print_matches(matches)
+  print(f"{len(matches)} matches in {(time.perf_counter() - started) * 1000:.1f}ms")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,181 @@
+import csv
+import io
+import sys
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+from app.dashboard import invalidate_dashboard
+from app.database import get_connection
+
+# Posting a month-end file is one statement; give it more room than a click
+SETTLEMENT_TIMEOUT_MS = 300000
+
+# Locks every invoice in the file (in id order, so two postings can't
+# deadlock) and walks each invoice's rows in file order, accepting a row
+# while the invoice's remaining balance covers it; a rejected row doesn't
+# use up any of the balance, so later rows that fit are still accepted.
+# The accepted rows go in with one INSERT ... SELECT and every row is
+# reported. The statement-level payment trigger then updates each touched
+# invoice once.
+POST_SETTLEMENT_QUERY = """
+WITH RECURSIVE locked AS (
+  SELECT i.invoice_id, i.member_id, i.remaining, i.status
+  FROM invoice i
+  WHERE i.invoice_id IN (SELECT invoice_id FROM settlement)
+  ORDER BY i.invoice_id
+  FOR UPDATE
+),
+-- One step per row of an invoice (seq 1, 2, ...), carrying what is left
+walk AS (
+  SELECT s.invoice_id, s.seq, s.line_no, s.amount <= l.remaining AS fits,
+         CASE WHEN s.amount <= l.remaining THEN l.remaining - s.amount ELSE l.remaining END AS left_over
+  FROM settlement s
+  JOIN locked l
+    ON s.invoice_id = l.invoice_id
+  WHERE s.seq = 1
+    AND l.status <> 'cancelled'
+  UNION ALL
+  SELECT s.invoice_id, s.seq, s.line_no, s.amount <= w.left_over,
+         CASE WHEN s.amount <= w.left_over THEN w.left_over - s.amount ELSE w.left_over END
+  FROM walk w
+  JOIN settlement s
+    ON s.invoice_id = w.invoice_id
+   AND s.seq = w.seq + 1
+),
+decided AS (
+  SELECT s.line_no, s.invoice_id, s.amount, s.method, s.payment_date, l.member_id,
+         CASE
+           WHEN l.invoice_id IS NULL THEN 'invoice does not exist'
+           WHEN l.status = 'cancelled' THEN 'invoice is cancelled'
+           WHEN NOT w.fits THEN 'exceeds remaining balance'
+         END AS reject_reason
+  FROM settlement s
+  LEFT JOIN locked l
+    ON s.invoice_id = l.invoice_id
+  LEFT JOIN walk w
+    ON s.line_no = w.line_no
+),
+posted AS (
+  INSERT INTO payment (invoice_id, amount, method, payment_date)
+  SELECT invoice_id, amount, method, payment_date
+  FROM decided
+  WHERE reject_reason IS NULL
+  ORDER BY line_no
+)
+SELECT line_no, invoice_id, amount, member_id, reject_reason
+FROM decided
+ORDER BY line_no
+"""
+
+
+def parse_settlement_row(record):
+  """
+  Validates one settlement CSV row (invoice_id, amount, method and an
+  optional payment_date). Returns a row tuple or raises ValueError.
+  """
+  try:
+    invoice_id = int(record.get('invoice_id'))
+  except (TypeError, ValueError):
+    raise ValueError("invoice_id missing or not an integer")
+
+  try:
+    amount = Decimal(str(record.get('amount'))).quantize(Decimal('0.01'))
+  except InvalidOperation:
+    raise ValueError("amount is not a number")
+  if not amount.is_finite() or amount <= 0 or amount >= Decimal('100000000'):
+    raise ValueError("amount out of range")
+
+  method = (record.get('method') or '').strip()
+  if not method or len(method) > 20 or any(c in method for c in '\t\n\\'):
+    raise ValueError("method missing or invalid")
+
+  payment_date = record.get('payment_date')
+  if payment_date in (None, ''):
+    payment_date = date.today()
+  else:
+    try:
+      payment_date = date.fromisoformat(payment_date)
+    except ValueError:
+      raise ValueError("payment_date is not YYYY-MM-DD")
+
+  return (invoice_id, amount, method, payment_date)
+
+def post_settlement_rows(cur, rows):
+  """
+  Posts parsed settlement rows [(line_no, invoice_id, amount, method,
+  payment_date), ...] on cur's transaction, without committing.
+  Returns [(line_no, invoice_id, amount, member_id, reject_reason or None), ...].
+  """
+  buf = io.StringIO()
+  seqs = {}
+  for line_no, invoice_id, amount, method, payment_date in rows:
+    # Position of the row among its invoice's rows, for the walk in file order
+    seqs[invoice_id] = seqs.get(invoice_id, 0) + 1
+    buf.write(f"{line_no}\t{invoice_id}\t{seqs[invoice_id]}\t{amount}\t{method}\t{payment_date}\n")
+  buf.seek(0)
+
+  cur.execute(
+    """
+    CREATE TEMP TABLE settlement (
+      line_no      INTEGER PRIMARY KEY,
+      invoice_id   INTEGER NOT NULL,
+      seq          INTEGER NOT NULL,
+      amount       NUMERIC(10,2) NOT NULL,
+      method       VARCHAR(20) NOT NULL,
+      payment_date DATE NOT NULL,
+      UNIQUE (invoice_id, seq)
+    ) ON COMMIT DROP
+    """
+  )
+  cur.copy_expert("COPY settlement FROM STDIN", buf)
+  # So each step of the walk is an index lookup, not a scan of the file
+  cur.execute("ANALYZE settlement")
+  cur.execute(POST_SETTLEMENT_QUERY)
+  return cur.fetchall()
+
+def post_settlement(path):
+  """
+  Posts every payment in a settlement CSV in one transaction.
+  Returns [(line_no, invoice_id, amount, reject_reason or None), ...].
+  """
+  report = []
+  parsed = []
+  with open(path, newline='') as f:
+    # line 1 is the header
+    for line_no, record in enumerate(csv.DictReader(f), start=2):
+      try:
+        parsed.append((line_no, *parse_settlement_row(record)))
+      except ValueError as e:
+        report.append((line_no, record.get('invoice_id'), record.get('amount'), str(e)))
+
+  with get_connection(statement_timeout_ms=SETTLEMENT_TIMEOUT_MS) as connection, connection.cursor() as cur:
+    rows = post_settlement_rows(cur, parsed)
+    connection.commit()
+
+  invalidate_dashboard(*{member_id for _, _, _, member_id, reason in rows if reason is None})
+  report.extend((line_no, invoice_id, amount, reason) for line_no, invoice_id, amount, _, reason in rows)
+  report.sort(key=lambda r: r[0])
+  return report
+
+def write_report(report, path):
+  with open(path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['line', 'invoice_id', 'amount', 'result'])
+    for line_no, invoice_id, amount, reason in report:
+      writer.writerow([line_no, invoice_id, amount, 'accepted' if reason is None else f'rejected: {reason}'])
+
+
+if __name__ == "__main__":
+  if len(sys.argv) != 2:
+    print("Usage: python -m app.payments <settlement.csv>")
+    sys.exit(1)
+  try:
+    settlement_report = post_settlement(sys.argv[1])
+  except psycopg2.Error as e:
+    print("Posting settlement failed, nothing was posted. Error:", e)
+    sys.exit(1)
+  accepted = sum(1 for r in settlement_report if r[3] is None)
+  print(f"Posted {accepted} payments, rejected {len(settlement_report) - accepted}")
+  write_report(settlement_report, sys.argv[1] + '.report.csv')
+  print(f"Per-row report written to {sys.argv[1]}.report.csv")
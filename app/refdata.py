@@ -0,0 +1,162 @@
+import select
+import threading
+import time
+
+import psycopg2
+from app.cache import TTLCache
+from app.database import DB_CONFIG, get_connection, record_write
+
+# Trainers, rooms and equipment change a few times a day but are read on
+# almost every action, so each table is kept in memory as a whole.
+# Triggers on the tables NOTIFY REFDATA_CHANNEL on commit and a listener
+# thread drops the table from the cache; the TTL bounds staleness if the
+# listener is down.
+REFDATA_CACHE_TTL = 300
+# Tables bigger than this are read from the database every time instead
+REFDATA_MAX_ROWS = 50000
+REFDATA_CHANNEL = 'refdata_changed'
+# Seconds between listener reconnect attempts
+LISTEN_RETRY_SECONDS = 5
+# Seconds without a notification after which the listener pings its
+# connection, so one that silently died (failover, dropped by a NAT) is
+# noticed and replaced; unanswered pings time out after as long again
+LISTEN_PING_SECONDS = 30
+
+REFDATA_QUERIES = {
+  'trainer': """
+    SELECT trainer_id, full_name, availability_start, availability_end
+    FROM trainer
+    ORDER BY trainer_id
+  """,
+  'rooms': """
+    SELECT room_id, room_name, capacity
+    FROM rooms
+    ORDER BY room_id
+  """,
+  'equipment': """
+    SELECT equipment_id, room_id, type, status
+    FROM equipment
+    ORDER BY equipment_id
+  """,
+}
+
+_cache = TTLCache(maxsize=len(REFDATA_QUERIES), ttl=REFDATA_CACHE_TTL)
+# Bumped on every invalidation so a load that raced with a change isn't cached
+_generation = dict.fromkeys(REFDATA_QUERIES, 0)
+_lock = threading.Lock()
+_listener = None
+
+
+def _load(table):
+  """
+  (rows, {id: row}) for a reference table, from memory when possible.
+  Raises psycopg2.Error on database failure.
+  """
+  _ensure_listener()
+  entry = _cache.get(table)
+  if entry is not None:
+    return entry
+
+  with _lock:
+    generation = _generation[table]
+  with get_connection(autocommit=True, read_only=True, reader=('refdata', table)) as connection, connection.cursor() as cur:
+    cur.execute(REFDATA_QUERIES[table])
+    rows = cur.fetchall()
+  entry = (rows, {row[0]: row for row in rows})
+
+  if len(rows) <= REFDATA_MAX_ROWS:
+    with _lock:
+      if _generation[table] == generation:
+        _cache.put(table, entry)
+  return entry
+
+def _get(table, key):
+  try:
+    key = int(key)
+  except (TypeError, ValueError):
+    return None
+  return _load(table)[1].get(key)
+
+def get_trainers():
+  """
+  [(trainer_id, full_name, availability_start, availability_end), ...]
+  """
+  return _load('trainer')[0]
+
+def get_trainer(trainer_id):
+  return _get('trainer', trainer_id)
+
+def get_rooms():
+  """
+  [(room_id, room_name, capacity), ...]
+  """
+  return _load('rooms')[0]
+
+def get_room(room_id):
+  return _get('rooms', room_id)
+
+def get_equipment_list():
+  """
+  [(equipment_id, room_id, type, status), ...]
+  """
+  return _load('equipment')[0]
+
+def get_equipment(equipment_id):
+  return _get('equipment', equipment_id)
+
+def invalidate_refdata(*tables):
+  """
+  Drops cached reference tables (all of them if none are named). Called by
+  the listener, and right after this process commits a change so its own
+  next read doesn't wait for the notification.
+  """
+  # Before the reload can start, so it comes from a replica with the change
+  record_write(*[('refdata', table) for table in tables or REFDATA_QUERIES])
+  with _lock:
+    for table in tables or REFDATA_QUERIES:
+      if table in _generation:
+        _generation[table] += 1
+        _cache.invalidate(table)
+
+
+def _listen_forever():
+  while True:
+    try:
+      connection = psycopg2.connect(
+        **DB_CONFIG, keepalives=1, keepalives_idle=LISTEN_PING_SECONDS,
+        keepalives_interval=LISTEN_PING_SECONDS, keepalives_count=1,
+        tcp_user_timeout=LISTEN_PING_SECONDS * 1000,
+      )
+    except psycopg2.Error:
+      time.sleep(LISTEN_RETRY_SECONDS)
+      continue
+    try:
+      connection.autocommit = True
+      with connection.cursor() as cur:
+        cur.execute(f"LISTEN {REFDATA_CHANNEL}")
+      # Anything that changed while we weren't listening
+      invalidate_refdata()
+      while True:
+        if not select.select([connection], [], [], LISTEN_PING_SECONDS)[0]:
+          # Raises if the connection is gone; notifications it brings along are kept
+          with connection.cursor() as cur:
+            cur.execute("SELECT 1")
+        connection.poll()
+        changed = {notify.payload for notify in connection.notifies}
+        connection.notifies.clear()
+        if changed:
+          invalidate_refdata(*changed)
+    except (OSError, psycopg2.Error):
+      invalidate_refdata()
+      time.sleep(LISTEN_RETRY_SECONDS)
+    finally:
+      connection.close()
+
+def _ensure_listener():
+  global _listener
+  if _listener is not None:
+    return
+  with _lock:
+    if _listener is None:
+      _listener = threading.Thread(target=_listen_forever, name='refdata-listener', daemon=True)
+      _listener.start()
@@ -0,0 +1,440 @@
+"""
+Binary snapshot and restore of the whole database:
+
+  python -m app.snapshot dump snapshots/2025-12-01
+  python -m app.snapshot restore snapshots/2025-12-01 --jobs 8
+
+dump streams every table (each health_metric partition on its own) out
+with binary COPY on SNAPSHOT_JOBS connections that share one exported
+snapshot, so the tables are consistent with each other. Each table becomes
+a gzip file in the archive directory; manifest.json lists the tables with
+their columns, row counts and SHA-256 checksums, plus the sequences,
+partition bounds, keys and indexes of the dumped database.
+
+restore loads an archive into a database created from the same DDL.sql.
+The checksums are verified before anything is touched. Then keys and
+indexes are dropped and triggers disabled (the archive already holds the
+derived state they maintain), every table is truncated and loaded with
+COPY FREEZE in parallel, and the indexes and keys are built afterwards,
+also in parallel. Foreign keys are added NOT VALID and validated last, so
+validations of different tables don't block each other. Running restore
+again after a failure starts over.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from app.database import DB_CONFIG, POOL_MAX_SIZE, get_connection
+
+MANIFEST = 'manifest.json'
+ARCHIVE_FORMAT = 1
+# Tables dumped / loaded / indexed at a time
+SNAPSHOT_JOBS = 4
+# gzip level: 1 is fastest, 9 smallest
+COMPRESS_LEVEL = 1
+# Bytes buffered between COPY and the compressor, and read per block
+BLOCK_SIZE = 1 << 20
+# maintenance_work_mem for index and key builds during restore
+RESTORE_MAINTENANCE_WORK_MEM = '512MB'
+
+
+class _ArchiveWriter:
+  """
+  Sink for COPY TO: buffers the rows, gzips them in blocks and checksums
+  the compressed file as it is written.
+  """
+  def __init__(self, path):
+    self._file = open(path, 'wb')
+    # wbits 31: gzip framing, so the file is readable with gunzip
+    self._zip = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    self._sha256 = hashlib.sha256()
+    self._buf = []
+    self._buffered = 0
+    self.raw_bytes = 0
+
+  def write(self, data):
+    self._buf.append(data)
+    self._buffered += len(data)
+    if self._buffered >= BLOCK_SIZE:
+      self._flush()
+
+  def _emit(self, data):
+    self._sha256.update(data)
+    self._file.write(data)
+
+  def _flush(self):
+    self.raw_bytes += self._buffered
+    self._emit(self._zip.compress(b''.join(self._buf)))
+    self._buf = []
+    self._buffered = 0
+
+  def close(self):
+    """
+    Returns the SHA-256 of the compressed file.
+    """
+    self._flush()
+    self._emit(self._zip.flush())
+    self._file.close()
+    return self._sha256.hexdigest()
+
+
+class _ArchiveReader:
+  """
+  Source for COPY FROM: one table's gzip file, decompressed block by block.
+  """
+  def __init__(self, path):
+    self._file = open(path, 'rb')
+    self._zip = zlib.decompressobj(31)
+
+  def read(self, size=-1):
+    while self._file is not None:
+      block = self._file.read(BLOCK_SIZE)
+      if not block:
+        self._file.close()
+        self._file = None
+        return self._zip.flush()
+      data = self._zip.decompress(block)
+      if data:
+        return data
+    return b''
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+
+
+def _file_sha256(path):
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+      sha256.update(block)
+  return sha256.hexdigest()
+
+def _run_parallel(task, items, jobs):
+  """
+  task(item) for every item on up to jobs threads; the first failure is
+  raised once the running tasks finish.
+  """
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+    return [future.result() for future in [executor.submit(task, item) for item in items]]
+
+def _jobs(jobs):
+  # One pooled connection stays with the caller
+  return max(1, min(jobs, POOL_MAX_SIZE - 1))
+
+def _quote(name):
+  return '"' + name.replace('"', '""') + '"'
+
+
+def _read_catalog(cur):
+  """
+  Tables, sequences, keys and indexes of the public schema.
+  """
+  cur.execute(
+    """
+    SELECT c.relname, p.relname, pg_get_expr(c.relpartbound, c.oid),
+           array_agg(a.attname ORDER BY a.attnum),
+           array_agg(format_type(a.atttypid, a.atttypmod) ORDER BY a.attnum)
+    FROM pg_class c
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+                       AND NOT a.attisdropped AND a.attgenerated = ''
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+    LEFT JOIN pg_class p ON p.oid = i.inhparent
+    WHERE c.relnamespace = 'public'::regnamespace
+      AND c.relkind = 'r'
+    GROUP BY c.oid, c.relname, p.relname
+    ORDER BY c.relname
+    """
+  )
+  tables = [
+    {'name': name, 'parent': parent, 'bound': bound, 'columns': columns, 'types': types}
+    for name, parent, bound, columns, types in cur.fetchall()
+  ]
+  cur.execute("SELECT relname FROM pg_class WHERE relnamespace = 'public'::regnamespace AND relkind = 'S' ORDER BY relname")
+  sequences = {}
+  for (name,) in cur.fetchall():
+    # pg_sequences shows no last_value before the first nextval()
+    cur.execute(f"SELECT last_value, is_called FROM {_quote(name)}")
+    sequences[name] = list(cur.fetchone())
+  # Keys declared on partitions are inherited from the parent's, and so are
+  # the partitions' own indexes
+  cur.execute(
+    """
+    SELECT con.conname, c.relname, c.relkind = 'p', con.contype, pg_get_constraintdef(con.oid)
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    WHERE c.relnamespace = 'public'::regnamespace
+      AND con.contype IN ('p', 'u', 'x', 'f')
+      AND con.conparentid = 0
+    ORDER BY c.relname, con.conname
+    """
+  )
+  keys = [
+    {'name': name, 'table': table, 'partitioned': partitioned, 'type': contype, 'definition': definition}
+    for name, table, partitioned, contype, definition in cur.fetchall()
+  ]
+  cur.execute(
+    """
+    SELECT ic.relname, c.relname, pg_get_indexdef(i.indexrelid)
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    JOIN pg_class c ON c.oid = i.indrelid
+    WHERE c.relnamespace = 'public'::regnamespace
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid AND con.contype IN ('p', 'u', 'x'))
+      AND NOT EXISTS (SELECT 1 FROM pg_inherits inh WHERE inh.inhrelid = i.indexrelid)
+    ORDER BY c.relname, ic.relname
+    """
+  )
+  indexes = [{'name': name, 'table': table, 'definition': definition} for name, table, definition in cur.fetchall()]
+  return tables, sequences, keys, indexes
+
+
+def dump(path, jobs=SNAPSHOT_JOBS):
+  """
+  Writes a snapshot of every table into the directory path (created if
+  needed) and returns its manifest.
+  """
+  os.makedirs(path, exist_ok=True)
+  jobs = _jobs(jobs)
+  started = time.monotonic()
+
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    # Held open until every table is out, so the exported snapshot stays valid
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    cur.execute("SELECT pg_export_snapshot(), current_setting('server_version'), now()")
+    snapshot_id, server_version, taken_at = cur.fetchone()
+    tables, sequences, keys, indexes = _read_catalog(cur)
+
+    def dump_table(table):
+      file_name = table['name'] + '.copy.gz'
+      writer = _ArchiveWriter(os.path.join(path, file_name))
+      try:
+        with get_connection(statement_timeout_ms=0, operation='snapshot_dump') as worker, worker.cursor() as wcur:
+          wcur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+          wcur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+          columns = ', '.join(_quote(c) for c in table['columns'])
+          wcur.copy_expert(f"COPY {_quote(table['name'])} ({columns}) TO STDOUT WITH (FORMAT binary)",
+                           writer, size=BLOCK_SIZE)
+          rows = wcur.rowcount
+      finally:
+        sha256 = writer.close()
+      print(f"  {table['name']}: {rows} rows, {writer.raw_bytes} bytes", flush=True)
+      return dict(table, file=file_name, rows=rows, bytes=writer.raw_bytes, sha256=sha256)
+
+    # Biggest tables first so they don't start last
+    cur.execute(
+      "SELECT relname FROM pg_class WHERE relnamespace = 'public'::regnamespace AND relkind = 'r' ORDER BY relpages DESC"
+    )
+    order = {name: i for i, (name,) in enumerate(cur.fetchall())}
+    tables.sort(key=lambda t: order[t['name']])
+    dumped = _run_parallel(dump_table, tables, jobs)
+
+  manifest = {
+    'format': ARCHIVE_FORMAT,
+    'database': DB_CONFIG['dbname'],
+    'server_version': server_version,
+    'taken_at': taken_at.isoformat(),
+    'tables': sorted(dumped, key=lambda t: t['name']),
+    'sequences': sequences,
+    'keys': keys,
+    'indexes': indexes,
+  }
+  temp_path = os.path.join(path, MANIFEST + '.tmp')
+  with open(temp_path, 'w') as f:
+    json.dump(manifest, f, indent=1)
+  # The manifest appears last, so a half-written archive has none
+  os.replace(temp_path, os.path.join(path, MANIFEST))
+  print(f"Dumped {len(dumped)} tables, {sum(t['rows'] for t in dumped)} rows "
+        f"in {time.monotonic() - started:.1f}s")
+  return manifest
+
+
+def read_manifest(path):
+  with open(os.path.join(path, MANIFEST)) as f:
+    manifest = json.load(f)
+  if manifest.get('format') != ARCHIVE_FORMAT:
+    raise ValueError(f"{path} is not a format {ARCHIVE_FORMAT} archive")
+  return manifest
+
+def verify(path, manifest, jobs=SNAPSHOT_JOBS):
+  """
+  Raises ValueError naming every table file that is missing or doesn't
+  match its checksum.
+  """
+  def check(table):
+    file_path = os.path.join(path, table['file'])
+    if not os.path.exists(file_path):
+      return f"{table['file']} is missing"
+    if _file_sha256(file_path) != table['sha256']:
+      return f"{table['file']} is corrupt (checksum mismatch)"
+    return None
+
+  problems = [p for p in _run_parallel(check, manifest['tables'], jobs) if p]
+  if problems:
+    raise ValueError('; '.join(problems))
+
+def _check_schema(manifest, tables):
+  """
+  Every archived table must exist with the same columns, except partitions,
+  which restore recreates. Every table of the database must be archived.
+  """
+  current = {t['name']: t for t in tables}
+  archived = {t['name'] for t in manifest['tables']}
+  problems = []
+  for table in manifest['tables']:
+    target = current.get(table['name'])
+    if target is None:
+      if table['parent'] is None:
+        problems.append(f"table {table['name']} does not exist")
+    elif (target['columns'], target['types']) != (table['columns'], table['types']):
+      problems.append(f"table {table['name']} has different columns")
+  for name, target in current.items():
+    if name not in archived and target['parent'] is None:
+      problems.append(f"table {name} is not in the archive")
+  if problems:
+    raise ValueError("The database doesn't match the archive: " + '; '.join(problems))
+
+def restore(path, jobs=SNAPSHOT_JOBS):
+  """
+  Replaces the contents of every table with the archive at path.
+  """
+  jobs = _jobs(jobs)
+  started = time.monotonic()
+  manifest = read_manifest(path)
+  verify(path, manifest, jobs)
+  print(f"Verified {len(manifest['tables'])} table files")
+
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    tables, _, keys, indexes = _read_catalog(cur)
+    _check_schema(manifest, tables)
+
+    # Partition layout of the archive: missing partitions are created and
+    # extra ones dropped, so every archived row lands in its own partition
+    archived = {t['name'] for t in manifest['tables']}
+    current = {t['name'] for t in tables}
+    for table in tables:
+      if table['parent'] is not None and table['name'] not in archived:
+        cur.execute(f"DROP TABLE {_quote(table['name'])}")
+    for table in manifest['tables']:
+      if table['name'] not in current:
+        cur.execute(f"CREATE TABLE {_quote(table['name'])} PARTITION OF {_quote(table['parent'])} {table['bound']}")
+
+    # Foreign keys first, they depend on the unique indexes
+    for key in sorted(keys, key=lambda k: k['type'] != 'f'):
+      cur.execute(f"ALTER TABLE {_quote(key['table'])} DROP CONSTRAINT {_quote(key['name'])}")
+    for index in indexes:
+      cur.execute(f"DROP INDEX {_quote(index['name'])}")
+    for table in manifest['tables']:
+      cur.execute(f"ALTER TABLE {_quote(table['name'])} DISABLE TRIGGER USER")
+    connection.commit()
+
+  def load_table(table):
+    reader = _ArchiveReader(os.path.join(path, table['file']))
+    try:
+      with get_connection(statement_timeout_ms=0, operation='snapshot_restore') as worker, worker.cursor() as wcur:
+        # FREEZE needs the table truncated in the same transaction, and
+        # spares autovacuum rewriting every page later
+        wcur.execute(f"TRUNCATE ONLY {_quote(table['name'])}")
+        columns = ', '.join(_quote(c) for c in table['columns'])
+        wcur.copy_expert(f"COPY {_quote(table['name'])} ({columns}) FROM STDIN WITH (FORMAT binary, FREEZE)",
+                         reader, size=BLOCK_SIZE)
+        worker.commit()
+    finally:
+      reader.close()
+    print(f"  {table['name']}: {table['rows']} rows", flush=True)
+
+  _run_parallel(load_table, sorted(manifest['tables'], key=lambda t: -t['bytes']), jobs)
+  print(f"Loaded {sum(t['rows'] for t in manifest['tables'])} rows in {time.monotonic() - started:.1f}s")
+
+  table_bytes = {}
+  for table in manifest['tables']:
+    owner = table['parent'] or table['name']
+    table_bytes[owner] = table_bytes.get(owner, 0) + table['bytes']
+
+  def build(statement):
+    with get_connection(statement_timeout_ms=0, autocommit=True, operation='snapshot_restore') as worker, worker.cursor() as wcur:
+      wcur.execute("SET maintenance_work_mem = %s", (RESTORE_MAINTENANCE_WORK_MEM,))
+      try:
+        wcur.execute(statement)
+      finally:
+        wcur.execute("RESET maintenance_work_mem")
+
+  # Indexes and keys on the biggest tables first. Builds on the same table
+  # queue behind each other on its lock; different tables run side by side.
+  unique_keys = [k for k in manifest['keys'] if k['type'] != 'f']
+  # Indexes of partitioned tables come out as ON ONLY, which would skip
+  # building them on the partitions
+  builds = [(i['table'], i['definition'].replace(' ON ONLY ', ' ON ', 1)) for i in manifest['indexes']]
+  builds += [(k['table'], f"ALTER TABLE {_quote(k['table'])} ADD CONSTRAINT {_quote(k['name'])} {k['definition']}")
+             for k in unique_keys]
+  builds.sort(key=lambda b: -table_bytes.get(b[0], 0))
+  _run_parallel(build, [statement for _, statement in builds], jobs)
+  print(f"Built {len(builds)} indexes and keys in {time.monotonic() - started:.1f}s")
+
+  # A validated ADD FOREIGN KEY locks the referenced table against other
+  # ones; VALIDATE CONSTRAINT doesn't. Partitioned tables can't take NOT
+  # VALID foreign keys and add theirs validated.
+  foreign_keys = [k for k in manifest['keys'] if k['type'] == 'f']
+  with get_connection(statement_timeout_ms=0) as connection, connection.cursor() as cur:
+    for key in foreign_keys:
+      if not key['partitioned']:
+        cur.execute(f"ALTER TABLE {_quote(key['table'])} ADD CONSTRAINT {_quote(key['name'])} {key['definition']} NOT VALID")
+    for name, (last_value, is_called) in manifest['sequences'].items():
+      cur.execute("SELECT setval(%s, %s, %s)", (_quote(name), last_value, is_called))
+    connection.commit()
+
+  validations = [
+    f"ALTER TABLE {_quote(k['table'])} ADD CONSTRAINT {_quote(k['name'])} {k['definition']}" if k['partitioned']
+    else f"ALTER TABLE {_quote(k['table'])} VALIDATE CONSTRAINT {_quote(k['name'])}"
+    for k in foreign_keys
+  ]
+  _run_parallel(build, validations, jobs)
+  print(f"Validated {len(foreign_keys)} foreign keys in {time.monotonic() - started:.1f}s")
+
+  with get_connection(statement_timeout_ms=0, autocommit=True) as connection, connection.cursor() as cur:
+    for table in manifest['tables']:
+      cur.execute(f"ALTER TABLE {_quote(table['name'])} ENABLE TRIGGER USER")
+    cur.execute("ANALYZE")
+  print(f"Restored {path} (taken {manifest['taken_at']}) in {time.monotonic() - started:.1f}s")
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Binary snapshot and restore of the whole database.")
+  parser.add_argument('command', choices=('dump', 'restore', 'verify'))
+  parser.add_argument('path', help="archive directory")
+  parser.add_argument('--jobs', type=int, default=SNAPSHOT_JOBS, help="tables processed at a time")
+  parser.add_argument('--yes', action='store_true', help="don't ask before replacing the database contents")
+  args = parser.parse_args(argv)
+
+  try:
+    if args.command == 'dump':
+      dump(args.path, args.jobs)
+      return 0
+
+    manifest = read_manifest(args.path)
+    if args.command == 'verify':
+      verify(args.path, manifest, args.jobs)
+      print(f"{len(manifest['tables'])} table files OK, taken {manifest['taken_at']}")
+      return 0
+
+    if not args.yes:
+      answer = input(f"This replaces ALL data in {DB_CONFIG['dbname']} with the snapshot taken "
+                     f"{manifest['taken_at']}. Continue? (y/n): ")
+      if answer.strip().lower() != 'y':
+        print("Cancelled.")
+        return 1
+    restore(args.path, args.jobs)
+  except (OSError, ValueError, psycopg2.Error) as e:
+    print("Snapshot failed, Error:", e)
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
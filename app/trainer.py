@@ -1,8 +1,99 @@
 import psycopg2
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from app.database import execute_prepared, get_connection
+from app.member import CLASS_LOOKAHEAD_DAYS
+from app.refdata import invalidate_refdata
 from app.validators import get_valid_time_input, validate_time
 
-def register_trainer(connection):
+# Rows per page when a trainer browses a member's raw health metrics
+METRIC_PAGE_SIZE = 20
+# Periods shown in a daily/weekly/monthly trend
+TREND_LENGTH = 12
+# Menu choice -> (date_trunc unit, one period as an interval)
+TREND_PERIODS = {
+  '1': ('day', '1 day'),
+  '2': ('week', '1 week'),
+  '3': ('month', '1 month'),
+}
+
+# Rows pulled per round trip while streaming the roster
+ROSTER_FETCH_SIZE = 500
+
+# Every member in the trainer's live sessions with profile, goal, latest
+# reading and progress, in one statement. The newest reading is a single
+# probe of idx_health_metric_member_date in the one partition holding the
+# member's latest day; the starting weight is the first weighed day in the
+# health_metric_daily rollup, which outlives the raw partitions.
+ROSTER_QUERY = """
+SELECT m.member_id, m.full_name, m.phone,
+       r.next_start, r.sessions,
+       g.weight AS goal_weight, g.target_date,
+       latest.weight, latest.heart_rate, latest.date,
+       ROUND(100 * (first.weight - latest.weight) / NULLIF(first.weight - g.weight, 0)) AS progress_pct
+FROM (
+  SELECT sm.member_id, MIN(ts.session_date + ts.start_time) AS next_start, COUNT(*) AS sessions
+  FROM training_sessions ts
+  JOIN session_members sm
+    ON sm.session_id = ts.session_id
+  WHERE ts.trainer_id = %s
+    AND ts.status IN ('active', 'full')
+  GROUP BY sm.member_id
+) r
+JOIN member m
+  ON m.member_id = r.member_id
+LEFT JOIN fitness_goal g
+  ON g.member_id = r.member_id
+LEFT JOIN LATERAL (
+  SELECT h.weight, h.heart_rate, h.date
+  FROM health_metric h
+  WHERE h.member_id = r.member_id
+    AND h.date >= (
+      SELECT MAX(d.day)
+      FROM health_metric_daily d
+      WHERE d.member_id = r.member_id
+    )
+    AND h.date < (
+      SELECT MAX(d.day) + 1
+      FROM health_metric_daily d
+      WHERE d.member_id = r.member_id
+    )
+  ORDER BY h.date DESC
+  LIMIT 1
+) latest ON true
+LEFT JOIN LATERAL (
+  SELECT ROUND(d.weight_sum / d.weight_count, 2) AS weight
+  FROM health_metric_daily d
+  WHERE d.member_id = r.member_id
+    AND d.weight_count > 0
+  ORDER BY d.day
+  LIMIT 1
+) first ON true
+ORDER BY r.next_start, m.full_name
+"""
+
+# Min/avg/max weight and heart rate per period, rolled up from the daily
+# rows of the last %(periods)s periods (the PK range scan only reads those)
+METRIC_TREND_QUERY = """
+SELECT date_trunc(%(period)s, d.day::timestamp)::date AS period_start,
+       SUM(d.readings),
+       MIN(d.weight_min),
+       ROUND(SUM(d.weight_sum) / NULLIF(SUM(d.weight_count), 0), 2),
+       MAX(d.weight_max),
+       MIN(d.heart_rate_min),
+       ROUND(SUM(d.heart_rate_sum)::numeric / NULLIF(SUM(d.heart_rate_count), 0)),
+       MAX(d.heart_rate_max)
+FROM health_metric_daily d
+WHERE d.member_id = %(member_id)s
+  AND d.day >= (
+    SELECT date_trunc(%(period)s, MAX(day)::timestamp) - (%(periods)s - 1) * %(step)s::interval
+    FROM health_metric_daily
+    WHERE member_id = %(member_id)s
+  )
+GROUP BY 1
+ORDER BY 1 DESC
+"""
+
+def register_trainer():
     print("\n---------Trainer Registration--------")
     full_name = input("Full name: ")
     phone = input("Phone#: ")
@@ -14,7 +105,7 @@ def register_trainer(connection):
       return
 
     try:
-      with connection.cursor() as cur:
+      with get_connection() as connection, connection.cursor() as cur:
         cur.execute(
           """
           INSERT INTO trainer (full_name, phone, availability_start, availability_end)
@@ -24,26 +115,20 @@ def register_trainer(connection):
           (full_name, phone, availability_start, availability_end),
         )
         trainer_id = cur.fetchone()[0]
-      connection.commit()
+        connection.commit()
+      invalidate_refdata('trainer')
       print(f"Trainer registered successfully with ID: {trainer_id}\n")
     except psycopg2.Error as e:
-      connection.rollback()
       print("Registering Trainer Failed, Error:", e)
 
-def login_trainer(connection):
+def login_trainer():
   trainer_id = input("Enter your trainer ID: ")
 
   try:
-    with connection.cursor() as cur:
-      cur.execute(
-        """
-        SELECT * FROM trainer WHERE trainer_id = %s
-        """,
-        (trainer_id,),
-      )
+    with get_connection() as connection, connection.cursor() as cur:
+      execute_prepared(cur, 'login_trainer', (trainer_id,))
       row = cur.fetchone()
   except psycopg2.Error as e:
-    connection.rollback()
     print(f"Retreiving Info For Trainer:{trainer_id} Failed, Error:", e)
     return None
 
@@ -52,17 +137,17 @@ def login_trainer(connection):
       return None
   return row[0]
 
-def view_sessions(connection, trainer_id):
+def view_sessions(trainer_id):
   print("\n------------ Your Upcoming Sessions ----------")
   try:
-    with connection.cursor() as cur:
+    with get_connection(read_only=True) as connection, connection.cursor() as cur:
       cur.execute(
         """
-        SELECT ts.session_id, ts.start_time, ts.end_time, ts.status, r.room_name, ts.session_type
+        SELECT ts.session_id, ts.session_date, ts.start_time, ts.end_time, ts.status, r.room_name, ts.session_type
         FROM training_sessions ts JOIN rooms r
           ON ts.room_id = r.room_id
         WHERE ts.trainer_id = %s AND ts.status = 'active' AND ts.session_type = 'personal'
-        ORDER BY ts.start_time
+        ORDER BY ts.session_date, ts.start_time
         """,
         (trainer_id,),
       )
@@ -72,26 +157,27 @@ def view_sessions(connection, trainer_id):
       print("you don't have any sessions scheduled")
       return
 
-    for session_id, start_time, end_time, status, room_name, session_type in rows:
-        print(f"{session_id} | {start_time}-{end_time} | room_name: {room_name} | {session_type} |{status}")
+    for session_id, session_date, start_time, end_time, status, room_name, session_type in rows:
+        print(f"{session_id} | {session_date} {start_time}-{end_time} | room_name: {room_name} | {session_type} |{status}")
 
   except psycopg2.Error as e:
-    connection.rollback()
     print(f"Error fetching sessions for trainer {trainer_id}:", e)
 
-def view_classes(connection, trainer_id):
+def view_classes(trainer_id):
   print("\n------------ Your Upcoming Classes ----------")
+  # Dated classes plus recurring ones, expanded for the lookahead window
+  today = date.today()
   try:
-    with connection.cursor() as cur:
+    with get_connection(read_only=True) as connection, connection.cursor() as cur:
       cur.execute(
         """
-        SELECT session_id, start_time, end_time, status, r.room_name
-        FROM training_sessions ts JOIN rooms r
-          ON ts.room_id = r.room_id
-        WHERE trainer_id = %s AND status = 'active' AND session_type = 'group'
-        ORDER BY start_time
+        SELECT c.session_id, c.schedule_id, c.session_date, c.start_time, c.end_time, c.status,
+               c.enrolled, c.capacity, r.room_name
+        FROM class_calendar(%s, %s, %s) c JOIN rooms r
+          ON c.room_id = r.room_id
+        ORDER BY c.session_date, c.start_time
         """,
-        (trainer_id,),
+        (today, today + timedelta(days=CLASS_LOOKAHEAD_DAYS), trainer_id),
       )
 
       rows = cur.fetchall()
@@ -99,18 +185,18 @@ def view_classes(connection, trainer_id):
       print("you don't have any classes scheduled")
       return
 
-    for session_id, start_time, end_time, status, room_name in rows:
-        print(f"{session_id} | {start_time}-{end_time} | Room_name: {room_name} | {status}")
+    for session_id, schedule_id, session_date, start_time, end_time, status, enrolled, capacity, room_name in rows:
+        label = session_id if session_id is not None else f"recurring {schedule_id}"
+        print(f"{label} | {session_date} {start_time}-{end_time} | Room_name: {room_name} | {status} | {enrolled}/{capacity}")
 
   except psycopg2.Error as e:
-    connection.rollback()
     print(f"Error fetching sessions for trainer {trainer_id}:", e)
 
-def member_lookup(connection, trainer_id):
+def member_lookup(trainer_id):
   print("\n------------ Member Lookup ----------")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection(read_only=True) as connection, connection.cursor() as cur:
       cur.execute(
         """
         SELECT DISTINCT m.member_id, m.full_name
@@ -118,14 +204,13 @@ def member_lookup(connection, trainer_id):
           ON sm.session_id = ts.session_id
         JOIN member m
           ON sm.member_id = m.member_id
-        WHERE ts.trainer_id = %s AND ts.status = 'active'
+        WHERE ts.trainer_id = %s AND ts.status IN ('active', 'full')
         ORDER BY m.member_id
         """,
         (trainer_id,),
       )
       rows = cur.fetchall()
   except psycopg2.Error as e:
-    connection.rollback()
     print(f"Error looking up members for trainer {trainer_id}:", e)
     return
 
@@ -143,13 +228,45 @@ def member_lookup(connection, trainer_id):
     print("You don't have access to this member ID")
     return 
   
-  view_member(connection, trainer_id, selected_member_id , format_ids[selected_member_id])
+  view_member(trainer_id, selected_member_id , format_ids[selected_member_id])
+
+def load_roster(trainer_id):
+  """
+  Yields one roster row per member of the trainer's live sessions, streamed
+  from a server-side cursor ROSTER_FETCH_SIZE rows at a time. Iterate it to
+  the end (or close() it) so the connection goes back to the pool.
+  Raises psycopg2.Error on database failure.
+  """
+  with get_connection() as connection, connection.cursor(name='trainer_roster') as cur:
+    cur.itersize = ROSTER_FETCH_SIZE
+    cur.execute(ROSTER_QUERY, (trainer_id,))
+    yield from cur
+
+def view_roster(trainer_id):
+  print("\n------------ Class Roster ----------")
+  count = 0
+  try:
+    for (member_id, full_name, phone, next_start, sessions, goal_weight, target_date,
+         weight, heart_rate, taken_on, progress_pct) in load_roster(trainer_id):
+      count += 1
+      goal = f"goal {goal_weight} lbs by {target_date}" if goal_weight is not None else "no goal"
+      latest = f"latest {weight} lbs, HR {heart_rate} ({taken_on:%Y-%m-%d})" if taken_on is not None else "no metrics"
+      progress = f" | {progress_pct}% to goal" if progress_pct is not None else ""
+      print(f"- ID {member_id} | {full_name} | {phone} | next {next_start} ({sessions} sessions) | {goal} | {latest}{progress}")
+  except psycopg2.Error as e:
+    print(f"Error loading roster for trainer {trainer_id}:", e)
+    return
+
+  if count == 0:
+    print("You don't have any members assigned to your sessions.")
+  else:
+    print(f"{count} members")
 
-def view_member(connection, trainer_id, member_id, member_name):
+def view_member(trainer_id, member_id, member_name):
   print(f"\n------------ Member Profile (ID: {member_id}) ----------")
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       # Basic member profile
       cur.execute(
         """
@@ -160,18 +277,7 @@ def view_member(connection, trainer_id, member_id, member_name):
         (member_id,),
       )
       fitness_goal = cur.fetchone()
-
-      cur.execute(
-        """
-        SELECT member_id, height, weight, heart_rate, date
-        FROM health_metric
-        WHERE member_id = %s
-        """,
-        (member_id,),
-      )
-      health_metric = cur.fetchall()
   except psycopg2.Error as e:
-    connection.rollback()
     print("Error fetching member details:", e)
     return
   
@@ -181,13 +287,87 @@ def view_member(connection, trainer_id, member_id, member_name):
     member_id, weigtht, target_date = fitness_goal
     print(f"Current Fitness Goal for {member_name}({member_id}) | weigtht(lbs): {weigtht} | target_date: {target_date}")
 
-  if not health_metric:
-      print("This member has not assigned any health metrics")
-  else: 
-    for member_id, height, weigtht, heart_rate, date in health_metric: 
-      print(f"Health Metrics for {member_name}({member_id}) | height(cm): {height} | weigtht(lbs): {weigtht} | heart_rate: {heart_rate} | date: {date}")
+  while True:
+    print(f"\nHealth Metrics for {member_name}({member_id})")
+    print("1) Daily trend")
+    print("2) Weekly trend")
+    print("3) Monthly trend")
+    print("4) Full history (paged)")
+    print("0) Back")
+    choice = input("Enter: ").strip()
+
+    if choice in TREND_PERIODS:
+      view_metric_trend(member_id, *TREND_PERIODS[choice])
+    elif choice == '4':
+      view_metric_history(member_id)
+    elif choice == '0':
+      break
+
+def view_metric_trend(member_id, period, step):
+  """
+  Last TREND_LENGTH days/weeks/months of readings from the health_metric_daily
+  rollup: at most TREND_LENGTH periods' worth of rows, however long the
+  member's history is.
+  """
+  try:
+    with get_connection() as connection, connection.cursor() as cur:
+      cur.execute(METRIC_TREND_QUERY, {
+        'member_id': member_id, 'period': period, 'step': step, 'periods': TREND_LENGTH,
+      })
+      rows = cur.fetchall()
+  except psycopg2.Error as e:
+    print("Error fetching health metric trend:", e)
+    return
+
+  if not rows:
+    print("This member has not assigned any health metrics")
+    return
+
+  print(f"{period.capitalize():<12}{'readings':>9}  {'weight min/avg/max (lbs)':<26}heart rate min/avg/max")
+  for period_start, readings, w_min, w_avg, w_max, hr_min, hr_avg, hr_max in rows:
+    print(f"{period_start!s:<12}{readings:>9}  {f'{w_min}/{w_avg}/{w_max}':<26}{hr_min}/{hr_avg}/{hr_max}")
+
+def view_metric_history(member_id):
+  """
+  Raw readings newest first, METRIC_PAGE_SIZE at a time. Each page is its
+  own short query continuing from the last row shown (keyset paging on
+  idx_health_metric_member_date), so no connection or transaction stays
+  open while the trainer reads.
+  """
+  last_date, last_id = datetime.max, 0
+  while True:
+    try:
+      with get_connection() as connection, connection.cursor() as cur:
+        cur.execute(
+          """
+          SELECT metric_id, height, weight, heart_rate, date
+          FROM health_metric
+          WHERE member_id = %s
+            AND (date, metric_id) < (%s, %s)
+          ORDER BY date DESC, metric_id DESC
+          LIMIT %s
+          """,
+          (member_id, last_date, last_id, METRIC_PAGE_SIZE),
+        )
+        rows = cur.fetchall()
+    except psycopg2.Error as e:
+      print("Error fetching health metrics:", e)
+      return
+
+    if not rows:
+      print("No more health metrics.")
+      return
 
-def set_availability(connection, trainer_id):
+    for metric_id, height, weight, heart_rate, taken_on in rows:
+      print(f"{taken_on} | height(cm): {height} | weight(lbs): {weight} | heart_rate: {heart_rate}")
+    last_id, _, _, _, last_date = rows[-1]
+
+    if len(rows) < METRIC_PAGE_SIZE:
+      return
+    if input("Enter for the next page, 0 to stop: ").strip() == '0':
+      return
+
+def set_availability(trainer_id):
   print("\n--------- Set Trainer Availability --------")
 
   start_time = get_valid_time_input("Availability start time (HH:MM): ")
@@ -198,7 +378,7 @@ def set_availability(connection, trainer_id):
       return
 
   try:
-    with connection.cursor() as cur:
+    with get_connection() as connection, connection.cursor() as cur:
       cur.execute(
         """
         UPDATE trainer
@@ -214,11 +394,11 @@ def set_availability(connection, trainer_id):
         connection.rollback()
         return
 
-    connection.commit()
+      connection.commit()
+    invalidate_refdata('trainer')
     print(f"Availability updated: {start_time} - {end_time}")
 
   except psycopg2.Error as e:
-    connection.rollback()
     print("Updating availability failed, Error:", e)
 
   
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 
 def get_valid_time_input(p):
   while True:
@@ -19,4 +19,46 @@ def validate_time(start_time, end_time):
     print("End time must be AFTER start time.")
     return False
 
-  return True
\ No newline at end of file
+  return True
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def get_valid_date_input(p, default=None):
+  """
+  Blank means default (today if none is given), 0 exits: returns None.
+  """
+  while True:
+    day = input(p).strip()
+    try:
+        if day == '0':
+          return None
+        if day == '':
+          return default or date.today()
+        return datetime.strptime(day, "%Y-%m-%d").date()
+    except ValueError:
+        print("Invalid date format. Format should be in YYYY-MM-DD. Try Again or type 0 to exit")
+
+def validate_date(day):
+  if day is None:
+    print("Exited.")
+    return False
+
+  if day < date.today():
+    print("Date can't be in the past.")
+    return False
+
+  return True
+
+def parse_weekdays(text):
+  """
+  'Mon,Wed' -> [1, 3] (ISO weekday numbers), None if a day isn't recognised.
+  """
+  days = set()
+  for part in text.replace(' ', ',').split(','):
+    part = part.strip().lower()[:3]
+    if not part:
+      continue
+    if part not in WEEKDAYS:
+      return None
+    days.add(WEEKDAYS.index(part) + 1)
+  return sorted(days) or None
@@ -0,0 +1,225 @@
+"""
+Runs queued background jobs (see app/jobs.py) on a pool of processes:
+
+  python -m app.worker
+  python -m app.worker --processes 8
+
+Each process claims one job at a time with FOR UPDATE SKIP LOCKED, so
+workers never wait on each other or run the same job twice. A failed job is
+retried after an exponential backoff with jitter and dead-lettered after
+its max_attempts. Jobs left running by a worker that died are requeued
+once JOB_LOCK_TIMEOUT passes. Idle workers LISTEN for new jobs and also
+poll every JOB_POLL_SECONDS for delayed ones.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import select
+import signal
+import socket
+import time
+
+import psycopg2
+from app.database import DB_CONFIG, close_pool, get_connection, init_pool
+from app.jobs import JOB_KINDS
+
+WORKER_PROCESSES = 4
+# Seconds an idle worker waits for a notification before looking again
+JOB_POLL_SECONDS = 5
+# Retry delay: JOB_BACKOFF_BASE * 2^(attempt - 1), capped, +/- 25% jitter
+JOB_BACKOFF_BASE = 10
+JOB_BACKOFF_MAX = 3600
+# A running job not finished after this long is assumed abandoned
+JOB_LOCK_TIMEOUT = 3600
+# Seconds between reaper passes in each worker
+REAP_INTERVAL = 60
+# Handlers get a longer timeout than menu actions
+JOB_STATEMENT_TIMEOUT_MS = 300000
+JOB_CHANNEL = 'job_queued'
+
+
+def backoff_seconds(attempts):
+  delay = min(JOB_BACKOFF_BASE * 2 ** (attempts - 1), JOB_BACKOFF_MAX)
+  return delay * random.uniform(0.75, 1.25)
+
+def claim_job(worker_id):
+  """
+  Takes the next due job, if any, and returns
+  (job_id, kind, payload, attempts, max_attempts). Committed right away so
+  the claim survives whatever the handler does.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      UPDATE job
+      SET status = 'running', attempts = attempts + 1, locked_by = %s, locked_at = now()
+      WHERE job_id = (
+        SELECT job_id
+        FROM job
+        WHERE status = 'queued' AND run_at <= now()
+        ORDER BY run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+      )
+      RETURNING job_id, kind, payload, attempts, max_attempts
+      """,
+      (worker_id,),
+    )
+    return cur.fetchone()
+
+def fail_job(job_id, attempts, error, give_up=False):
+  """
+  Requeues a failed job after its backoff, or marks it dead on its last
+  attempt (or right away with give_up). Returns the new status.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      UPDATE job
+      SET status = CASE WHEN %(give_up)s OR attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+          run_at = now() + make_interval(secs => %(delay)s),
+          finished_at = CASE WHEN %(give_up)s OR attempts >= max_attempts THEN now() END,
+          locked_by = NULL,
+          locked_at = NULL,
+          last_error = %(error)s
+      WHERE job_id = %(job_id)s
+      RETURNING status
+      """,
+      {'give_up': give_up, 'delay': backoff_seconds(attempts), 'error': error, 'job_id': job_id},
+    )
+    row = cur.fetchone()
+  return row[0] if row else None
+
+def run_job(job):
+  job_id, kind, payload, attempts, _ = job
+  entry = JOB_KINDS.get(kind)
+  if entry is None:
+    return fail_job(job_id, attempts, f"unknown job kind {kind}", give_up=True)
+
+  handler, _ = entry
+  try:
+    with get_connection(statement_timeout_ms=JOB_STATEMENT_TIMEOUT_MS, operation=kind) as connection, connection.cursor() as cur:
+      result = handler(cur, payload)
+      cur.execute(
+        """
+        UPDATE job
+        SET status = 'done', finished_at = now(), locked_at = NULL, result = %s
+        WHERE job_id = %s
+        """,
+        (json.dumps(result), job_id),
+      )
+      connection.commit()
+    return 'done'
+  except Exception as e:
+    return fail_job(job_id, attempts, f"{type(e).__name__}: {e}".strip())
+
+def reap_abandoned_jobs():
+  """
+  Jobs still running after JOB_LOCK_TIMEOUT count as a failed attempt.
+  """
+  with get_connection(autocommit=True) as connection, connection.cursor() as cur:
+    cur.execute(
+      """
+      UPDATE job
+      SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+          finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+          last_error = 'abandoned by ' || locked_by,
+          locked_by = NULL,
+          locked_at = NULL
+      WHERE status = 'running'
+        AND locked_at < now() - make_interval(secs => %s)
+      """,
+      (JOB_LOCK_TIMEOUT,),
+    )
+    return cur.rowcount
+
+def _listen():
+  connection = psycopg2.connect(**DB_CONFIG)
+  connection.autocommit = True
+  with connection.cursor() as cur:
+    cur.execute(f"LISTEN {JOB_CHANNEL}")
+  return connection
+
+def _wait_for_jobs(listener):
+  """
+  Sleeps until a job is queued or JOB_POLL_SECONDS pass. Returns the
+  listener to use next time (None if it broke; polling still works).
+  """
+  if listener is None:
+    try:
+      listener = _listen()
+    except psycopg2.Error:
+      time.sleep(JOB_POLL_SECONDS)
+      return None
+
+  try:
+    if select.select([listener], [], [], JOB_POLL_SECONDS)[0]:
+      listener.poll()
+      listener.notifies.clear()
+    return listener
+  except (OSError, psycopg2.Error):
+    listener.close()
+    return None
+
+def work(stopping):
+  """
+  One worker process: claims and runs jobs until stopping is set.
+  """
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  worker_id = f"{socket.gethostname()}:{os.getpid()}"
+  init_pool(1, 2)
+  listener = None
+  next_reap = 0
+  try:
+    while not stopping.is_set():
+      try:
+        if time.monotonic() >= next_reap:
+          reap_abandoned_jobs()
+          next_reap = time.monotonic() + REAP_INTERVAL
+        job = claim_job(worker_id)
+        if job is None:
+          listener = _wait_for_jobs(listener)
+          continue
+        # If recording the outcome fails too, the reaper requeues the job
+        status = run_job(job)
+      except psycopg2.Error as e:
+        print(f"[{worker_id}] database unavailable: {e}".strip(), flush=True)
+        time.sleep(JOB_POLL_SECONDS)
+        continue
+      print(f"[{worker_id}] job {job[0]} ({job[1]}) attempt {job[3]}: {status}", flush=True)
+  finally:
+    if listener is not None:
+      listener.close()
+    close_pool()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Run queued background jobs.")
+  parser.add_argument('--processes', type=int, default=WORKER_PROCESSES)
+  args = parser.parse_args(argv)
+
+  stopping = multiprocessing.Event()
+  workers = [
+    multiprocessing.Process(target=work, args=(stopping,), name=f"worker-{i}")
+    for i in range(args.processes)
+  ]
+  for process in workers:
+    process.start()
+  print(f"Started {args.processes} job workers, Ctrl-C to stop")
+
+  signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+  try:
+    while not stopping.is_set() and any(p.is_alive() for p in workers):
+      stopping.wait(1)
+  except KeyboardInterrupt:
+    pass
+  # Workers finish the job in hand first
+  stopping.set()
+  for process in workers:
+    process.join()
+  return 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,67 @@
+from datetime import date
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+from app.database import DB_CONFIG
+from app.payments import post_settlement_rows
+
+
+@pytest.fixture
+def cur():
+  try:
+    connection = psycopg2.connect(**DB_CONFIG)
+  except psycopg2.OperationalError as e:
+    pytest.skip(f"database not reachable: {e}")
+  try:
+    with connection.cursor() as cur:
+      yield cur
+  finally:
+    # Nothing a test posts is kept
+    connection.rollback()
+    connection.close()
+
+def create_invoice(cur, total_amount):
+  cur.execute("INSERT INTO member (full_name, date_of_birth) VALUES ('Settlement Test', '1990-01-01') RETURNING member_id")
+  member_id = cur.fetchone()[0]
+  cur.execute("INSERT INTO invoice (member_id, total_amount) VALUES (%s, %s) RETURNING invoice_id", (member_id, total_amount))
+  return cur.fetchone()[0]
+
+def post(cur, lines):
+  rows = [(line_no, invoice_id, Decimal(amount), 'card', date.today())
+          for line_no, (invoice_id, amount) in enumerate(lines, start=2)]
+  return {line_no: reason for line_no, _, _, _, reason in post_settlement_rows(cur, rows)}
+
+def remaining(cur, invoice_id):
+  cur.execute("SELECT remaining FROM invoice WHERE invoice_id = %s", (invoice_id,))
+  return cur.fetchone()[0]
+
+
+def test_oversized_line_in_the_middle_of_a_group(cur):
+  invoice_id = create_invoice(cur, '100.00')
+  report = post(cur, [(invoice_id, '60.00'), (invoice_id, '60.00'), (invoice_id, '40.00')])
+  assert report == {2: None, 3: 'exceeds remaining balance', 4: None}
+  assert remaining(cur, invoice_id) == Decimal('0.00')
+
+def test_oversized_first_line_leaves_the_balance_for_the_next(cur):
+  invoice_id = create_invoice(cur, '100.00')
+  report = post(cur, [(invoice_id, '600.00'), (invoice_id, '10.00')])
+  assert report == {2: 'exceeds remaining balance', 3: None}
+  assert remaining(cur, invoice_id) == Decimal('90.00')
+
+def test_invoices_are_walked_separately(cur):
+  first = create_invoice(cur, '50.00')
+  second = create_invoice(cur, '20.00')
+  report = post(cur, [(first, '30.00'), (second, '25.00'), (first, '30.00'), (second, '20.00'), (first, '20.00')])
+  assert report == {2: None, 3: 'exceeds remaining balance', 4: 'exceeds remaining balance', 5: None, 6: None}
+  assert remaining(cur, first) == Decimal('0.00')
+  assert remaining(cur, second) == Decimal('0.00')
+
+def test_unknown_and_cancelled_invoices_are_rejected(cur):
+  invoice_id = create_invoice(cur, '100.00')
+  cur.execute("UPDATE invoice SET status = 'cancelled' WHERE invoice_id = %s", (invoice_id,))
+  cur.execute("SELECT COALESCE(MAX(invoice_id), 0) + 1 FROM invoice")
+  missing = cur.fetchone()[0]
+  report = post(cur, [(invoice_id, '10.00'), (missing, '10.00')])
+  assert report == {2: 'invoice is cancelled', 3: 'invoice does not exist'}